@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Asyncio interface to the LIMS (Python 3.7+ only).
+
+Requests are still made by the synchronous client, but on a bounded
+pool of threads sharing its connection pool and limiter, so coroutines
+can fan out hundreds of lookups without blocking the event loop.
+
+Entities are returned fully fetched: accessing e.g. `sample.udf` on a
+lazy entity would otherwise make a blocking request inside the loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from cglims import api
+
+# stops iterating a generator in the executor
+_DONE = object()
+
+
+class AsyncClinicalLims(object):
+
+    def __init__(self, lims_api, max_concurrency=16):
+        """Wrap a `ClinicalLims` client.
+
+        Args:
+            lims_api (ClinicalLims): client to issue requests through
+            max_concurrency (int): max blocking calls running at a time
+        """
+        self.lims = lims_api
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+
+    @classmethod
+    def connect(cls, config, max_concurrency=16):
+        """Connect like `api.connect` and wrap the client."""
+        return cls(api.connect(config), max_concurrency=max_concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call in the executor."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor,
+                                              functools.partial(func, *args, **kwargs))
+
+    def _fetched(self, func):
+        """Wrap a call returning entities so they are batch retrieved too."""
+        def fetch(*args, **kwargs):
+            instances = func(*args, **kwargs)
+            for instances_chunk in api.chunks(instances, api.QUERY_CHUNK):
+                self.lims.get_batch(instances_chunk)
+            return instances
+        return fetch
+
+    async def case(self, customer, family_id):
+        """Get all samples in a case."""
+        return await self._run(self._fetched(self.lims.case), customer, family_id)
+
+    async def sample(self, lims_id, is_cgid=False):
+        """Get a unique sample."""
+        def fetch():
+            lims_sample = self.lims.sample(lims_id, is_cgid=is_cgid)
+            if lims_sample is not None:
+                lims_sample.get()
+            return lims_sample
+        return await self._run(fetch)
+
+    async def get_artifacts(self, **filters):
+        """Get artifacts, see `Lims.get_artifacts` for filters."""
+        return await self._run(self._fetched(self.lims.get_artifacts), **filters)
+
+    async def get_batch(self, instances, force=False):
+        """Batch retrieve entities."""
+        return await self._run(self.lims.get_batch, instances, force=force)
+
+    async def is_delivered(self, lims_id):
+        """Get the delivery date of a sample or None."""
+        return await self._run(self.lims.is_delivered, lims_id)
+
+    async def get_received_date(self, lims_id):
+        """Get the date a sample arrived."""
+        return await self._run(self.lims.get_received_date, lims_id)
+
+    async def samplesheet(self, flowcell):
+        """Yield the samplesheet rows of a flowcell."""
+        rows = self.lims.samplesheet(flowcell)
+        while True:
+            row = await self._run(next, rows, _DONE)
+            if row is _DONE:
+                break
+            yield row
+
+    def close(self):
+        """Shut down the worker threads."""
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
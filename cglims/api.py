@@ -1,33 +1,129 @@
 # -*- coding: utf-8 -*-
+import atexit
+from contextlib import contextmanager
 from copy import deepcopy
+import logging
+from multiprocessing.pool import ThreadPool
 import re
+import threading
+from xml.etree import ElementTree
 
 from dateutil.parser import parse as parse_date
-from genologics.entities import Sample
-from genologics.lims import Lims
+from genologics.constants import nsmap
+from genologics.entities import Artifact, Entity, Processtype, Sample
+from genologics.lims import Lims, TIMEOUT
+from requests.exceptions import HTTPError
 
+from cglims import cassette, hedge, limiter, store, xmlstream
 from cglims.apptag import ApplicationTag
-from cglims.constants import READS_PER_1X, SEX_MAP
-from cglims.exc import MultipleSamplesError
+from cglims.constants import (DEFAULT_CACHE_DIR, DELIVERY_TYPE, READS_PER_1X, RECEIVED_UDF,
+                              RECEPTION_CONTROL, SEX_MAP)
+from cglims.exc import (LimsCaseIdNotFoundError, LimsSampleNotFoundError,
+                        MissingLimsDataException, MultipleSamplesError)
 
 SAMPLE_REF = 'hg19'
+REPLAY_HOST = 'http://replay.invalid'
+XML_HEADERS = {'content-type': 'application/xml', 'accept': 'application/xml'}
+# how many values to send in a single list query to keep URLs short
+QUERY_CHUNK = 100
+# entities supported by the batch endpoints
+BATCH_TAGS = ('artifact', 'container', 'file', 'sample')
+# concurrent requests for entities without a batch endpoint
+FETCH_JOBS = 8
+
+log = logging.getLogger(__name__)
+
+
+def chunks(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def unique_entities(entities):
+    """Drop duplicate (and missing) entities, keeping the order."""
+    seen = set()
+    unique = []
+    for entity in entities:
+        if entity is not None and entity.uri not in seen:
+            seen.add(entity.uri)
+            unique.append(entity)
+    return unique
+
+
+def entity_uri(entity):
+    """URI of an entity without e.g. the state of an artifact."""
+    return entity.uri.split('?', 1)[0]
+
+
+def related_entities(value):
+    """Collect the entities in the value of a relation.
+
+    Handles single entities, lists and tuples (e.g. `location`) and dicts
+    (e.g. `placements`).
+    """
+    if value is None:
+        return []
+    elif isinstance(value, Entity):
+        return [value]
+    elif isinstance(value, dict):
+        value = value.values()
+    return [item for item in value if isinstance(item, Entity)]
+
 
 def connect(config):
     """Connect and return API reference."""
-    api = ClinicalLims(config['host'], config['username'], config['password'])
+    cassette_opts = config.get('cassette') or {}
+    if cassette_opts.get('replay'):
+        # recorded traffic doesn't depend on the host so no config is needed
+        api = ClinicalLims(config.get('host', REPLAY_HOST), config.get('username', ''),
+                           config.get('password', ''))
+    else:
+        api = ClinicalLims(config['host'], config['username'], config['password'])
+    cassette.install(api, **cassette_opts)
+    api.limiter = limiter.install(api, **(config.get('limiter') or {}))
+    if 'hedge' in config and not (cassette_opts.get('record') or cassette_opts.get('replay')):
+        # duplicates go through the limiter as well, a bare 'hedge:' uses defaults
+        api.hedger = hedge.install(api, **(config['hedge'] or {}))
+    if config.get('cached'):
+        # outermost so cached responses don't wait for the limiter
+        store.install(api, store.store_path(config.get('cache_dir', DEFAULT_CACHE_DIR)),
+                      ttl=config.get('cache_ttl', store.CACHE_TTL))
+    if config.get('profile'):
+        atexit.register(log_profile, api)
     return api
 
 
+def log_profile(lims_api):
+    """Log statistics about the requests sent to the LIMS."""
+    for section, stats in sorted(lims_api.profile().items()):
+        stats_str = ' '.join("{}={}".format(key, value) for key, value in
+                             sorted(stats.items()))
+        log.info("profile %s: %s", section, stats_str)
+
+
 class ClinicalSample(object):
 
+    # fields always exported, see `to_dict`
+    MINIMAL_FIELDS = ('id', 'sample_id', 'name', 'project_name', 'project_id', 'case_id')
+    # fields exported unless asked for minimal information
+    EXTENDED_FIELDS = ('date_received', 'sex', 'reads', 'expected_reads', 'is_human',
+                       'sequencing_type', 'is_external', 'pipeline', 'is_production',
+                       'panels')
+
     def __init__(self, lims_sample):
         """ Wrapper around the genologics Sample class
 
+        Fields (see `field`) are only computed when asked for and then
+        remembered, so looking up a single field costs just the requests
+        it depends on.
+
         Args:
             lims_sample (genologics.Sample): the sample instance to extend
         """
         self.lims = lims_sample
-        self._apptag = ApplicationTag(self.lims.udf['Sequencing Analysis'])
+        self._apptag = None
+        self._fields = {}
 
     @property
     def apptag(self):
@@ -35,6 +131,8 @@ class ClinicalSample(object):
 
         Returns: ApplicationTag.
         """
+        if self._apptag is None:
+            self._apptag = ApplicationTag(self.lims.udf['Sequencing Analysis'])
         return self._apptag
 
     @property
@@ -86,40 +184,70 @@ class ClinicalSample(object):
         """Get the official sample id."""
         return self.udf('Clinical Genomics ID') or self.lims.id
 
-    def to_dict(self, minimal=False):
-        """Export data from the sample object."""
+    @property
+    def case_id(self):
+        """Get the case id: "<customer>-<familyID>" or 'NA'."""
         if self.udf('customer') and self.udf('familyID'):
-            case_id = '-'.join([self.udf('customer'), self.udf('familyID')])
-        else:
-            case_id = 'NA'
+            return '-'.join([self.udf('customer'), self.udf('familyID')])
+        return 'NA'
+
+    @property
+    def panels(self):
+        """Get the gene panels ordered for the sample."""
+        return self.udf('Gene List').split(';') if self.udf('Gene List') else None
+
+    def field(self, key):
+        """Get a single exported field: a derived value or else a UDF.
+
+        Raises:
+            KeyError: if the sample has no such field
+        """
+        if key not in self._fields:
+            getter = FIELD_GETTERS.get(key)
+            self._fields[key] = getter(self) if getter else self.lims.udf[key]
+        return self._fields[key]
+
+    def __getitem__(self, key):
+        return self.field(key)
+
+    def __contains__(self, key):
+        return key in FIELD_GETTERS or key in self.lims.udf
 
+    def get(self, key, default=None):
+        """Get a single exported field or a default."""
+        return self.field(key) if key in self else default
+
+    def to_dict(self, minimal=False):
+        """Export data from the sample object."""
         data = deepcopy(self.lims.udf._lookup)
-        data.update(dict(
-            id=self.lims.id,
-            # general sample id if imported from old TSL
-            sample_id=self.sample_id,
-            name=self.lims.name,
-            project_name=self.lims.project.name,
-            project_id=self.lims.project.id,
-            case_id=case_id,
-        ))
-
-        if not minimal:
-            data.update(dict(
-                date_received=parse_date(self.lims.date_received),
-                sex=self.sex,
-                reads=self.ordered_reads,
-                expected_reads=self.expected_reads,
-                is_human=self.apptag.is_human,
-                sequencing_type=self.apptag.sequencing_type,
-                is_external=self.apptag.is_external,
-                pipeline=self.pipeline or 'NA',
-                is_production=(False if data['customer'] == 'cust000' else True),
-                panels=(self.udf('Gene List').split(';') if self.udf('Gene List') else None),
-            ))
+        keys = self.MINIMAL_FIELDS if minimal else self.MINIMAL_FIELDS + self.EXTENDED_FIELDS
+        data.update((key, self.field(key)) for key in keys)
         return data
 
 
+# how to compute each derived field of a `ClinicalSample`
+FIELD_GETTERS = {
+    'id': lambda sample: sample.lims.id,
+    # general sample id if imported from old TSL
+    'sample_id': lambda sample: sample.sample_id,
+    'name': lambda sample: sample.lims.name,
+    'project_name': lambda sample: sample.lims.project.name,
+    # the id is part of the project link, no need to fetch the project
+    'project_id': lambda sample: sample.lims.project.id,
+    'case_id': lambda sample: sample.case_id,
+    'date_received': lambda sample: parse_date(sample.lims.date_received),
+    'sex': lambda sample: sample.sex,
+    'reads': lambda sample: sample.ordered_reads,
+    'expected_reads': lambda sample: sample.expected_reads,
+    'is_human': lambda sample: sample.apptag.is_human,
+    'sequencing_type': lambda sample: sample.apptag.sequencing_type,
+    'is_external': lambda sample: sample.apptag.is_external,
+    'pipeline': lambda sample: sample.pipeline or 'NA',
+    'is_production': lambda sample: sample.lims.udf['customer'] != 'cust000',
+    'panels': lambda sample: sample.panels,
+}
+
+
 class SamplesheetHandler(object):
 
     def _get_placement_lane(self, lane):
@@ -165,36 +293,314 @@ class SamplesheetHandler(object):
 
         return artifacts
 
-    def samplesheet(self, flowcell):
+    def flowcell_samples(self, flowcell):
+        """Yield (lane, artifact, sample) for each library on a flowcell."""
         containers = self.get_containers(name=flowcell)
 
         if containers:
             container = containers[-1] # only take the last one. See ÖA#217.
+            # load the libraries of all lanes (and pools) at once
+            self.load_related([container], 'placements.samples.project',
+                              'placements.parent_process', 'placements.input_artifact_list')
             raw_lanes = sorted(container.placements.keys())
             for raw_lane in raw_lanes:
                 lane = self._get_placement_lane(raw_lane)
                 placement_artifact = container.placements[raw_lane]
                 for artifact in self._get_non_pooled_artifacts(placement_artifact):
                     sample = artifact.samples[0] # we are assured it only has one sample
-                    label = self._get_reagent_label(artifact)
-                    index = self._get_index(label)
-                    yield {
-                        'fcid': flowcell,
-                        'lane': lane,
-                        'sample_id': sample.id,
-                        'sample_ref': SAMPLE_REF,
-                        'index': index,
-                        'description': '',
-                        'sample_name': sample.project.name,
-                        'control': 'N',
-                        'recipe': 'R1',
-                        'operator': 'script',
-                        'project': sample.project.name
-                    }
+                    yield lane, artifact, sample
+
+    def samplesheet(self, flowcell):
+        for lane, artifact, sample in self.flowcell_samples(flowcell):
+            label = self._get_reagent_label(artifact)
+            index = self._get_index(label)
+            yield {
+                'fcid': flowcell,
+                'lane': lane,
+                'sample_id': sample.id,
+                'sample_ref': SAMPLE_REF,
+                'index': index,
+                'description': '',
+                'sample_name': sample.project.name,
+                'control': 'N',
+                'recipe': 'R1',
+                'operator': 'script',
+                'project': sample.project.name
+            }
 
 
 class ClinicalLims(Lims, SamplesheetHandler):
 
+    # shared limit on concurrent requests, see `cglims.limiter`
+    limiter = None
+    # duplicates slow GET requests, see `cglims.hedge`
+    hedger = None
+    # persistent cache of responses, see `cglims.store`
+    store = None
+    store_read = False
+
+    def __init__(self, *args, **kwargs):
+        super(ClinicalLims, self).__init__(*args, **kwargs)
+        # upstream only uses the large connection pool for plain HTTP
+        self.request_session.mount('https://', self.adapter)
+        self._process_type_names = {}
+        self._local = threading.local()
+
+    def profile(self):
+        """Collect statistics about the requests sent so far."""
+        data = {}
+        if self.limiter:
+            data['limiter'] = self.limiter.stats()
+        if self.hedger:
+            data['hedge'] = self.hedger.stats()
+        if self.store:
+            data['store'] = dict(self.store.stats)
+        return data
+
+    def get(self, uri, params=dict()):
+        """GET XML, recording the entity if it's read within `recording`."""
+        if not params and store.uri_kind(uri) != 'query':
+            used = getattr(self._local, 'used', None)
+            if used is not None:
+                used.add(uri.split('?', 1)[0])
+        return super(ClinicalLims, self).get(uri, params=params)
+
+    def put(self, uri, data, params=dict()):
+        """PUT XML through the shared session (unlike upstream genologics)."""
+        response = self.request_session.put(uri, data=data, params=params,
+                                            auth=(self.username, self.password),
+                                            headers=XML_HEADERS)
+        return self.parse_response(response)
+
+    def post(self, uri, data, params=dict()):
+        """POST XML through the shared session (unlike upstream genologics)."""
+        response = self.request_session.post(uri, data=data, params=params,
+                                             auth=(self.username, self.password),
+                                             headers=XML_HEADERS)
+        return self.parse_response(response, accept_status_codes=[200, 201, 202])
+
+    def iter_instances(self, klass, params=None, prefetch=True, resolve=False):
+        """Lazily yield the entities of a list query page by page.
+
+        Args:
+            klass: entity class to list, e.g. `Sample`
+            params (Optional[dict]): query parameters
+            prefetch (Optional[bool]): fetch the next page in the background
+                                       while the current page is processed
+            resolve (Optional[bool]): batch retrieve each page's entities
+        """
+        params = params or {}
+        pool = ThreadPool(1) if prefetch else None
+        try:
+            uri = self.get_uri(klass._URI)
+            instances, next_uri = self._fetch_page(klass, uri, params, resolve)
+            while True:
+                if next_uri and pool:
+                    pending = pool.apply_async(self._fetch_page,
+                                               (klass, next_uri, params, resolve))
+                for instance in instances:
+                    yield instance
+                if next_uri is None:
+                    break
+                elif pool:
+                    instances, next_uri = pending.get()
+                else:
+                    instances, next_uri = self._fetch_page(klass, next_uri, params, resolve)
+        finally:
+            if pool:
+                pool.terminate()
+
+    def _fetch_page(self, klass, uri, params, resolve=False, info=None):
+        """Fetch one page of a list query and the link to the next page.
+
+        The response is parsed incrementally so only the entity links are
+        kept in memory, not the whole document.
+
+        Args:
+            info (Optional[list]): collect additional info about entities
+        """
+        tag = klass._TAG or klass.__name__.lower()
+        response = self._stream('GET', uri, params=params)
+        instances = []
+        next_uri = None
+        for node in xmlstream.iter_children(response):
+            if node.tag == tag:
+                instances.append(klass(self, uri=node.attrib['uri']))
+                if info is not None:
+                    # same (odd) format as upstream genologics
+                    info_dict = {attrib_key: node.attrib['uri'] for attrib_key in node.attrib}
+                    info_dict.update((subnode.tag, subnode.text) for subnode in node)
+                    info.append(info_dict)
+            elif node.tag == 'next-page':
+                next_uri = node.attrib['uri']
+        if resolve:
+            self.get_batch(instances)
+        return instances, next_uri
+
+    def _get_instances(self, klass, add_info=None, params=dict()):
+        """List entities, parsing each page incrementally."""
+        results = []
+        info = [] if add_info else None
+        instances, next_uri = self._fetch_page(klass, self.get_uri(klass._URI), params,
+                                               info=info)
+        results.extend(instances)
+        # a given start index means a single page was requested
+        while next_uri and params.get('start-index') is None:
+            instances, next_uri = self._fetch_page(klass, next_uri, params, info=info)
+            results.extend(instances)
+        if add_info:
+            return results, info
+        return results
+
+    def get_batch(self, instances, force=False):
+        """Batch retrieve entities, parsing the response incrementally.
+
+        Works like `Lims.get_batch` but assigns each entity its XML as soon
+        as it has been parsed instead of building the full document first.
+        """
+        if not instances:
+            return []
+
+        if instances[0]._TAG not in BATCH_TAGS:
+            raise TypeError("Cannot retrieve batch for instances of type '{}'"
+                            .format(instances[0]._TAG))
+
+        links = ElementTree.Element(nsmap('ri:links'))
+        instance_map = {}
+        for instance in instances:
+            instance_map[instance.id] = instance
+            if not force and instance.root is None and self.store_read:
+                content = self.store.get(instance.uri)
+                if content is not None:
+                    self.store.stats['hits'] += 1
+                    instance.root = ElementTree.fromstring(content)
+            if force or instance.root is None:
+                ElementTree.SubElement(links, 'link', dict(uri=instance.uri,
+                                                           rel=instance.__class__._URI))
+
+        if len(links):
+            uri = self.get_uri(instances[0].__class__._URI, 'batch/retrieve')
+            data = self.tostring(ElementTree.ElementTree(links))
+            response = self._stream('POST', uri, data=data,
+                                    accept_status_codes=(200, 201, 202))
+            fetched = []
+            for node in xmlstream.iter_children(response):
+                instance = instance_map[node.attrib['limsid']]
+                instance.root = node
+                if self.store:
+                    fetched.append((instance.uri, ElementTree.tostring(node)))
+            if fetched:
+                # store each entity under its own URI to serve single GETs too
+                self.store.stats['misses'] += len(fetched)
+                self.store.set_many(fetched)
+        return list(instance_map.values())
+
+    def put_batch(self, instances):
+        """Update entities with batch update requests of `QUERY_CHUNK` each."""
+        for instances_chunk in chunks(instances, QUERY_CHUNK):
+            super(ClinicalLims, self).put_batch(instances_chunk)
+            if self.store:
+                for instance in instances_chunk:
+                    self.store.delete(instance.uri, unindex=False)
+                # batch updates only answer with links, index what was sent
+                self.store.index_samples(
+                    self.tostring(ElementTree.ElementTree(instance.root))
+                    for instance in instances_chunk if instance._TAG == 'sample')
+
+    def fetch(self, entities, force=False):
+        """Fetch entities not yet fetched (or all if `force`).
+
+        Entities are batch retrieved where the LIMS supports it and
+        otherwise fetched concurrently.
+        """
+        self._record_used(entities)
+        pending = {}
+        for entity in entities:
+            if force or entity.root is None:
+                pending.setdefault(entity.__class__, []).append(entity)
+
+        concurrent = []
+        for klass, klass_entities in pending.items():
+            if klass._TAG in BATCH_TAGS:
+                for entities_chunk in chunks(klass_entities, QUERY_CHUNK):
+                    self.get_batch(entities_chunk, force=force)
+            else:
+                concurrent.extend(klass_entities)
+        if concurrent:
+            pool = ThreadPool(min(FETCH_JOBS, len(concurrent)))
+            try:
+                pool.map(lambda entity: entity.get(force=force), concurrent)
+            finally:
+                pool.terminate()
+        return entities
+
+    def load_related(self, entities, *paths):
+        """Load entities and what they relate to, level by level.
+
+        Each path lists attributes separated by dots, e.g.
+        'parent_process.type' for artifacts. Attributes may hold entities,
+        lists or dicts of entities (e.g. 'placements') or be methods
+        without arguments (e.g. 'input_artifact_list'). For samples,
+        'artifacts' are looked up with list queries. Every level is
+        loaded for all entities at once, so a path costs round trips in
+        proportion to its depth rather than the number of entities.
+
+        Returns:
+            list: the (now fetched) entities
+        """
+        entities = self.fetch(list(entities))
+        levels = {}
+        for path in paths:
+            level = entities
+            attributes = path.split('.')
+            for depth, attribute in enumerate(attributes, start=1):
+                prefix = '.'.join(attributes[:depth])
+                if prefix not in levels:
+                    related = self._related(level, attribute)
+                    levels[prefix] = self.fetch(unique_entities(related))
+                level = levels[prefix]
+        return entities
+
+    def _related(self, entities, attribute):
+        """Collect the entities related to others through an attribute."""
+        if attribute == 'artifacts' and all(isinstance(entity, Sample) for entity in entities):
+            artifacts = []
+            sample_ids = sorted(lims_sample.id for lims_sample in entities)
+            for ids_chunk in chunks(sample_ids, QUERY_CHUNK):
+                artifacts.extend(self.get_artifacts(samplelimsid=ids_chunk))
+            return artifacts
+
+        related = []
+        for entity in entities:
+            value = getattr(entity, attribute)
+            if callable(value):
+                value = value()
+            related.extend(related_entities(value))
+        return related
+
+    def _stream(self, method, uri, params=None, data=None, accept_status_codes=(200,)):
+        """Send a request without reading the response body up front."""
+        response = self.request_session.request(method, uri, params=params, data=data,
+                                                auth=(self.username, self.password),
+                                                headers=XML_HEADERS, timeout=TIMEOUT,
+                                                stream=True)
+        self.validate_response(response, accept_status_codes=list(accept_status_codes))
+        return response
+
+    def iter_samples(self, udf=None, prefetch=True, resolve=False, **filters):
+        """Lazily iterate over samples, see `get_samples` for filters."""
+        params = self._get_params(**filters)
+        params.update(self._get_params_udf(udf=udf or {}))
+        return self.iter_instances(Sample, params=params, prefetch=prefetch,
+                                   resolve=resolve)
+
+    def iter_artifacts(self, udf=None, prefetch=True, resolve=False, **filters):
+        """Lazily iterate over artifacts, see `get_artifacts` for filters."""
+        params = self._get_params(**filters)
+        params.update(self._get_params_udf(udf=udf or {}))
+        return self.iter_instances(Artifact, params=params, prefetch=prefetch,
+                                   resolve=resolve)
+
     def case(self, customer, family_id):
         filters = {'customer': customer, 'familyID': family_id}
         samples = self.get_samples(udf=filters)
@@ -219,6 +625,140 @@ class ClinicalLims(Lims, SamplesheetHandler):
 
         return lims_sample
 
+    def resolve_samples(self, identifiers, external=False):
+        """Resolve many sample identifiers with grouped LIMS queries.
+
+        Identifiers are interpreted like in `cglims get`: case ids
+        ("<customer>-<family>"), Clinical Genomics ids (starting with a
+        digit), customer sample names (if `external`) or LIMS ids.
+
+        Returns:
+            dict: identifier -> list of (fully fetched) samples, or the
+                  exception explaining why it couldn't be resolved
+        """
+        results = {}
+        cases, cgids, names, lims_ids = {}, [], [], []
+        for identifier in set(identifiers):
+            if external:
+                names.append(identifier)
+            elif identifier.startswith('cust'):
+                if '-' not in identifier:
+                    message = "'{}' isn't a case id: <customer>-<family>".format(identifier)
+                    results[identifier] = LimsCaseIdNotFoundError(message)
+                    continue
+                customer, family_id = identifier.split('-', 1)
+                cases.setdefault(customer, []).append(family_id)
+            elif identifier[0].isdigit():
+                cgids.append(identifier)
+            else:
+                lims_ids.append(identifier)
+
+        for customer, family_ids in cases.items():
+            matches = self._group_samples('familyID', family_ids, udf={'customer': customer})
+            for family_id in family_ids:
+                case_id = '-'.join([customer, family_id])
+                if matches.get(family_id):
+                    results[case_id] = matches[family_id]
+                else:
+                    results[case_id] = LimsCaseIdNotFoundError(case_id)
+
+        cgid_key = 'Clinical Genomics ID'
+        matches = self._group_samples(cgid_key, cgids)
+        for cgid in cgids:
+            lims_samples = matches.get(cgid, [])
+            if len(lims_samples) > 1:
+                matches_str = ', '.join(sample.id for sample in lims_samples)
+                message = "'{}' matches: {}".format(cgid, matches_str)
+                results[cgid] = MultipleSamplesError(message)
+            elif lims_samples:
+                results[cgid] = lims_samples
+            else:
+                results[cgid] = LimsSampleNotFoundError(cgid)
+
+        matches = self._group_samples('name', names)
+        for name in names:
+            results[name] = matches.get(name) or LimsSampleNotFoundError(name)
+
+        for ids_chunk in chunks(sorted(lims_ids), QUERY_CHUNK):
+            lims_samples = [Sample(self, id=lims_id) for lims_id in ids_chunk]
+            try:
+                self.get_batch(lims_samples)
+            except HTTPError:
+                log.debug("batch retrieve failed, fetching samples one by one")
+            for lims_sample in lims_samples:
+                try:
+                    lims_sample.get()
+                    results[lims_sample.id] = [lims_sample]
+                except HTTPError as error:
+                    message = "{}: {}".format(lims_sample.id, error)
+                    results[lims_sample.id] = LimsSampleNotFoundError(message)
+
+        return results
+
+    def _group_samples(self, key, values, udf=None):
+        """Query samples matching any of the values and group them by value.
+
+        Args:
+            key (str): 'name' or the UDF to match values against
+            values (list): values to look up in chunks
+            udf (Optional[dict]): extra UDF filters
+        """
+        lims_samples = []
+        for values_chunk in chunks(sorted(values), QUERY_CHUNK):
+            if key == 'name':
+                filters = dict(name=values_chunk, udf=udf or {})
+            else:
+                sample_udf = dict(udf or {})
+                sample_udf[key] = values_chunk
+                filters = dict(udf=sample_udf)
+            lims_samples.extend(self.get_samples(**filters))
+
+        groups = {}
+        for samples_chunk in chunks(lims_samples, QUERY_CHUNK):
+            for lims_sample in self.get_batch(samples_chunk):
+                value = lims_sample.name if key == 'name' else lims_sample.udf.get(key)
+                groups.setdefault(value, []).append(lims_sample)
+        for value in groups:
+            groups[value].sort(key=lambda lims_sample: lims_sample.id)
+        return groups
+
+    def process_type_names(self, type_ids):
+        """Look up (and remember) the names of process types by id."""
+        for type_id in type_ids:
+            if type_id not in self._process_type_names:
+                self._process_type_names[type_id] = Processtype(self, id=type_id).name
+        return {type_id: self._process_type_names[type_id] for type_id in type_ids}
+
+    def get_process_artifacts(self, sample_ids, type_ids, **filters):
+        """Get the artifacts of samples produced by some process types.
+
+        Rather than listing every artifact of each sample and skipping
+        most of them, the LIMS is asked for artifacts of the given process
+        types only, for many samples per query. The artifacts and their
+        parent processes are fetched up front.
+
+        Args:
+            sample_ids (List[str]): LIMS ids of samples
+            type_ids (List[str]): ids of process types, e.g. ['669']
+            filters: more filters, see `get_artifacts`
+
+        Returns:
+            dict: sample id -> artifacts in the order they were produced
+        """
+        names = sorted(set(self.process_type_names(type_ids).values()))
+        artifacts = []
+        for ids_chunk in chunks(sorted(set(sample_ids)), QUERY_CHUNK):
+            artifacts.extend(self.get_artifacts(samplelimsid=ids_chunk, process_type=names,
+                                                **filters))
+        artifacts = self.load_related(unique_entities(artifacts), 'parent_process')
+
+        results = {sample_id: [] for sample_id in sample_ids}
+        for artifact in sorted(artifacts, key=production_order):
+            for lims_sample in artifact.samples:
+                if lims_sample.id in results:
+                    results[lims_sample.id].append(artifact)
+        return results
+
     def is_delivered(self, lims_id):
         """Check if a sample has been delivered."""
         filters = dict(samplelimsid=lims_id, type="Analyte",
@@ -229,19 +769,78 @@ class ClinicalLims(Lims, SamplesheetHandler):
         else:
             return None
 
-    def process_samples(lims_process):
-        """Retrieve LIMS input samples from a process."""
-        for artifact in lims_process.all_inputs():
+    def delivery_dates(self, sample_ids):
+        """Check if many samples have been delivered, see `is_delivered`.
+
+        Returns:
+            dict: sample id -> date delivered, None or the error if the
+                  delivery process has no date
+        """
+        results = self.get_process_artifacts(sample_ids, [DELIVERY_TYPE], type='Analyte')
+        dates = {}
+        for sample_id, artifacts in results.items():
+            if not artifacts:
+                dates[sample_id] = None
+                continue
+            delivered = artifacts[0].parent_process.udf.get('Date delivered')
+            dates[sample_id] = (MissingLimsDataException('Date delivered') if delivered is None
+                                else delivered)
+        return dates
+
+    def process_samples(self, lims_process):
+        """Retrieve LIMS input samples from a process.
+
+        All input artifacts and then all their samples are batch retrieved
+        rather than fetched one by one.
+
+        Yields:
+            dict: 'sample' and the input 'artifact' it's part of
+        """
+        # the LIMS input order, `all_inputs` would drop duplicates through a set
+        artifacts = unique_entities(lims_process.all_inputs(unique=False))
+        self.load_related(artifacts, 'samples')
+
+        for artifact in artifacts:
             for lims_sample in artifact.samples:
                 yield {'sample': lims_sample, 'artifact': artifact}
 
     def get_received_date(self, lims_id):
-        lims_artifacts = self.get_artifacts(process_type='CG002 - Reception Control',
+        lims_artifacts = self.get_artifacts(process_type=RECEPTION_CONTROL,
                                             samplelimsid=lims_id)
         for artifact in lims_artifacts:
-            udf_key = 'date arrived at clinical genomics'
-            if artifact.parent_process and artifact.parent_process.udf.get(udf_key):
-                return artifact.parent_process.udf.get(udf_key)
+            self._record_used([artifact, artifact.parent_process])
+            if artifact.parent_process and artifact.parent_process.udf.get(RECEIVED_UDF):
+                return artifact.parent_process.udf.get(RECEIVED_UDF)
+
+    @contextmanager
+    def recording(self):
+        """Record which entities are read from within the block.
+
+        Entities are recorded when they are fetched, including those
+        already fetched before, and when they are lazily loaded, in the
+        current thread.
+
+        Yields:
+            set: URIs of the entities, see `entity_uri`
+        """
+        self._local.used = set()
+        try:
+            yield self._local.used
+        finally:
+            self._local.used = None
+
+    def _record_used(self, entities):
+        used = getattr(self._local, 'used', None)
+        if used is not None:
+            used.update(entity_uri(entity) for entity in entities if entity is not None)
+
+
+def production_order(artifact):
+    """Sort key for artifacts by when their parent process was created."""
+    if artifact.parent_process is None:
+        return (0, artifact.id)
+    number = artifact.parent_process.id.rsplit('-', 1)[-1]
+    return (int(number) if number.isdigit() else 0, artifact.id)
 
 
 def deliver(lims_sample):
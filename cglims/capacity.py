@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Compare ordered reads with what fits on a flowcell."""
+from __future__ import division
+
+import logging
+import math
+
+import click
+
+from cglims import api
+from cglims.apptag import ApplicationTag
+from cglims.cli.utils import jsonify
+
+# reads a single lane is expected to produce
+LANE_CAPACITY = 400000000
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-f', '--flowcell', help='report per lane of a flowcell')
+@click.option('-s', '--samples', type=click.File('r'),
+              help='file with pending sample ids, "-" for stdin')
+@click.option('-c', '--lane-capacity', type=int, help='reads per lane')
+@click.option('-u', '--under', default=0.75,
+              help='flag lanes loaded below this fraction of the capacity')
+@click.pass_context
+def capacity(context, flowcell, samples, lane_capacity, under):
+    """Compare ordered reads with lane capacity."""
+    lane_capacity = lane_capacity or context.obj.get('lane_capacity', LANE_CAPACITY)
+    lims_api = api.connect(context.obj)
+    if flowcell:
+        lane_samples = [(lane, sample) for lane, artifact, sample in
+                        lims_api.flowcell_samples(flowcell)]
+        if not lane_samples:
+            log.error("flowcell not found: %s", flowcell)
+            context.abort()
+    elif samples:
+        sample_ids = [line.strip() for line in samples if line.strip()]
+        lane_samples = [(None, lims_api.sample(sample_id)) for sample_id in sample_ids]
+    else:
+        click.echo("you need to provide a flowcell or samples")
+        context.abort()
+
+    # fetch all samples up front instead of one by one
+    lims_samples = [lims_sample for lane, lims_sample in lane_samples]
+    for samples_chunk in api.chunks(lims_samples, api.QUERY_CHUNK):
+        lims_api.get_batch(samples_chunk)
+    lane_tags = [(lane, lims_sample.id, lims_sample.udf.get('Sequencing Analysis'))
+                 for lane, lims_sample in lane_samples]
+
+    report = capacity_report(lane_tags, lane_capacity, under=under)
+    if flowcell:
+        report['flowcell'] = flowcell
+    click.echo(jsonify(report, pretty=True))
+
+
+def capacity_report(lane_tags, lane_capacity, under=0.75):
+    """Sum up ordered reads per lane and compare with the capacity.
+
+    Args:
+        lane_tags (List[tuple]): lane (or None if pending), sample id, app tag
+        lane_capacity (int): reads per lane
+        under (float): fraction of capacity below which a lane is under-loaded
+    """
+    tag_reads = {}
+    lanes = {}
+    errors = []
+    # the reads of a sample on several lanes are split between them
+    sample_lanes = {}
+    for lane, sample_id, raw_tag in set(lane_tags):
+        sample_lanes[sample_id] = sample_lanes.get(sample_id, 0) + 1
+    for lane, sample_id, raw_tag in lane_tags:
+        if raw_tag not in tag_reads:
+            try:
+                tag_reads[raw_tag] = ApplicationTag(raw_tag).reads
+            except (TypeError, ValueError, IndexError) as error:
+                tag_reads[raw_tag] = None
+                log.warning("can't parse reads from app tag '%s': %s", raw_tag, error)
+        reads = tag_reads[raw_tag]
+        if reads is None:
+            error = {'sample_id': sample_id, 'app_tag': raw_tag}
+            if error not in errors:
+                errors.append(error)
+            continue
+        lane_data = lanes.setdefault(lane, {'samples': 0, 'ordered_reads': 0})
+        lane_data['samples'] += 1
+        lane_data['ordered_reads'] += reads / sample_lanes[sample_id]
+
+    report = {'lane_capacity': lane_capacity, 'lanes': [], 'errors': errors}
+    for lane, lane_data in sorted(lanes.items()):
+        load = lane_data['ordered_reads'] / lane_capacity
+        if load > 1:
+            status = 'over'
+        elif load < under:
+            status = 'under'
+        else:
+            status = 'ok'
+        lane_data.update(lane=lane, load=round(load, 3), status=status,
+                         ordered_reads=int(round(lane_data['ordered_reads'])))
+        if lane is None:
+            # pending samples: how many lanes would they need?
+            lane_data['lanes_needed'] = int(math.ceil(load))
+        report['lanes'].append(lane_data)
+    return report
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Record and replay the HTTP traffic between cglims and the LIMS.
+
+A cassette is a directory holding a single gzipped JSON lines file with
+one exchange (request + response) per line, in the order they happened.
+"""
+import atexit
+import base64
+import collections
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from six.moves.urllib.parse import urlsplit
+
+from cglims.exc import CassetteError
+
+CASSETTE_FILE = 'cassette.jsonl.gz'
+KEPT_HEADERS = ('content-type',)
+
+log = logging.getLogger(__name__)
+
+
+def request_key(method, url, body=None):
+    """Identify a request independently of the host it was sent to."""
+    parts = urlsplit(url)
+    path = "{}?{}".format(parts.path, parts.query) if parts.query else parts.path
+    if body is None:
+        digest = None
+    else:
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body).hexdigest()
+    return method.upper(), path, digest
+
+
+def encode_content(content):
+    """Store response bodies as text, falling back to base64 for binaries."""
+    try:
+        return content.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        return base64.b64encode(content).decode('ascii'), 'base64'
+
+
+def decode_content(exchange):
+    """Reverse of `encode_content`."""
+    if exchange['encoding'] == 'base64':
+        return base64.b64decode(exchange['content'])
+    return exchange['content'].encode('utf-8')
+
+
+def build_response(request, exchange):
+    """Create a requests response from a recorded exchange."""
+    response = Response()
+    response.status_code = exchange['status']
+    response.headers = CaseInsensitiveDict(exchange['headers'])
+    response.raw = io.BytesIO(decode_content(exchange))
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    response.reason = exchange.get('reason')
+    return response
+
+
+class Cassette(object):
+
+    def __init__(self, root_dir):
+        """A directory of recorded LIMS exchanges.
+
+        Args:
+            root_dir (str): directory to record to or replay from
+        """
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, CASSETTE_FILE)
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def exchanges(self):
+        """Iterate over the recorded exchanges in order."""
+        if not os.path.exists(self.path):
+            raise CassetteError("no cassette found: {}".format(self.path))
+        with gzip.open(self.path, 'rb') as handle:
+            for line in handle:
+                yield json.loads(line.decode('utf-8'))
+
+    def append(self, request, response, elapsed):
+        """Record a single exchange."""
+        content, encoding = encode_content(response.content)
+        exchange = {
+            'method': request.method,
+            'url': request.url,
+            'key': request_key(request.method, request.url, request.body),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {key: value for key, value in response.headers.items()
+                        if key.lower() in KEPT_HEADERS},
+            'content': content,
+            'encoding': encoding,
+            'elapsed': elapsed,
+        }
+        line = json.dumps(exchange, sort_keys=True) + '\n'
+        with self._lock:
+            if self._handle is None:
+                if not os.path.isdir(self.root_dir):
+                    os.makedirs(self.root_dir)
+                self._handle = gzip.open(self.path, 'wb')
+                atexit.register(self.close)
+            self._handle.write(line.encode('utf-8'))
+        return exchange
+
+    def close(self):
+        """Flush the recorded exchanges to disk."""
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+class RecordingAdapter(BaseAdapter):
+
+    """Transport adapter passing requests on to the LIMS and recording them."""
+
+    def __init__(self, cassette, adapter=None):
+        super(RecordingAdapter, self).__init__()
+        self.cassette = cassette
+        self.adapter = adapter or HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        response = self.adapter.send(request, **kwargs)
+        exchange = self.cassette.append(request, response, time.time() - start)
+        return build_response(request, exchange)
+
+    def close(self):
+        self.adapter.close()
+        self.cassette.close()
+
+
+class ReplayAdapter(BaseAdapter):
+
+    """Transport adapter serving recorded exchanges without any network.
+
+    Identical requests are answered in the order they were recorded; when
+    a request is repeated more often than during the recording the last
+    answer is served again.
+    """
+
+    def __init__(self, cassette, latency=False):
+        super(ReplayAdapter, self).__init__()
+        self.latency = latency
+        self._queues = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        for exchange in cassette.exchanges():
+            self._queues[tuple(exchange['key'])].append(exchange)
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                exchange = self._last[key] = queue.popleft()
+            elif key in self._last:
+                exchange = self._last[key]
+            else:
+                raise CassetteError("request not in cassette: {} {}"
+                                    .format(request.method, request.url))
+        if self.latency:
+            time.sleep(exchange['elapsed'])
+        return build_response(request, exchange)
+
+    def close(self):
+        pass
+
+
+def install(lims_api, record=None, replay=None, latency=False):
+    """Route all traffic of a LIMS client through a cassette."""
+    if record:
+        log.info("recording LIMS traffic to: %s", record)
+        adapter = RecordingAdapter(Cassette(record), adapter=lims_api.adapter)
+    elif replay:
+        log.info("replaying LIMS traffic from: %s", replay)
+        adapter = ReplayAdapter(Cassette(replay), latency=latency)
+    else:
+        return None
+    for prefix in ('http://', 'https://'):
+        lims_api.request_session.mount(prefix, adapter)
+    return adapter
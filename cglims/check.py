@@ -6,6 +6,7 @@ from genologics.entities import Process
 
 from cglims import api
 from cglims.apptag import ApplicationTag
+from cglims.journal import Journal
 
 RELATION_UDS = ['motherID', 'fatherID', 'Other relations']
 log = logging.getLogger(__name__)
@@ -16,17 +17,17 @@ log = logging.getLogger(__name__)
               type=click.Choice(['project', 'process']), default='project')
 @click.argument('lims_id')
 @click.pass_context
-def samples(context, source, apptags, lims_id):
+def samples(context, source, lims_id):
     """Fetch projects from the database."""
     lims = api.connect(context.obj)
     if source == 'process':
         lims_process = Process(lims, id=lims_id)
-        lims_samples = process_samples(lims_process)
+        lims_samples = lims.process_samples(lims_process)
     elif source == 'project':
         lims_samples = ({'sample': sample} for sample in
-                        lims.get_samples(projectlimsid=lims_id))
+                        lims.iter_samples(projectlimsid=lims_id))
     for lims_sample in lims_samples:
-        click.echo(lims_sample.id)
+        click.echo(lims_sample['sample'].id)
 
 
 @click.command()
@@ -36,23 +37,38 @@ def samples(context, source, apptags, lims_id):
 @click.option('-s', '--source',
               type=click.Choice(['sample', 'project', 'process']),
               default='sample')
+@click.option('--journal', type=click.Path(dir_okay=False),
+              help='record checked samples to resume from')
+@click.option('--resume', is_flag=True, help='skip samples completed in the journal')
 @click.argument('lims_id')
 @click.pass_context
-def check(context, update, version, force, source, lims_id):
+def check(context, update, version, force, source, journal, resume, lims_id):
     """Check LIMS sample or all samples in a process."""
+    if resume and not journal:
+        click.echo("'--resume' needs a '--journal'")
+        context.abort()
     lims = api.connect(context.obj)
     if source == 'sample':
         lims_samples = [{'sample': lims.sample(lims_id)}]
     elif source == 'process':
         lims_process = Process(lims, id=lims_id)
-        lims_samples = process_samples(lims_process)
+        lims_samples = lims.process_samples(lims_process)
     elif source == 'project':
         lims_samples = ({'sample': sample} for sample in
-                        lims.get_samples(projectlimsid=lims_id))
-
-    for sample in lims_samples:
-        check_sample(lims, sample['sample'], lims_artifact=sample.get('artifact'),
-                     update=update, version=version, force=force)
+                        lims.iter_samples(projectlimsid=lims_id, resolve=True))
+
+    checkpoints = Journal(journal, resume=resume) if journal else None
+    try:
+        for sample in lims_samples:
+            if checkpoints and sample['sample'].id in checkpoints:
+                continue
+            check_sample(lims, sample['sample'], lims_artifact=sample.get('artifact'),
+                         update=update, version=version, force=force)
+            if checkpoints:
+                checkpoints.record(sample['sample'].id)
+    finally:
+        if checkpoints:
+            checkpoints.close()
 
 
 def check_sample(lims, lims_sample, lims_artifact=None, update=False, version=None,
@@ -215,10 +231,3 @@ def check_familymembers(lims, lims_sample):
                 log.error("samples in 'family' not related, tumor/normal?")
                 result = False
     return result
-
-
-def process_samples(lims_process):
-    """Retrieve LIMS input samples from a process."""
-    for artifact in lims_process.all_inputs():
-        for lims_sample in artifact.samples:
-            yield {'sample': lims_sample, 'artifact': artifact}
@@ -44,9 +44,19 @@ def build_cli(title):
                   help='path to config file')
     @click.option('-d', '--database', help='path/URI of the SQL database')
     @click.option('-l', '--log-level', default='INFO')
+    @click.option('--record', type=click.Path(file_okay=False),
+                  help='record LIMS traffic to a cassette directory')
+    @click.option('--replay', type=click.Path(exists=True, file_okay=False),
+                  help='replay LIMS traffic from a cassette directory')
+    @click.option('--replay-latency', is_flag=True,
+                  help='wait as long as the recorded requests took')
+    @click.option('--profile', is_flag=True, help='log statistics about LIMS requests')
+    @click.option('--cached', is_flag=True,
+                  help='serve LIMS responses from the persistent cache (see prefetch)')
     @click.version_option(version, prog_name=title)
     @click.pass_context
-    def root(context, config, database, log_level):
+    def root(context, config, database, log_level, record, replay, replay_latency,
+             profile, cached):
         """Interact with CLI."""
         init_log(logging.getLogger(), loglevel=log_level)
         log.debug("{}: version {}".format(title, version))
@@ -60,4 +70,12 @@ def build_cli(title):
         else:
             context.obj = {}
 
+        if record and replay:
+            click.echo("can't record and replay at the same time")
+            context.abort()
+        context.obj['cassette'] = dict(record=record, replay=replay,
+                                      latency=replay_latency)
+        context.obj['profile'] = profile
+        context.obj['cached'] = cached or context.obj.get('cached', False)
+
     return root
@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
+import csv
 import logging
 
 import click
-import yaml
 
-from cglims import api
+from cglims import api, incremental
 from cglims.api import ClinicalSample
 from cglims.apptag import UnknownSequencingTypeError
-from cglims.config import make_config, CAPTUREKIT_MAP, relevant_samples
+from cglims.config import make_config, CAPTUREKIT_MAP, HYBRIDIZE_LIBRARY, relevant_samples
+from cglims.indexes import check_indexes
 from cglims.pedigree import make_pedigree
 from cglims.panels import convert_panels
-from .utils import jsonify, fix_dump
+from .utils import jsonify, dump_yaml
 
 CAPTUREKITS = CAPTUREKIT_MAP.values()
 log = logging.getLogger(__name__)
@@ -44,43 +45,80 @@ def pedigree(context, gene_panel, family_id, samples, customer_family):
 @click.option('-c', '--capture-kit', type=click.Choice(CAPTUREKITS),
               help='custom capture kit')
 @click.option('--force', is_flag=True, help='skip sanity checks')
-@click.argument('raw_case_id')
+@click.option('--cases', type=click.File('r'), help='file with one case id per line')
+@click.option('-i', '--incremental', 'outdir', type=click.Path(file_okay=False),
+              help='only regenerate changed --cases into a directory')
+@click.argument('raw_case_id', required=False)
 @click.pass_context
-def config(context, gene_panel, family_id, samples, capture_kit, force,
+def config(context, gene_panel, family_id, samples, capture_kit, force, cases, outdir,
            raw_case_id):
     """Create pedigree YAML file from LIMS data."""
+    lims_api = api.connect(context.obj)
+    gene_panels = [gene_panel] if gene_panel else None
+
+    if cases or outdir:
+        if not (cases and outdir):
+            click.echo("use '--cases' together with '--incremental'")
+            context.abort()
+        case_ids = [line.strip() for line in cases if line.strip()]
+
+        def generate(lims_samples):
+            data = render_config(lims_api, lims_samples, gene_panels=gene_panels,
+                                 capture_kit=capture_kit, force=force)
+            return dump_yaml(data)
+
+        process_types = lims_api.process_type_names([HYBRIDIZE_LIBRARY]).values()
+        counts = incremental.sweep(lims_api, case_ids, outdir, generate, process_types)
+        log.info("%s cases: %s skipped, %s regenerated, %s unchanged, %s failed",
+                 len(case_ids), counts['skipped'], counts['regenerated'],
+                 counts['unchanged'], counts['failed'])
+        if counts['failed']:
+            context.exit(1)
+        return
+    elif not raw_case_id:
+        click.echo("you need to provide a case id")
+        context.abort()
+
     if '--' in raw_case_id:
         case_id, ext = raw_case_id.split('--', 1)
     else:
         case_id, ext = raw_case_id, None
     customer, family = case_id.split('-', 1)
 
-    lims_api = api.connect(context.obj)
-    gene_panels = [gene_panel] if gene_panel else None
-
     if samples:
         lims_samples = [lims_api.sample(sample_id) for sample_id in samples]
     else:
         lims_samples = lims_api.case(customer, family)
 
-    included_samples = relevant_samples(lims_samples)
-    data = make_config(lims_api, included_samples, family_id=family_id,
-                       gene_panels=gene_panels, capture_kit=capture_kit, force=force)
-
+    data = render_config(lims_api, lims_samples, family_id=family_id,
+                         gene_panels=gene_panels, capture_kit=capture_kit, force=force)
     if ext:
         # handle cases with e.g. downsampled data
         data['family'] = '--'.join([data['family'], ext])
         for sample in data['samples']:
             sample['sample_id'] = '--'.join([sample['sample_id'], ext])
 
+    dump_yaml(data, click.get_text_stream('stdout'))
+    click.echo()
+
+
+def render_config(lims_api, lims_samples, **options):
+    """Build the pedigree config for the samples of a case.
+
+    Args:
+        lims_samples (List[Sample]): all samples of the case
+        options: passed on to `make_config`
+    """
+    lims_samples = lims_api.load_related(lims_samples)
+    included_samples = relevant_samples(lims_samples)
+    data = make_config(lims_api, included_samples, **options)
+
     # handle single sample cases with 'unknown' phenotype
     if len(data['samples']) == 1:
         if data['samples'][0]['phenotype'] == 'unknown':
             log.info("setting 'unknown' phenotype to 'unaffected'")
             data['samples'][0]['phenotype'] = 'unaffected'
-
-    dump = yaml.safe_dump(data, default_flow_style=False, allow_unicode=True)
-    click.echo(fix_dump(dump))
+    return data
 
 
 @click.command()
@@ -90,19 +128,56 @@ def config(context, gene_panel, family_id, samples, capture_kit, force,
 @click.option('-m', '--minimal', is_flag=True, help='output minimal information')
 @click.option('--all', '--all-samples', is_flag=True,
               help='include cancelled/tumor samples')
-@click.argument('raw_identifier')
+@click.option('-b', '--batch', type=click.File('r'),
+              help='read identifiers from a file, "-" for stdin')
+@click.option('-F', '--fields', help='comma separated fields to output in batch mode')
+@click.option('-o', '--output', type=click.Choice(['tsv', 'json']), default='tsv',
+              help='output format in batch mode')
+@click.argument('raw_identifier', required=False)
 @click.argument('field', required=False)
 @click.pass_context
-def get(context, condense, project, external, minimal, raw_identifier, field, all_samples):
+def get(context, condense, project, external, minimal, raw_identifier, field, all_samples,
+        batch, fields, output):
     """Get information from LIMS: either sample or family samples."""
-    if '--' in raw_identifier:
-        identifier, ext = raw_identifier.split('--', 1)
-    else:
-        identifier, ext = raw_identifier, None
+    if batch:
+        if raw_identifier or project:
+            click.echo("'--batch' reads identifiers from a file: don't combine it with an "
+                       "identifier argument or '--project'")
+            context.abort()
+        fields = fields.split(',') if fields else None
+        if output == 'tsv' and not fields:
+            click.echo("you need to pick '--fields' for TSV output")
+            context.abort()
+        lims = api.connect(context.obj)
+        identifiers = [line.strip() for line in batch if line.strip()]
+        records = batch_records(lims, identifiers, external=external, minimal=minimal,
+                                all_samples=all_samples, fields=fields)
+        if output == 'tsv':
+            click.echo('\t'.join(['identifier'] + fields + ['error']))
+        for identifier, data, error in records:
+            if output == 'json':
+                record = {'identifier': identifier}
+                if error:
+                    record['error'] = error
+                else:
+                    record['sample'] = data
+                click.echo(jsonify(record))
+            else:
+                values = [tsv_value(data.get(key) if data else None) for key in fields]
+                click.echo('\t'.join([identifier] + values + [error or '']))
+        return
+    elif raw_identifier is None:
+        click.echo("you need to provide an identifier or '--batch'")
+        context.abort()
+
+    identifier, ext = split_identifier(raw_identifier)
 
     lims = api.connect(context.obj)
     if project:
-        lims_samples = lims.get_samples(projectlimsid=identifier)
+        # stream samples as soon as the first page of the project comes in
+        lims_samples = lims.iter_samples(projectlimsid=identifier, resolve=True)
+        if not all_samples:
+            lims_samples = relevant_samples(lims_samples)
     elif identifier.startswith('cust'):
         # look up samples in a case
         lims_samples = lims.case(*identifier.split('-', 1))
@@ -113,62 +188,181 @@ def get(context, condense, project, external, minimal, raw_identifier, field, al
         is_cgid = True if identifier[0].isdigit() else False
         lims_samples = [lims.sample(identifier, is_cgid=is_cgid)]
 
-    if len(lims_samples) > 1 and not all_samples:
+    if not project and not field:
+        # fetch all samples with their projects up front
+        lims_samples = lims.load_related(lims_samples, 'project')
+
+    if not project and len(lims_samples) > 1 and not all_samples:
         # filter out tumor and cancelled samples
         lims_samples = relevant_samples(lims_samples)
 
     for lims_sample in lims_samples:
-        sample_obj = ClinicalSample(lims_sample)
-        data = sample_obj.to_dict(minimal=minimal)
-        data['sample_id'] = "{}--{}".format(data['sample_id'], ext) if ext else data['sample_id']
-        data['case_id'] = "{}--{}".format(data['case_id'], ext) if ext else data['case_id']
-
         if field:
-            if field not in data:
+            # only compute (and fetch) what the field needs
+            sample_obj = ClinicalSample(lims_sample)
+            if field not in sample_obj:
                 log.error("can't find UDF on sample: %s", field)
                 context.abort()
-            elif isinstance(data[field], list):
-                for item in data[field]:
+            value = sample_field(sample_obj, field, ext=ext)
+            if isinstance(value, list):
+                for item in value:
                     click.echo(item)
             else:
-                click.echo(data[field])
+                click.echo(value)
         else:
+            data = sample_data(lims_sample, ext=ext, minimal=minimal)
             if condense:
-                dump = jsonify(data)
+                click.echo(jsonify(data))
             else:
-                raw_dump = yaml.safe_dump(data, default_flow_style=False,
-                                          allow_unicode=True)
-                dump = fix_dump(raw_dump)
                 click.echo(click.style('>>> Sample: ', fg='red'), nl=False)
                 click.echo(click.style(data['id'], bold=True, fg='red'))
                 if data.get('cancelled') == 'yes':
                     click.echo(click.style('CANCELLED', bold=True, fg='yellow'))
-            click.echo(dump)
+                dump_yaml(data, click.get_text_stream('stdout'))
+                click.echo()
+
+
+def split_identifier(raw_identifier):
+    """Split off the extension of e.g. downsampled data: "<id>--<ext>"."""
+    if '--' in raw_identifier:
+        identifier, ext = raw_identifier.split('--', 1)
+    else:
+        identifier, ext = raw_identifier, None
+    return identifier, ext
+
+
+def sample_data(lims_sample, ext=None, minimal=False, fields=None):
+    """Export a LIMS sample, optionally extending the ids.
+
+    Args:
+        fields (Optional[List[str]]): only export these fields (None if missing)
+    """
+    sample_obj = ClinicalSample(lims_sample)
+    if fields:
+        return {key: (sample_field(sample_obj, key, ext=ext) if key in sample_obj else None)
+                for key in fields}
+    data = sample_obj.to_dict(minimal=minimal)
+    data['sample_id'] = "{}--{}".format(data['sample_id'], ext) if ext else data['sample_id']
+    data['case_id'] = "{}--{}".format(data['case_id'], ext) if ext else data['case_id']
+    return data
+
+
+def sample_field(sample_obj, field, ext=None):
+    """Export a single field of a sample, optionally extending the ids."""
+    value = sample_obj[field]
+    if ext and field in ('sample_id', 'case_id'):
+        value = "{}--{}".format(value, ext)
+    return value
+
+
+def batch_records(lims, raw_identifiers, external=False, minimal=False, all_samples=False,
+                  fields=None):
+    """Resolve many identifiers at once and export their samples.
+
+    Yields (identifier, data, error) for each sample in input order. An
+    identifier which can't be resolved yields a single record with an
+    error message instead of aborting the whole batch.
+
+    Args:
+        fields (Optional[List[str]]): only export these fields
+    """
+    split_ids = [split_identifier(raw_identifier) for raw_identifier in raw_identifiers]
+    resolved = lims.resolve_samples([identifier for identifier, ext in split_ids],
+                                    external=external)
+    if fields is None or 'project_name' in fields:
+        lims.load_related([lims_sample for lims_samples in resolved.values()
+                           if not isinstance(lims_samples, Exception)
+                           for lims_sample in lims_samples], 'project')
+    for raw_identifier, (identifier, ext) in zip(raw_identifiers, split_ids):
+        lims_samples = resolved[identifier]
+        if isinstance(lims_samples, Exception):
+            log.error("can't resolve identifier: %s", lims_samples)
+            yield raw_identifier, None, str(lims_samples)
+            continue
+
+        if len(lims_samples) > 1 and not all_samples:
+            lims_samples = list(relevant_samples(lims_samples))
+        for lims_sample in lims_samples:
+            try:
+                data = sample_data(lims_sample, ext=ext, minimal=minimal, fields=fields)
+            except (KeyError, ValueError, UnknownSequencingTypeError) as error:
+                log.error("can't export sample %s: %s", lims_sample.id, error)
+                yield raw_identifier, None, "{}: {}".format(lims_sample.id, error)
+            else:
+                yield raw_identifier, data, None
+
+
+def tsv_value(value):
+    """Format a sample value for a TSV cell."""
+    if value is None:
+        return ''
+    elif isinstance(value, list):
+        return ','.join(value)
+    return "{}".format(value)
 
 
 @click.command()
-@click.argument('lims_id')
-@click.argument('field_key')
-@click.argument('new_value')
+@click.option('-f', '--file', 'changes_file', type=click.File('r'),
+              help='TSV/CSV file with sample id, UDF and new value per row')
+@click.option('-y', '--yes', is_flag=True, help='update without confirmation')
+@click.argument('lims_id', required=False)
+@click.argument('field_key', required=False)
+@click.argument('new_value', required=False)
 @click.pass_context
-def update(context, lims_id, field_key, new_value):
-    """Update a UDF for a sample."""
+def update(context, changes_file, yes, lims_id, field_key, new_value):
+    """Update a UDF for a sample (or many from a file)."""
     lims = api.connect(context.obj)
+    if changes_file:
+        try:
+            rows = read_changes(changes_file)
+        except ValueError as error:
+            log.error(error)
+            context.abort()
+        lims_samples = resolve_lims_ids(context, lims, [row[0] for row in rows])
+        changes = []
+        for sample_id, field_key, new_value in rows:
+            lims_sample = lims_samples[sample_id]
+            before = dict(lims_sample.udf.items())
+            lims_sample.udf[field_key] = new_value
+            changes.extend(udf_changes(lims_sample, before))
+        save_changes(lims, changes, yes=yes)
+        return
+    elif new_value is None:
+        click.echo("you need to provide sample, UDF and value or '--file'")
+        context.abort()
+
     lims_sample = lims.sample(lims_id)
     old_value = lims_sample.udf.get(field_key, 'N/A').encode('utf-8')
     click.echo("about to update sample: {}".format(lims_sample.id))
     message_tmlt = "are you sure you want to change '{}': '{}' -> '{}'"
-    if click.confirm(message_tmlt.format(field_key, old_value, new_value)):
+    if yes or click.confirm(message_tmlt.format(field_key, old_value, new_value)):
         lims_sample.udf[field_key] = new_value
         lims_sample.put()
 
 
 @click.command()
-@click.argument('sample_id')
+@click.option('-f', '--file', 'ids_file', type=click.File('r'),
+              help='file with one sample id per line, "-" for stdin')
+@click.option('-y', '--yes', is_flag=True, help='save without confirmation in bulk mode')
+@click.argument('sample_id', required=False)
 @click.pass_context
-def fillin(context, sample_id):
-    """Fill in defaults for a LIMS sample."""
+def fillin(context, ids_file, yes, sample_id):
+    """Fill in defaults for a LIMS sample (or many from a file)."""
     lims_api = api.connect(context.obj)
+    if ids_file:
+        sample_ids = [line.strip() for line in ids_file if line.strip()]
+        lims_samples = resolve_lims_ids(context, lims_api, sample_ids)
+        changes = []
+        for lims_sample in lims_samples.values():
+            before = dict(lims_sample.udf.items())
+            set_defaults(lims_sample)
+            changes.extend(udf_changes(lims_sample, before))
+        save_changes(lims_api, changes, yes=yes)
+        return
+    elif sample_id is None:
+        click.echo("you need to provide a sample id or '--file'")
+        context.abort()
+
     lims_sample = lims_api.sample(sample_id)
     click.echo("filling in defaults...")
     set_defaults(lims_sample)
@@ -176,6 +370,74 @@ def fillin(context, sample_id):
     click.echo("saved new defaults")
 
 
+def read_changes(handle):
+    """Read (sample id, UDF, new value) rows from a TSV or CSV file.
+
+    Lines starting with '#' are skipped, e.g. for a header.
+    """
+    delimiter = ',' if handle.name.endswith('.csv') else '\t'
+    rows = []
+    for line_no, row in enumerate(csv.reader(handle, delimiter=delimiter), start=1):
+        if not row or row[0].startswith('#'):
+            continue
+        if len(row) != 3:
+            raise ValueError("line {}: expected sample id, UDF and value, got: {}"
+                             .format(line_no, row))
+        rows.append(tuple(value.strip() for value in row))
+    return rows
+
+
+def resolve_lims_ids(context, lims, sample_ids):
+    """Fetch samples by LIMS id in batches, abort if any is missing."""
+    resolved = lims.resolve_samples(sample_ids)
+    lims_samples = {}
+    for sample_id in sample_ids:
+        result = resolved[sample_id]
+        if isinstance(result, Exception):
+            log.error("can't resolve sample: %s", result)
+        elif len(result) > 1:
+            log.error("'%s' matches more than one sample", sample_id)
+        else:
+            lims_samples[sample_id] = result[0]
+    if len(lims_samples) < len(set(sample_ids)):
+        context.abort()
+    return lims_samples
+
+
+def udf_changes(lims_sample, before):
+    """Compare the UDFs of a sample with a snapshot taken before editing.
+
+    Returns:
+        List[tuple]: (sample, UDF, old value, new value) for each change
+    """
+    changes = []
+    for key, old_value in sorted(before.items()):
+        new_value = lims_sample.udf.get(key)
+        if new_value != old_value:
+            changes.append((lims_sample, key, old_value, new_value))
+    for key, new_value in sorted(lims_sample.udf.items()):
+        if key not in before:
+            changes.append((lims_sample, key, None, new_value))
+    return changes
+
+
+def save_changes(lims, changes, yes=False):
+    """Confirm all changes at once and save them with batch updates."""
+    if not changes:
+        click.echo("nothing to update")
+        return
+    for lims_sample, key, old_value, new_value in changes:
+        click.echo("{}: '{}': '{}' -> '{}'".format(lims_sample.id, key,
+                                                  'N/A' if old_value is None else old_value,
+                                                  new_value))
+    lims_samples = {lims_sample.id: lims_sample for lims_sample, _, _, _ in changes}
+    message = "are you sure you want to make {} changes to {} samples".format(
+        len(changes), len(lims_samples))
+    if yes or click.confirm(message):
+        lims.put_batch(list(lims_samples.values()))
+        click.echo("saved changes to {} samples".format(len(lims_samples)))
+
+
 def set_defaults(lims_sample):
     """Set default values for required UDFs."""
     log.info("setting defaults for required fields")
@@ -246,3 +508,34 @@ def sample(context, delivered, lims_id):
         else:
             log.error("sample not yet delivered")
             context.abort()
+
+
+@click.command()
+@click.option('-d', '--min-distance', default=3,
+              help='report indexes closer than this on every index read')
+@click.argument('flowcell')
+@click.pass_context
+def indexes(context, min_distance, flowcell):
+    """Check that indexes in each lane of a flowcell can be told apart."""
+    lims_api = api.connect(context.obj)
+    rows = list(lims_api.samplesheet(flowcell))
+    if not rows:
+        log.error("flowcell not found: %s", flowcell)
+        context.abort()
+
+    results = check_indexes(rows, min_distance=min_distance)
+    collided = False
+    for lane, result in sorted(results.items()):
+        for collision in result['collisions']:
+            collided = True
+            click.echo("lane {}: {} ({}) <-> {} ({}), distance: {}".format(
+                lane, collision['samples'][0], collision['indexes'][0],
+                collision['samples'][1], collision['indexes'][1],
+                '/'.join(str(distance) for distance in collision['distances'])))
+        if result['barcode_mismatches'] is None:
+            log.error("lane %s: identical indexes, can't demultiplex", lane)
+        else:
+            click.echo("lane {}: --barcode-mismatches {}"
+                       .format(lane, result['barcode_mismatches']))
+    if collided:
+        context.exit(1)
@@ -4,13 +4,14 @@ import json
 import re
 
 from six import StringIO
+import yaml
 
 from cglims.constants import READS_PER_1X
 
 
 def json_serial(obj):
     """JSON serializer for objects not serializable by default json code"""
-    if isinstance(obj, datetime.datetime):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
         serial = obj.isoformat()
         return serial
     raise TypeError('Type not serializable')
@@ -22,6 +23,24 @@ def jsonify(data, pretty=False):
     return json.dumps(data, default=json_serial, **kwargs)
 
 
+class IndentedListDumper(yaml.SafeDumper):
+
+    """Safe YAML dumper which indents list items under their parent key.
+
+    The libyaml emitter always writes such lists indentless so this has to
+    build on the pure-Python emitter.
+    """
+
+    def increase_indent(self, flow=False, indentless=False):
+        return super(IndentedListDumper, self).increase_indent(flow, False)
+
+
+def dump_yaml(data, stream=None):
+    """Serialize data to YAML with indented lists in a single pass."""
+    return yaml.dump(data, stream, Dumper=IndentedListDumper,
+                     default_flow_style=False, allow_unicode=True)
+
+
 def fix_dump(dump, indentSize=2):
     stream = StringIO(dump)
     out = StringIO()
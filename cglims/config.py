@@ -12,6 +12,8 @@ CAPTUREKIT_MAP = {'Agilent Sureselect CRE': 'Agilent_SureSelectCRE.V1',
                   'SureSelect Focused Exome': 'Agilent_SureSelectFocusedExome.V1',
                   'other': 'Agilent_SureSelectCRE.V1'}
 LATEST_CAPTUREKIT = 'Agilent_SureSelectCRE.V1'
+# process type: CG002 - Hybridize Library (SS XT)
+HYBRIDIZE_LIBRARY = '669'
 
 log = logging.getLogger(__name__)
 
@@ -27,7 +29,7 @@ def relevant_samples(lims_samples):
 
 def basic_config(lims_api, customer_id, family_id):
     """Generate data for a basic config."""
-    lims_samples = lims_api.case(customer_id, family_id)
+    lims_samples = lims_api.load_related(lims_api.case(customer_id, family_id))
     included_samples = relevant_samples(lims_samples)
     data = make_config(lims_api, included_samples, family_id=family_id)
     # handle single sample cases with 'unknown' phenotype
@@ -155,15 +157,15 @@ def get_sampleid(lims_sample, key='Clinical Genomics ID'):
 def get_capture_kit(lims, lims_sample, udf_key='Capture Library version',
                     udf_kitkey='SureSelect capture library/libraries used'):
     """Figure out which capture kit has been used for the sample."""
-    hybrizelib_id = '669'
+    hybrizelib_id = HYBRIDIZE_LIBRARY
     udfs = dict(lims_sample.udf.items())
     sample_capture_kit = udfs.get(udf_key)
     if sample_capture_kit and sample_capture_kit != 'NA':
         log.debug('prefer capture kit annotated on the sample level')
         capture_kit = lims_sample.udf[udf_key]
     else:
-        artifacts = lims.get_artifacts(samplelimsid=lims_sample.id,
-                                       type='Analyte')
+        artifacts = lims.get_process_artifacts([lims_sample.id], [hybrizelib_id],
+                                               type='Analyte')[lims_sample.id]
         capture_kit = None
         for artifact in artifacts:
             if artifact.parent_process:
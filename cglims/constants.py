@@ -1,7 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 
+from datetime import timedelta
+
 # for WGS, how many reads needed to cover genome 1x
 READS_PER_1X = 650000000 / 0.75 / 30
 
 SEX_MAP = {'F': 'female', 'M': 'male', 'Unknown': 'unknown', 'unknown': 'unknown'}
+
+# where to keep cached LIMS data by default
+DEFAULT_CACHE_DIR = '~/.cache/cglims'
+
+# allow for the clocks of the LIMS server and this host to differ
+CLOCK_MARGIN = timedelta(minutes=5)
+# format of timestamps in LIMS queries, e.g. `last_modified`
+LIMS_TIMESTAMP = '%Y-%m-%dT%H:%M:%SZ'
+
+# process types which sequence samples, e.g. "CG002 - Illumina Sequencing"
+SEQUENCING_TYPES = ('670', '671')
+# "CG002 - Delivery"
+DELIVERY_TYPE = '159'
+# process receiving samples and the UDF with the date they arrived
+RECEPTION_CONTROL = 'CG002 - Reception Control'
+RECEIVED_UDF = 'date arrived at clinical genomics'
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Plan where to deliver the results of many samples at once."""
+import logging
+
+import click
+import yaml
+
+from cglims import api
+from cglims.api import ClinicalSample, deliver, unique_entities
+from cglims.cli.utils import jsonify
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-p', '--project', 'projects', multiple=True, help='LIMS project id')
+@click.option('-c', '--case', 'cases', multiple=True, help='case id: CUSTOMER-FAMILY')
+@click.option('--cases', 'cases_file', type=click.File('r'),
+              help='file with one case id per line')
+@click.option('-f', '--flowcell', 'flowcells', multiple=True, help='flowcell name')
+@click.option('--pending', is_flag=True, help='leave out samples already delivered')
+@click.option('-o', '--output', type=click.Choice(['yaml', 'json']), default='yaml')
+@click.pass_context
+def delivery(context, projects, cases, cases_file, flowcells, pending, output):
+    """Plan deliveries for samples grouped by where they go."""
+    case_ids = list(cases)
+    if cases_file:
+        case_ids.extend(line.strip() for line in cases_file if line.strip())
+    if not (projects or case_ids or flowcells):
+        click.echo("you need to provide a project, case or flowcell")
+        context.abort()
+
+    lims_api = api.connect(context.obj)
+    lims_samples, errors = [], []
+    for project_id in projects:
+        lims_samples.extend(lims_api.get_samples(projectlimsid=project_id))
+    for case_id, resolved in sorted(lims_api.resolve_samples(case_ids).items()):
+        if isinstance(resolved, Exception):
+            log.error("can't resolve case: %s", resolved)
+            errors.append({'id': case_id, 'error': "{}".format(resolved)})
+            continue
+        lims_samples.extend(resolved)
+    for flowcell in flowcells:
+        lims_samples.extend(lims_sample for lane, artifact, lims_sample
+                            in lims_api.flowcell_samples(flowcell))
+
+    manifest = plan_delivery(lims_api, lims_samples, pending=pending)
+    manifest['errors'] = errors + manifest['errors']
+    if output == 'json':
+        click.echo(jsonify(manifest))
+    else:
+        click.echo(yaml.safe_dump(manifest, default_flow_style=False, allow_unicode=True),
+                   nl=False)
+
+
+def plan_delivery(lims_api, lims_samples, pending=False):
+    """Apply the `deliver` rules to many samples and group them by target.
+
+    Samples are batch retrieved and their delivery status checked with
+    grouped queries so the number of requests doesn't grow per sample.
+
+    Args:
+        lims_samples (List[Sample]): samples to deliver
+        pending (bool): leave out samples already delivered
+
+    Returns:
+        dict: 'raw_data' groups per target (and project), 'scout' uploads
+              per case and 'errors' for samples which can't be planned
+    """
+    lims_samples = lims_api.fetch(unique_entities(lims_samples))
+    delivered = lims_api.delivery_dates([lims_sample.id for lims_sample in lims_samples])
+
+    raw_data, scout, errors = {}, {}, []
+    for lims_sample in sorted(lims_samples, key=lambda lims_sample: lims_sample.id):
+        try:
+            if isinstance(delivered[lims_sample.id], Exception):
+                raise delivered[lims_sample.id]
+            if pending and delivered[lims_sample.id]:
+                continue
+            plan = deliver(lims_sample)
+        except KeyError as error:
+            errors.append({'id': lims_sample.id, 'error': "missing UDF: {}".format(error)})
+            continue
+
+        case_id = ClinicalSample(lims_sample).case_id
+        sample = {
+            'id': lims_sample.id,
+            'name': lims_sample.name,
+            'case': case_id,
+            'extras': plan['extras'],
+            'delivered': delivered[lims_sample.id],
+        }
+        # no target means the customer has its own way of delivery
+        target = plan['raw_data'].get('target', 'manual')
+        project = plan['raw_data'].get('project')
+        group = raw_data.setdefault((target, project), {'target': target, 'samples': []})
+        if project:
+            group['project'] = project
+        group['samples'].append(sample)
+        if plan['scout']:
+            scout.setdefault(case_id, []).append(lims_sample.id)
+
+    return {
+        'raw_data': [group for key, group in
+                     sorted(raw_data.items(), key=lambda item: (item[0][0], item[0][1] or ''))],
+        'scout': [{'case': case_id, 'samples': sample_ids}
+                  for case_id, sample_ids in sorted(scout.items())],
+        'errors': errors,
+    }
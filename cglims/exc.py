@@ -27,3 +27,11 @@ class MultipleSamplesError(LimsException):
 
 class UnknownSequencingTypeError(Exception):
     pass
+
+
+class CassetteError(LimsException):
+    pass
+
+
+class LimsUnavailableError(LimsException):
+    pass
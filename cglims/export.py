@@ -2,23 +2,137 @@
 from datetime import datetime
 import copy
 import logging
+import multiprocessing
+import time
 
 import click
 from dateutil.parser import parse as parse_date
 import yaml
 
-from cglims import api
-from cglims.constants import SEX_MAP
+from cglims import api, incremental
+from cglims.journal import Journal, output_size, trim_output
+from cglims.cli.utils import jsonify
+from cglims.constants import RECEPTION_CONTROL, SEX_MAP
+from cglims.exc import LimsCaseIdNotFoundError
+
+# journal entry with the offset where the output started
+OUTPUT_START = ':output-start'
+# process types producing the artifacts `sample_data` reads
+EXPORT_PROCESS_TYPES = ('33', '159', '663', '664', '667', '669', '670', '671')
 
 log = logging.getLogger(__name__)
+# LIMS client of the current worker process in bulk exports
+WORKER_LIMS = None
 
 
 @click.command()
-@click.argument('customer_or_case')
+@click.option('--cases', type=click.File('r'),
+              help='export all case ids in a file, "-" for stdin')
+@click.option('-j', '--jobs', default=1, help='worker processes for --cases')
+@click.option('-o', '--output', type=click.Choice(['yaml', 'json']), default='yaml',
+              help='output format for --cases')
+@click.option('-i', '--incremental', 'outdir', type=click.Path(file_okay=False),
+              help='only regenerate changed --cases into a directory')
+@click.option('--journal', type=click.Path(dir_okay=False),
+              help='record exported --cases to resume from')
+@click.option('--resume', is_flag=True, help='skip cases completed in the journal')
+@click.argument('customer_or_case', required=False)
 @click.argument('family_id', required=False)
 @click.pass_context
-def export(context, customer_or_case, family_id):
+def export(context, cases, jobs, output, outdir, journal, resume, customer_or_case,
+           family_id):
     """Parse out interesting data about a case."""
+    if outdir and not cases:
+        click.echo("'--incremental' needs '--cases'")
+        context.abort()
+    elif outdir and (jobs > 1 or output != 'yaml' or journal or resume):
+        click.echo("'--incremental' writes YAML one case at a time, it can't be combined "
+                   "with '--jobs', '--output', '--journal' or '--resume'")
+        context.abort()
+    elif outdir:
+        case_ids = [line.strip() for line in cases if line.strip()]
+        lims = api.connect(context.obj)
+
+        def generate(lims_samples):
+            return yaml.safe_dump(export_case(lims, lims_samples), default_flow_style=False,
+                                  allow_unicode=True)
+
+        process_types = ([RECEPTION_CONTROL] +
+                         list(lims.process_type_names(EXPORT_PROCESS_TYPES).values()))
+        counts = incremental.sweep(lims, case_ids, outdir, generate, process_types)
+        log.info("%s cases: %s skipped, %s regenerated, %s unchanged, %s failed",
+                 len(case_ids), counts['skipped'], counts['regenerated'],
+                 counts['unchanged'], counts['failed'])
+        if counts['failed']:
+            context.exit(1)
+        return
+    elif cases:
+        case_ids = [line.strip() for line in cases if line.strip()]
+        if jobs > 1 and (context.obj.get('cassette') or {}).get('record'):
+            click.echo("can't record traffic from multiple worker processes")
+            context.abort()
+        if resume and not journal:
+            click.echo("'--resume' needs a '--journal'")
+            context.abort()
+
+        stdout = click.get_binary_stream('stdout')
+        size = output_size(stdout)
+        if resume and size is None:
+            click.echo("'--resume' needs the output written to a file")
+            context.abort()
+        offset = 0
+        checkpoints = None
+        if journal:
+            checkpoints = Journal(journal, resume=resume)
+            offset = checkpoints.last('offset')
+            if offset is None:
+                # offsets are absolute, the output may be appended to a file
+                offset = size or 0
+                checkpoints.record(OUTPUT_START, offset=offset)
+            elif size is not None and size < offset:
+                # e.g. redirected with '>', new offsets wouldn't match the file
+                checkpoints.close()
+                click.echo("the output is shorter than recorded in the journal, append "
+                           "('>>') to the output file of the earlier run", err=True)
+                context.abort()
+            else:
+                # continue the output right after the last completed case
+                trim_output(stdout, offset)
+            case_ids = [case_id for case_id in case_ids if case_id not in checkpoints]
+
+        failed = 0
+        try:
+            for case_id, case_data, error, elapsed in export_cases(context.obj, case_ids,
+                                                                   jobs=jobs):
+                if error:
+                    failed += 1
+                    log.error("%s: export failed after %.2fs: %s", case_id, elapsed, error)
+                    continue
+
+                log.info("%s: exported in %.2fs", case_id, elapsed)
+                if output == 'json':
+                    content = jsonify(case_data) + '\n'
+                else:
+                    content = yaml.safe_dump(case_data, default_flow_style=False,
+                                             encoding=None, allow_unicode=True,
+                                             explicit_start=True)
+                content = content.encode('utf-8')
+                stdout.write(content)
+                stdout.flush()
+                offset += len(content)
+                if checkpoints:
+                    checkpoints.record(case_id, offset=offset)
+        finally:
+            if checkpoints:
+                checkpoints.close()
+        log.info("exported %s cases, %s failed", len(case_ids) - failed, failed)
+        if failed:
+            context.exit(1)
+        return
+    elif customer_or_case is None:
+        click.echo("you need to provide a case or '--cases'")
+        context.abort()
+
     lims = api.connect(context.obj)
     if family_id:
         customer = customer_or_case
@@ -32,13 +146,61 @@ def export(context, customer_or_case, family_id):
     click.echo(raw_dump)
 
 
+def export_cases(config, case_ids, jobs=1):
+    """Export many cases, spread over worker processes.
+
+    Each worker connects its own LIMS client which it keeps (with its
+    cached entities) between cases. Results are yielded in input order.
+
+    Yields:
+        tuple: case id, case data, error message, elapsed seconds
+    """
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(config,))
+        try:
+            for result in pool.imap(export_worker, case_ids):
+                yield result
+        finally:
+            pool.terminate()
+    else:
+        init_worker(config)
+        for case_id in case_ids:
+            yield export_worker(case_id)
+
+
+def init_worker(config):
+    """Connect a LIMS client for the current worker process."""
+    global WORKER_LIMS
+    WORKER_LIMS = api.connect(config)
+
+
+def export_worker(case_id):
+    """Export a single case with the client of the current worker process."""
+    start = time.time()
+    try:
+        customer, family_id = case_id.split('-', 1)
+        lims_samples = WORKER_LIMS.case(customer, family_id)
+        if not lims_samples:
+            raise LimsCaseIdNotFoundError(case_id)
+        case_data = export_case(WORKER_LIMS, lims_samples)
+    except Exception as error:
+        # report any failure per case rather than aborting the whole run
+        return case_id, None, "{}: {}".format(type(error).__name__, error), time.time() - start
+    return case_id, case_data, None, time.time() - start
+
+
 def export_case(lims_api, lims_samples):
     """Gather data about a case, multiple samples in LIMS."""
+    lims_samples = lims_api.load_related(lims_samples, 'project')
     families = (get_familydata(lims_sample) for lims_sample in lims_samples)
     samples = []
+    sample_artifacts = lims_api.get_process_artifacts(
+        [lims_sample.id for lims_sample in lims_samples], EXPORT_PROCESS_TYPES)
+    # sequencing artifacts are exported with their flowcell
+    lims_api.load_related([artifact for artifacts in sample_artifacts.values()
+                           for artifact in artifacts], 'container')
     for lims_sample in lims_samples:
-        artifacts = lims_api.get_artifacts(samplelimsid=lims_sample.id)
-        data = sample_data(lims_api, lims_sample, artifacts)
+        data = sample_data(lims_api, lims_sample, sample_artifacts[lims_sample.id])
         samples.append(data)
 
     family_data = consolidate_family(families)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Hedged GET requests against the LIMS latency tail.
+
+A GET which hasn't returned within a percentile of recently observed
+latencies is sent once more and whichever answer arrives first is used.
+A budget caps the extra load: each request earns a fraction of a hedge.
+"""
+from __future__ import division
+
+from collections import deque
+import logging
+import threading
+import time
+
+from requests.adapters import BaseAdapter
+from six.moves import queue
+
+log = logging.getLogger(__name__)
+
+
+class LatencyTracker(object):
+
+    def __init__(self, window=200, min_samples=20):
+        """Recently observed request latencies.
+
+        Args:
+            window (int): how many recent latencies to keep
+            min_samples (int): latencies needed before estimating percentiles
+        """
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+
+    def percentile(self, percent):
+        """Latency below which `percent` of recent requests completed or None."""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class HedgingAdapter(BaseAdapter):
+
+    """Transport adapter hedging slow GET requests."""
+
+    def __init__(self, adapter, percentile=95, budget=0.05, min_delay=0.05, window=200):
+        """Hedge GET requests sent through another adapter.
+
+        Args:
+            adapter (BaseAdapter): adapter sending the actual requests
+            percentile (float): hedge requests slower than this percentile
+            budget (float): max extra requests as a fraction of all GETs
+            min_delay (float): never hedge before this many seconds
+        """
+        super(HedgingAdapter, self).__init__()
+        self.adapter = adapter
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.tracker = LatencyTracker(window=window)
+        self.tokens = 1.0
+        self.counts = dict(requests=0, hedged=0, hedge_wins=0, denied=0)
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return self.adapter.send(request, **kwargs)
+
+        with self._lock:
+            self.counts['requests'] += 1
+            self.tokens = min(10.0, self.tokens + self.budget)
+        delay = self.tracker.percentile(self.percentile)
+        if delay is None:
+            # nothing to tell a slow request by yet, no need for a race
+            start = time.time()
+            response = self.adapter.send(request, **kwargs)
+            self.tracker.observe(time.time() - start)
+            return response
+
+        race = Race(self.adapter, request, kwargs, self.tracker)
+        race.start(hedge=False)
+        result = race.first(timeout=max(delay, self.min_delay))
+        if result is not None:
+            return race.unwrap(result)
+        if not self._spend():
+            return race.result()
+        log.debug("hedging request after %.2fs: %s", delay, request.url)
+        race.start(hedge=True)
+        result = race.first()
+        if result.hedge:
+            with self._lock:
+                self.counts['hedge_wins'] += 1
+        return race.unwrap(result)
+
+    def _spend(self):
+        """Take a hedge from the budget if there is one left."""
+        with self._lock:
+            if self.tokens < 1:
+                self.counts['denied'] += 1
+                return False
+            self.tokens -= 1
+            self.counts['hedged'] += 1
+            return True
+
+    def stats(self):
+        """Summarize hedging for profiling output."""
+        with self._lock:
+            data = dict(self.counts)
+        requests = data['requests'] or 1
+        data['hedge_rate'] = round(data['hedged'] / requests, 3)
+        data['delay'] = self.tracker.percentile(self.percentile)
+        return data
+
+    def close(self):
+        self.adapter.close()
+
+
+class Attempt(object):
+
+    def __init__(self, hedge, response=None, error=None):
+        """Outcome of one copy of a request."""
+        self.hedge = hedge
+        self.response = response
+        self.error = error
+
+
+class Race(object):
+
+    def __init__(self, adapter, request, kwargs, tracker):
+        """Copies of the same request racing each other."""
+        self.adapter = adapter
+        self.request = request
+        self.kwargs = kwargs
+        self.tracker = tracker
+        self.results = queue.Queue()
+        self.started = 0
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def start(self, hedge):
+        """Send a copy of the request in the background."""
+        self.started += 1
+        request = self.request.copy() if hedge else self.request
+        thread = threading.Thread(target=self._run, args=(request, hedge))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, request, hedge):
+        start = time.time()
+        try:
+            attempt = Attempt(hedge, response=self.adapter.send(request, **self.kwargs))
+            self.tracker.observe(time.time() - start)
+        except Exception as error:
+            attempt = Attempt(hedge, error=error)
+        with self._lock:
+            if self.finished:
+                if attempt.response is not None:
+                    # lost the race, give the connection back
+                    attempt.response.close()
+            else:
+                self.results.put(attempt)
+
+    def first(self, timeout=None):
+        """Wait for the first successful copy (or the last failure).
+
+        Returns:
+            Attempt: None if nothing arrived within the timeout
+        """
+        while True:
+            try:
+                attempt = self.results.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            self.started -= 1
+            if attempt.error is None or self.started == 0:
+                with self._lock:
+                    self.finished = True
+                    # close copies that arrived meanwhile
+                    while not self.results.empty():
+                        other = self.results.get()
+                        if other.response is not None:
+                            other.response.close()
+                return attempt
+
+    def result(self):
+        """Wait for the request without hedging."""
+        return self.unwrap(self.first())
+
+    def unwrap(self, attempt):
+        if attempt.error is not None:
+            raise attempt.error
+        return attempt.response
+
+
+def install(lims_api, **options):
+    """Hedge the GET requests of a LIMS client.
+
+    Returns:
+        HedgingAdapter: the adapter used for the LIMS host
+    """
+    session = lims_api.request_session
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, HedgingAdapter(session.adapters[prefix], **options))
+    return session.get_adapter(lims_api.baseuri)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Regenerate per-case outputs only when their LIMS data has changed.
+
+For each case a fingerprint is kept next to the outputs: a hash of the
+samples, the entities the output was read from and a hash of the rendered
+output. A case is unchanged if its samples hash the same, no process (of
+a type the output is read from) modified since it was checked involves
+them and none of the recorded entities have been modified since. That
+costs two requests per case (listing and batch retrieving the samples)
+plus, once per sweep, queries for modified processes and containers and
+fetching those processes with their artifacts.
+"""
+import codecs
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+from xml.etree import ElementTree
+
+from cglims import api
+from cglims.constants import CLOCK_MARGIN, LIMS_TIMESTAMP
+
+STATE_FILE = '.fingerprints.json'
+
+log = logging.getLogger(__name__)
+
+
+def content_hash(content):
+    """Hash text or bytes."""
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+def samples_hash(lims_samples):
+    """Hash the XML of fetched samples."""
+    xml = sorted(ElementTree.tostring(lims_sample.root) for lims_sample in lims_samples)
+    return content_hash(b''.join(xml))
+
+
+def modified_since(lims_api, since, process_types):
+    """Collect what was modified in the LIMS since a timestamp.
+
+    The LIMS can only list processes and containers by when they were
+    last modified. The artifacts going in and out of modified processes
+    tell which samples they involve.
+
+    Args:
+        since (str): LIMS timestamp
+        process_types (List[str]): names of the process types to look at,
+                                   processes of other types are left out
+
+    Returns:
+        dict: 'entities' URIs of modified processes, their artifacts and
+              modified containers, 'samples' ids of the samples involved
+    """
+    lims_processes = lims_api.load_related(
+        lims_api.get_processes(last_modified=since, type=sorted(process_types)),
+        'all_inputs', 'all_outputs')
+    entities, sample_ids = set(), set()
+    for lims_process in lims_processes:
+        entities.add(api.entity_uri(lims_process))
+        for artifact in lims_process.all_inputs() + lims_process.all_outputs():
+            entities.add(api.entity_uri(artifact))
+            sample_ids.update(lims_sample.id for lims_sample in artifact.samples)
+    entities.update(api.entity_uri(container) for container in
+                    lims_api.get_containers(last_modified=since))
+    return {'entities': entities, 'samples': sample_ids}
+
+
+def changes(fingerprint, lims_samples, modified):
+    """Explain why a case needs to be regenerated or None if it doesn't.
+
+    Args:
+        fingerprint (dict): stored when the case was last generated
+        lims_samples (List[Sample]): fetched samples of the case
+        modified (dict): modified since the oldest fingerprint, see
+                         `modified_since`
+    """
+    if fingerprint is None:
+        return 'new case'
+    elif samples_hash(lims_samples) != fingerprint['samples']:
+        return 'samples changed'
+    elif modified['samples'].intersection(lims_sample.id for lims_sample in lims_samples):
+        return 'samples processed'
+    elif modified['entities'].intersection(fingerprint['entities']):
+        return 'entities changed'
+    return None
+
+
+def sweep(lims_api, case_ids, outdir, generate, process_types):
+    """Regenerate the output of each case whose LIMS data has changed.
+
+    Args:
+        case_ids (List[str]): "<customer>-<family>" ids
+        outdir (str): directory with a "<case id>.yaml" output per case
+        generate (function): renders the output for the samples of a case
+        process_types (List[str]): names of the process types the output
+                                   is read from
+
+    Returns:
+        dict: number of cases 'skipped', 'regenerated', 'unchanged' (same
+              output as before) and 'failed'
+    """
+    state = Fingerprints(os.path.join(outdir, STATE_FILE))
+    counts = dict(skipped=0, regenerated=0, unchanged=0, failed=0)
+    known = [state.get(case_id) for case_id in case_ids if state.get(case_id)]
+    modified = {'entities': set(), 'samples': set()}
+    if known:
+        modified = modified_since(lims_api, min(fingerprint['checked_at']
+                                                for fingerprint in known), process_types)
+
+    for case_id in case_ids:
+        out_path = os.path.join(outdir, "{}.yaml".format(case_id))
+        # anything modified from here on is picked up by the next sweep
+        checked_at = (datetime.utcnow() - CLOCK_MARGIN).strftime(LIMS_TIMESTAMP)
+        try:
+            lims_samples = lims_api.fetch(lims_api.case(*case_id.split('-', 1)))
+            if not lims_samples:
+                raise ValueError("case not found")
+            fingerprint = state.get(case_id)
+            if fingerprint and not os.path.exists(out_path):
+                fingerprint = None
+            reason = changes(fingerprint, lims_samples, modified)
+            if reason is None:
+                log.debug("%s: unchanged, skipping", case_id)
+                counts['skipped'] += 1
+                state.set(case_id, dict(fingerprint, checked_at=checked_at))
+                continue
+
+            log.info("%s: %s, regenerating", case_id, reason)
+            with lims_api.recording() as entities:
+                content = generate(lims_samples)
+        except Exception as error:
+            log.error("%s: failed: %s: %s", case_id, type(error).__name__, error)
+            counts['failed'] += 1
+            # regenerate next time rather than holding back later sweeps
+            state.discard(case_id)
+            continue
+
+        output_hash = content_hash(content)
+        if fingerprint and fingerprint['output'] == output_hash:
+            counts['unchanged'] += 1
+        else:
+            write_output(out_path, content)
+            counts['regenerated'] += 1
+        state.set(case_id, {'samples': samples_hash(lims_samples), 'checked_at': checked_at,
+                            'entities': sorted(entities), 'output': output_hash})
+    state.save()
+    return counts
+
+
+def write_output(path, content):
+    """Write an output file without ever leaving it half written."""
+    with codecs.open(path + '.tmp', 'w', encoding='utf-8') as handle:
+        handle.write(content)
+    os.rename(path + '.tmp', path)
+
+
+class Fingerprints(object):
+
+    def __init__(self, path):
+        """Fingerprints of generated cases, kept in a JSON file."""
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            with codecs.open(path, 'r', encoding='utf-8') as handle:
+                self.data = json.load(handle)
+
+    def get(self, case_id):
+        """Get the fingerprint of a case or None."""
+        return self.data.get(case_id)
+
+    def set(self, case_id, fingerprint):
+        self.data[case_id] = fingerprint
+
+    def discard(self, case_id):
+        """Forget the fingerprint of a case, if any."""
+        self.data.pop(case_id, None)
+
+    def save(self):
+        """Store all fingerprints."""
+        root_dir = os.path.dirname(self.path)
+        if root_dir and not os.path.isdir(root_dir):
+            os.makedirs(root_dir)
+        with codecs.open(self.path + '.tmp', 'w', encoding='utf-8') as handle:
+            json.dump(self.data, handle, indent=2, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Check that the indexes in a samplesheet can be told apart.
+
+With numpy the indexes of a lane are turned into an array of base codes
+and every library is compared to every other in one array operation per
+base, giving a matrix of Hamming distances per index read. Without it,
+indexes are packed into integers with 4 bits per base and compared pair
+by pair.
+"""
+from itertools import combinations
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BASE_CODES = {'A': 1, 'C': 2, 'G': 3, 'T': 4, 'N': 5}
+# highest --barcode-mismatches value bcl2fastq accepts
+MAX_MISMATCHES = 2
+
+
+def pack(sequence):
+    """Pack a DNA sequence into an integer, one 4-bit nibble per base."""
+    packed = 0
+    for base in sequence.upper():
+        packed = (packed << 4) | BASE_CODES.get(base, 0xF)
+    return packed
+
+
+def nibble_mask(length):
+    """Mask with the lowest bit of each of `length` nibbles set."""
+    return int('1' * length, 16) if length else 0
+
+
+class LaneIndexes(object):
+
+    def __init__(self, indexes):
+        """Packed representation of all indexes in a lane.
+
+        Args:
+            indexes (List[str]): index per library, dual indexes joined by '-'
+        """
+        reads = [index.split('-') if index else [] for index in indexes]
+        read_count = max(len(index_reads) for index_reads in reads) if reads else 0
+        # compare each index read over the length all libraries have in common
+        self.lengths = []
+        for read_no in range(read_count):
+            lengths = [len(index_reads[read_no]) for index_reads in reads
+                       if len(index_reads) > read_no]
+            self.lengths.append(min(lengths))
+        # sequence of each index read per library, None if it's missing
+        self.reads = [[index_reads[read_no][:length].upper() if read_no < len(index_reads)
+                       else None for index_reads in reads]
+                      for read_no, length in enumerate(self.lengths)]
+
+        # each read gets its own slice of the packed integer
+        self.masks = []
+        offset = 0
+        for length in reversed(self.lengths):
+            self.masks.insert(0, nibble_mask(length) << offset)
+            offset += length * 4
+
+        self.packed = []
+        self.present = []
+        for index_reads in reads:
+            packed = 0
+            for read_no, length in enumerate(self.lengths):
+                sequence = index_reads[read_no][:length] if read_no < len(index_reads) else ''
+                packed = (packed << length * 4) | pack(sequence)
+            self.packed.append(packed)
+            # a missing index read can't tell libraries apart
+            self.present.append(sum(self.masks[:len(index_reads)]))
+
+    def __len__(self):
+        return len(self.packed)
+
+    def distances(self, first, second):
+        """Hamming distance per index read between two libraries."""
+        diff = self.packed[first] ^ self.packed[second]
+        # collapse each differing nibble into its lowest bit
+        diff = diff | (diff >> 1) | (diff >> 2) | (diff >> 3)
+        diff &= self.present[first] & self.present[second]
+        if not self.masks:
+            return (0,)
+        return tuple(bin(diff & mask).count('1') for mask in self.masks)
+
+    def pairs(self):
+        """Yield all pairs of libraries with their distances."""
+        for first, second in combinations(range(len(self)), 2):
+            yield first, second, self.distances(first, second)
+
+    def distance_matrix(self):
+        """Hamming distances between all libraries with numpy.
+
+        Returns:
+            numpy.ndarray: distances per index read, library and library
+        """
+        size = len(self)
+        if not self.reads:
+            return numpy.zeros((1, size, size), dtype=numpy.int16)
+        matrix = numpy.zeros((len(self.reads), size, size), dtype=numpy.int16)
+        for read_no, sequences in enumerate(self.reads):
+            length = self.lengths[read_no]
+            present = numpy.array([sequence is not None for sequence in sequences])
+            codes = numpy.array([[BASE_CODES.get(base, 0xF) for base in sequence or '']
+                                 if sequence is not None else [0] * length
+                                 for sequence in sequences], dtype=numpy.uint8)
+            codes = codes.reshape(size, length)
+            for position in range(length):
+                column = codes[:, position]
+                matrix[read_no] += column[:, None] != column[None, :]
+            matrix[read_no] *= present[:, None] & present[None, :]
+        return matrix
+
+    def closest(self, min_distance):
+        """Find pairs of libraries closer than `min_distance` on every read.
+
+        Returns:
+            tuple: smallest distance on the most distinct read over all
+                   pairs (None without pairs) and (first, second,
+                   distances) of each close pair
+        """
+        if numpy is None:
+            smallest, close = None, []
+            for first, second, distances in self.pairs():
+                smallest = max(distances) if smallest is None else min(smallest,
+                                                                       max(distances))
+                if max(distances) < min_distance:
+                    close.append((first, second, distances))
+            return smallest, close
+
+        matrix = self.distance_matrix()
+        firsts, seconds = numpy.triu_indices(len(self), 1)
+        if not len(firsts):
+            return None, []
+        pair_distances = matrix[:, firsts, seconds]
+        most_distinct = pair_distances.max(axis=0)
+        close = [(int(firsts[pair]), int(seconds[pair]),
+                  tuple(int(distance) for distance in pair_distances[:, pair]))
+                 for pair in numpy.nonzero(most_distinct < min_distance)[0]]
+        return int(most_distinct.min()), close
+
+
+def safe_mismatches(distances):
+    """Highest mismatch value that still tells two libraries apart.
+
+    bcl2fastq allows mismatches per index read so a read is ambiguous if
+    it's within the mismatches of both libraries on every index read.
+
+    Returns:
+        int: -1 if the libraries can't be told apart at all
+    """
+    return (max(distances) - 1) // 2
+
+
+def check_indexes(rows, min_distance=3):
+    """Find libraries per lane with indexes too similar to demultiplex.
+
+    Args:
+        rows (List[dict]): samplesheet rows with 'lane', 'sample_id', 'index'
+        min_distance (int): report pairs closer than this on every index read
+
+    Returns:
+        dict: lane -> {'collisions': [...], 'barcode_mismatches': int or None}
+    """
+    lanes = {}
+    for row in rows:
+        lanes.setdefault(row['lane'], []).append(row)
+
+    results = {}
+    for lane, lane_rows in sorted(lanes.items()):
+        lane_indexes = LaneIndexes([row['index'] for row in lane_rows])
+        smallest, close = lane_indexes.closest(min_distance)
+        mismatches = MAX_MISMATCHES
+        if smallest is not None:
+            mismatches = min(mismatches, safe_mismatches([smallest]))
+        results[lane] = {
+            'collisions': [{
+                'samples': [lane_rows[first]['sample_id'], lane_rows[second]['sample_id']],
+                'indexes': [lane_rows[first]['index'], lane_rows[second]['index']],
+                'distances': list(distances),
+            } for first, second, distances in close],
+            'barcode_mismatches': mismatches if mismatches >= 0 else None,
+        }
+    return results
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Checkpoint journal to resume interrupted bulk jobs.
+
+Each completed unit of work (a sample, case, ...) is appended as a line
+of JSON and flushed to disk right away so progress survives the job
+being killed at any point. A half written last line is dropped.
+"""
+import codecs
+from datetime import datetime
+import io
+import json
+import logging
+import os
+import stat
+
+log = logging.getLogger(__name__)
+
+
+class Journal(object):
+
+    def __init__(self, path, resume=False):
+        """Journal of completed units in a JSON lines file.
+
+        Args:
+            path (str): path to the journal
+            resume (bool): keep completed units from an earlier run,
+                           otherwise start a new journal
+        """
+        self.path = path
+        self.completed = {}
+        if resume and os.path.exists(path):
+            with io.open(path, 'rb+') as handle:
+                content = handle.read()
+                end = content.rfind(b'\n') + 1
+                if end < len(content):
+                    # new entries would be glued onto the half written line
+                    log.warning("dropping incomplete journal entry: %s",
+                                content[end:].decode('utf-8', 'replace'))
+                    handle.truncate(end)
+            for line in content[:end].decode('utf-8').splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    log.warning("skipping invalid journal entry: %s", line)
+                    continue
+                self.completed[entry['unit']] = entry
+            log.info("resuming after %s completed units", len(self.completed))
+        root_dir = os.path.dirname(path)
+        if root_dir and not os.path.isdir(root_dir):
+            os.makedirs(root_dir)
+        self._handle = codecs.open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def __contains__(self, unit):
+        return unit in self.completed
+
+    def record(self, unit, **info):
+        """Mark a unit as completed, with extra information like offsets."""
+        entry = dict(info, unit=unit, completed_at=datetime.utcnow().isoformat())
+        self._handle.write(json.dumps(entry, sort_keys=True) + '\n')
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self.completed[unit] = entry
+
+    def last(self, key, default=None):
+        """Get a value from the most recent entry, e.g. an output offset."""
+        values = [entry[key] for entry in self.completed.values() if key in entry]
+        return max(values) if values else default
+
+    def close(self):
+        self._handle.close()
+
+
+def output_size(handle):
+    """Size of the file output goes to, None if it isn't a regular file."""
+    try:
+        fileno = handle.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return None
+    info = os.fstat(fileno)
+    return info.st_size if stat.S_ISREG(info.st_mode) else None
+
+
+def trim_output(handle, offset):
+    """Drop output after the last completed unit, e.g. half a YAML document.
+
+    Only output written (or appended) to a regular file can be trimmed.
+
+    Raises:
+        ValueError: if the output is shorter than the offset, i.e. the
+                    earlier output isn't there to continue
+    """
+    size = output_size(handle)
+    if size is None:
+        return
+    if size > offset:
+        log.info("dropping %s bytes of incomplete output", size - offset)
+        os.ftruncate(handle.fileno(), offset)
+    elif size < offset:
+        raise ValueError("output has {} bytes, the journal continues after {}"
+                         .format(size, offset))
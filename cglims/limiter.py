@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Client-side limit on concurrent LIMS requests.
+
+The limit adapts to how the LIMS is doing: it grows slowly while
+requests are fast and successful and is cut in half on slow requests or
+overload responses (AIMD). When the server keeps failing the circuit
+opens and requests fail fast until a cool down period has passed.
+"""
+from __future__ import division
+
+import logging
+import threading
+import time
+
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+from cglims.exc import LimsUnavailableError
+
+log = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter(object):
+
+    def __init__(self, initial=4, minimum=1, maximum=16, target_latency=2.0,
+                 failure_threshold=5, cooldown=30, clock=time.time):
+        """Cap in-flight requests and adapt the cap to server health.
+
+        Args:
+            initial (int): starting concurrency limit
+            minimum (int): the limit never goes below this
+            maximum (int): the limit never goes above this
+            target_latency (float): slower requests (seconds) decrease the limit
+            failure_threshold (int): consecutive failures opening the circuit
+            cooldown (float): seconds to fail fast before probing the server again
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.failures = 0
+        self.opened_at = None
+        self.counts = dict(requests=0, slow=0, overloaded=0, errors=0, rejected=0)
+        self.peaks = dict(in_flight=0, waiting=0)
+        self._condition = threading.Condition()
+
+    @property
+    def is_open(self):
+        """Whether requests are currently failing fast."""
+        return (self.opened_at is not None and
+                self.clock() - self.opened_at < self.cooldown)
+
+    def acquire(self):
+        """Wait for a free slot, failing fast while the circuit is open."""
+        with self._condition:
+            self.waiting += 1
+            self.peaks['waiting'] = max(self.peaks['waiting'], self.waiting)
+            try:
+                while True:
+                    if self.is_open:
+                        self.counts['rejected'] += 1
+                        retry_in = self.cooldown - (self.clock() - self.opened_at)
+                        raise LimsUnavailableError("LIMS unhealthy, retry in {:.0f}s"
+                                                   .format(retry_in))
+                    if self.in_flight < self._allowed():
+                        break
+                    self._condition.wait()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.peaks['in_flight'] = max(self.peaks['in_flight'], self.in_flight)
+
+    def _allowed(self):
+        # after the cool down only a single probe request is let through
+        return 1 if self.opened_at is not None else int(self.limit)
+
+    def cancel(self):
+        """Free a slot without learning anything about the server."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def release(self, latency, status_code=None):
+        """Free a slot and adapt the limit to the outcome of the request.
+
+        Args:
+            latency (float): seconds the request took
+            status_code (Optional[int]): None if the request didn't complete
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.counts['requests'] += 1
+            if status_code is None or status_code == 429 or status_code >= 500:
+                self.counts['errors' if status_code is None else 'overloaded'] += 1
+                self.failures += 1
+                self._decrease()
+                if self.failures >= self.failure_threshold and self.opened_at is None:
+                    log.warning("opening circuit after %s failed LIMS requests", self.failures)
+                    self.opened_at = self.clock()
+                elif self.opened_at is not None:
+                    # probe after cool down failed: stay open a while longer
+                    self.opened_at = self.clock()
+            else:
+                self.failures = 0
+                if self.opened_at is not None:
+                    log.info("closing circuit, LIMS responding again")
+                    self.opened_at = None
+                if latency > self.target_latency:
+                    self.counts['slow'] += 1
+                    self._decrease()
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+    def stats(self):
+        """Summarize the current state for profiling output."""
+        with self._condition:
+            data = dict(self.counts)
+            data.update(limit=int(self.limit), in_flight=self.in_flight,
+                        queue_depth=self.waiting, peak_in_flight=self.peaks['in_flight'],
+                        peak_queue_depth=self.peaks['waiting'],
+                        circuit='open' if self.is_open else 'closed')
+            return data
+
+
+class LimitedAdapter(BaseAdapter):
+
+    """Transport adapter sending requests through a limiter."""
+
+    def __init__(self, limiter, adapter):
+        super(LimitedAdapter, self).__init__()
+        self.limiter = limiter
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        self.limiter.acquire()
+        start = time.time()
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except (ConnectionError, Timeout):
+            self.limiter.release(time.time() - start)
+            raise
+        except Exception:
+            self.limiter.cancel()
+            raise
+        self.limiter.release(time.time() - start, status_code=response.status_code)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def install(lims_api, **options):
+    """Limit the concurrent requests of a LIMS client."""
+    limiter = AdaptiveLimiter(**options)
+    session = lims_api.request_session
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, LimitedAdapter(limiter, session.adapters[prefix]))
+    return limiter
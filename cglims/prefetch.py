@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Warm the persistent cache before many jobs ask for the same data."""
+from collections import OrderedDict
+import logging
+from multiprocessing.pool import ThreadPool
+import time
+
+import click
+
+from cglims import api, store
+from cglims.api import unique_entities
+from cglims.config import HYBRIDIZE_LIBRARY
+from cglims.constants import DEFAULT_CACHE_DIR, RECEPTION_CONTROL
+from cglims.export import EXPORT_PROCESS_TYPES
+from cglims.journal import Journal
+
+# list queries other commands make per sample: `get_received_date` (export)
+# and the capture kit of older samples (pedigree)
+ARTIFACT_QUERIES = ({'process_type': RECEPTION_CONTROL}, {'type': 'Analyte'})
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-p', '--project', 'projects', multiple=True, help='LIMS project id')
+@click.option('-c', '--case', 'cases', multiple=True, help='case id: CUSTOMER-FAMILY')
+@click.option('-f', '--flowcell', 'flowcells', multiple=True, help='flowcell name')
+@click.option('-j', '--jobs', default=8, help='concurrent list queries')
+@click.option('--journal', type=click.Path(dir_okay=False),
+              help='record prefetched projects/cases/flowcells to resume from')
+@click.option('--resume', is_flag=True, help='skip what was completed in the journal')
+@click.pass_context
+def prefetch(context, projects, cases, flowcells, jobs, journal, resume):
+    """Fetch what other commands need into the persistent cache."""
+    if not (projects or cases or flowcells):
+        click.echo("you need to provide a project, case or flowcell")
+        context.abort()
+    elif resume and not journal:
+        click.echo("'--resume' needs a '--journal'")
+        context.abort()
+
+    config = dict(context.obj, cached=False)
+    lims_api = api.connect(config)
+    # always fetch from the LIMS, only store what comes back
+    store.install(lims_api, store.store_path(config.get('cache_dir', DEFAULT_CACHE_DIR)),
+                  read=False)
+
+    units = ([('project', project_id) for project_id in projects] +
+             [('case', case_id) for case_id in cases] +
+             [('flowcell', flowcell) for flowcell in flowcells])
+    checkpoints = Journal(journal, resume=resume) if journal else None
+    if checkpoints:
+        units = [(kind, unit_id) for kind, unit_id in units
+                 if "{}:{}".format(kind, unit_id) not in checkpoints]
+        if not units:
+            checkpoints.close()
+            click.echo("nothing left to prefetch")
+            return
+
+    start = time.time()
+    totals = OrderedDict()
+    pool = ThreadPool(jobs)
+    try:
+        for kind, unit_id in units:
+            lims_samples, artifacts = source_samples(lims_api, kind, unit_id)
+            if not lims_samples:
+                log.error("no samples found for %s: %s", kind, unit_id)
+                context.abort()
+            counts = prefetch_samples(lims_api, lims_samples, pool, artifacts=artifacts)
+            for entity_kind, count in counts:
+                totals[entity_kind] = totals.get(entity_kind, 0) + count
+            if checkpoints:
+                checkpoints.record("{}:{}".format(kind, unit_id))
+    finally:
+        pool.terminate()
+        if checkpoints:
+            checkpoints.close()
+
+    counts_str = ', '.join("{} {}".format(count, kind) for kind, count in totals.items())
+    click.echo("prefetched {} in {:.1f}s".format(counts_str, time.time() - start))
+
+
+def source_samples(lims_api, kind, unit_id):
+    """Get the samples (and flowcell artifacts) of a project, case or flowcell."""
+    lims_samples, artifacts = [], []
+    if kind == 'project':
+        lims_samples.extend(lims_api.iter_samples(projectlimsid=unit_id))
+    elif kind == 'case':
+        lims_samples.extend(lims_api.case(*unit_id.split('-', 1)))
+    elif kind == 'flowcell':
+        for lane, artifact, lims_sample in lims_api.flowcell_samples(unit_id):
+            artifacts.append(artifact)
+            lims_samples.append(lims_sample)
+    return lims_samples, artifacts
+
+
+def prefetch_samples(lims_api, lims_samples, pool, artifacts=()):
+    """Fetch samples and the entities related to them level by level.
+
+    Args:
+        lims_samples (List[Sample]): samples to start from
+        pool (ThreadPool): workers for list queries
+        artifacts (List[Artifact]): artifacts known up front (flowcells)
+
+    Returns:
+        List[tuple]: (kind, number of entities fetched)
+    """
+    counts = []
+    lims_samples = lims_api.fetch(unique_entities(lims_samples))
+    counts.append(('samples', len(lims_samples)))
+
+    projects = lims_api.fetch(unique_entities(lims_sample.project
+                                              for lims_sample in lims_samples))
+    counts.append(('projects', len(projects)))
+
+    case_ids = set((lims_sample.udf.get('customer'), lims_sample.udf.get('familyID'))
+                   for lims_sample in lims_samples)
+    case_ids = [case_id for case_id in case_ids if all(case_id)]
+    case_samples = pool.map(lambda case_id: lims_api.case(*case_id), case_ids)
+    counts.append(('cases', len(case_ids)))
+
+    # the artifact queries planned by export (delivery, sequencing and
+    # library prep per case) and config, with the same arguments so they
+    # end up under the same URLs
+    pool.map(lambda samples: lims_api.get_process_artifacts(
+        [lims_sample.id for lims_sample in samples], EXPORT_PROCESS_TYPES), case_samples)
+    pool.map(lambda lims_sample: lims_api.get_process_artifacts(
+        [lims_sample.id], [HYBRIDIZE_LIBRARY], type='Analyte'), lims_samples)
+
+    queries = [(lims_sample.id, filters) for lims_sample in lims_samples
+               for filters in ARTIFACT_QUERIES]
+    results = pool.map(lambda query: lims_api.get_artifacts(samplelimsid=query[0],
+                                                            **query[1]), queries)
+    all_artifacts = list(artifacts)
+    for sample_artifacts in results:
+        all_artifacts.extend(sample_artifacts)
+    all_artifacts = lims_api.fetch(unique_entities(all_artifacts))
+    counts.append(('artifacts', len(all_artifacts)))
+
+    processes = lims_api.fetch(unique_entities(artifact.parent_process
+                                               for artifact in all_artifacts))
+    counts.append(('processes', len(processes)))
+    process_types = lims_api.fetch(unique_entities(process.type for process in processes))
+    counts.append(('process types', len(process_types)))
+
+    containers = lims_api.fetch(unique_entities(artifact.container
+                                                for artifact in all_artifacts))
+    counts.append(('containers', len(containers)))
+
+    labels = set(label for artifact in all_artifacts for label in artifact.reagent_labels)
+    pool.map(lambda label: lims_api.get_reagent_types(name=label), labels)
+    counts.append(('reagent labels', len(labels)))
+    return counts
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Find out which cases are ready to be analyzed and in which pipeline."""
+from datetime import datetime, timedelta
+import logging
+import os
+
+import click
+import yaml
+
+from cglims import api
+from cglims.api import ClinicalSample, unique_entities
+from cglims.config import relevant_samples
+from cglims.constants import (CLOCK_MARGIN, DEFAULT_CACHE_DIR, LIMS_TIMESTAMP, RECEPTION_CONTROL,
+                               SEQUENCING_TYPES)
+from cglims.cli.utils import jsonify
+from cglims.exc import UnknownSequencingTypeError
+from cglims.watch import MAX_RETRIES, Watermark
+# how long emitted units are remembered to not emit them again
+EMITTED_RETENTION = timedelta(days=30)
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('--since', help='start from this LIMS timestamp instead of the watermark')
+@click.option('--state', type=click.Path(dir_okay=False),
+              help='file to keep the watermark in')
+@click.option('-a', '--all', 'all_units', is_flag=True, help='include units not ready yet')
+@click.option('-o', '--output', type=click.Choice(['json', 'yaml']), default='json',
+              help='one JSON work unit per line or a YAML list')
+@click.pass_context
+def queue(context, since, state, all_units, output):
+    """List cases with new samples which are ready to be analyzed."""
+    cache_dir = context.obj.get('cache_dir', DEFAULT_CACHE_DIR)
+    watermark = Watermark(state or os.path.join(os.path.expanduser(cache_dir), 'queue.json'))
+    queue_state = watermark.load()
+    since = since or queue_state.get('since')
+    if since is None:
+        click.echo("you need to provide '--since' the first time")
+        context.abort()
+    now = datetime.utcnow()
+    polled_at = (now - CLOCK_MARGIN).strftime(LIMS_TIMESTAMP)
+
+    lims_api = api.connect(context.obj)
+    lims_samples = changed_samples(lims_api, since)
+    log.info("found %s received or sequenced samples since %s", len(lims_samples), since)
+    failed = queue_state.get('failed', {})
+    units, unresolved = work_units(lims_api, lims_samples, case_ids=sorted(failed))
+    emitted = forget_emitted(queue_state.get('emitted', {}),
+                             (now - EMITTED_RETENTION).strftime(LIMS_TIMESTAMP))
+    units = [unit for unit in new_units(units, emitted, polled_at)
+             if all_units or unit['ready']]
+
+    if output == 'json':
+        for unit in units:
+            click.echo(jsonify(unit))
+    else:
+        click.echo(yaml.safe_dump(units, default_flow_style=False, allow_unicode=True),
+                   nl=False)
+    watermark.save({'since': polled_at, 'emitted': emitted,
+                    'failed': retries(failed, unresolved)})
+
+
+def new_units(units, emitted, seen_at):
+    """Pick out units which are new or have changed since they were emitted.
+
+    Runs overlap by `CLOCK_MARGIN` and cases show up again whenever one
+    of their processes is modified. Ready units are only emitted again if
+    their samples have changed. Units not ready yet are always kept.
+
+    Args:
+        emitted (dict): 'samples' of each ready unit emitted before and
+                        when it was last 'seen_at', updated with the units
+        seen_at (str): LIMS timestamp of the current run
+    """
+    picked = []
+    for unit in units:
+        if not unit['ready']:
+            picked.append(unit)
+            continue
+        kind = 'case' if 'case' in unit else 'project'
+        key = "{}:{}:{}".format(kind, unit[kind], unit['pipeline'])
+        sample_ids = sorted(sample['id'] for sample in unit['samples'])
+        if key not in emitted or emitted[key]['samples'] != sample_ids:
+            picked.append(unit)
+        emitted[key] = {'samples': sample_ids, 'seen_at': seen_at}
+    return picked
+
+
+def forget_emitted(emitted, before):
+    """Drop emitted units not seen since a LIMS timestamp.
+
+    Keeps the state from growing with every case ever emitted. A unit
+    showing up again after that is emitted once more.
+    """
+    return {key: entry for key, entry in emitted.items() if entry['seen_at'] >= before}
+
+
+def retries(failed, unresolved):
+    """Count attempts to resolve cases, giving up after `MAX_RETRIES`.
+
+    Returns:
+        dict: case id -> attempts, to retry in the next run
+    """
+    attempts = {}
+    for case_id in unresolved:
+        count = failed.get(case_id, 0) + 1
+        if count < MAX_RETRIES:
+            attempts[case_id] = count
+        else:
+            log.error("%s: giving up after %s attempts", case_id, count)
+    return attempts
+
+
+def changed_samples(lims_api, since):
+    """Get samples received or sequenced since a LIMS timestamp.
+
+    Processes are listed in a single query and their inputs and samples
+    are batch retrieved.
+    """
+    type_names = [RECEPTION_CONTROL] + list(lims_api.process_type_names(SEQUENCING_TYPES)
+                                            .values())
+    lims_processes = lims_api.fetch(lims_api.get_processes(type=type_names,
+                                                           last_modified=since))
+    artifacts = unique_entities(artifact for lims_process in lims_processes
+                                for artifact in lims_process.all_inputs())
+    lims_api.load_related(artifacts, 'samples')
+    return unique_entities(lims_sample for artifact in artifacts
+                           for lims_sample in artifact.samples)
+
+
+def work_units(lims_api, lims_samples, case_ids=()):
+    """Group samples with the rest of their case into work units.
+
+    Samples which aren't part of a case (e.g. microbial) are grouped by
+    project. A unit is ready when all its relevant samples (not cancelled
+    or excluded) have been sequenced.
+
+    Args:
+        lims_samples (List[Sample]): changed samples
+        case_ids (List[str]): more cases to include, e.g. to retry
+
+    Returns:
+        tuple: a unit per case/project and pipeline, sorted by id, and ids
+               of cases which couldn't be resolved
+    """
+    case_ids, project_ids = set(case_ids), set()
+    for lims_sample in lims_samples:
+        case_id = ClinicalSample(lims_sample).case_id
+        if case_id != 'NA':
+            case_ids.add(case_id)
+        else:
+            project_ids.add(lims_sample.project.id)
+
+    groups, unresolved = [], []
+    resolved = lims_api.resolve_samples(sorted(case_ids))
+    for case_id in sorted(case_ids):
+        if isinstance(resolved[case_id], Exception):
+            log.error("can't resolve case: %s", resolved[case_id])
+            unresolved.append(case_id)
+            continue
+        groups.append(('case', case_id, resolved[case_id]))
+    for project_id in sorted(project_ids):
+        project_samples = lims_api.fetch(lims_api.get_samples(projectlimsid=project_id))
+        groups.append(('project', project_id, [
+            lims_sample for lims_sample in project_samples
+            if ClinicalSample(lims_sample).case_id == 'NA']))
+
+    members = [lims_sample for kind, group_id, group_samples in groups
+               for lims_sample in relevant_samples(group_samples)]
+    sequenced = lims_api.get_process_artifacts([lims_sample.id for lims_sample in members],
+                                               SEQUENCING_TYPES)
+
+    units = []
+    for kind, group_id, group_samples in groups:
+        pipelines = {}
+        for lims_sample in relevant_samples(group_samples):
+            sample_obj = ClinicalSample(lims_sample)
+            try:
+                pipeline = sample_obj.pipeline
+                sequencing_type = sample_obj.apptag.sequencing_type
+            except (KeyError, UnknownSequencingTypeError) as error:
+                log.error("%s: can't route sample %s: %s", group_id, lims_sample.id, error)
+                continue
+            pipelines.setdefault(pipeline or 'NA', []).append({
+                'id': lims_sample.id,
+                'name': lims_sample.name,
+                'sequencing_type': sequencing_type,
+                'sequenced': bool(sequenced.get(lims_sample.id)),
+            })
+        for pipeline, samples in sorted(pipelines.items()):
+            waiting = [sample['id'] for sample in samples if not sample['sequenced']]
+            units.append({kind: group_id, 'pipeline': pipeline, 'samples': samples,
+                          'ready': not waiting, 'waiting_for': waiting})
+    return units, unresolved
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Generate samplesheets for many flowcells at once."""
+import codecs
+import csv
+from datetime import datetime
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import re
+
+import click
+from six import StringIO
+
+from cglims import api
+from cglims.constants import CLOCK_MARGIN, DEFAULT_CACHE_DIR, LIMS_TIMESTAMP
+from cglims.indexes import check_indexes
+
+HEADERS = [('fcid', 'FCID'), ('lane', 'Lane'), ('sample_id', 'SampleID'),
+           ('sample_ref', 'SampleRef'), ('index', 'Index'),
+           ('description', 'Description'), ('control', 'Control'),
+           ('recipe', 'Recipe'), ('operator', 'Operator'),
+           ('project', 'SampleProject')]
+# flowcell ids like HGYFNBCXX or 000000000-A1B2C, safe to use in file names
+FLOWCELL_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9-]*$')
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-j', '--jobs', default=4, help='flowcells to resolve concurrently')
+@click.option('-o', '--outdir', type=click.Path(file_okay=False),
+              help='write a samplesheet per flowcell to this directory')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              help='where to cache rendered samplesheets')
+@click.option('--force', is_flag=True, help='ignore cached samplesheets')
+@click.argument('flowcells', nargs=-1, required=True)
+@click.pass_context
+def samplesheet(context, jobs, outdir, cache_dir, force, flowcells):
+    """Generate samplesheets for one or more flowcells."""
+    invalid = [flowcell for flowcell in flowcells if not FLOWCELL_PATTERN.match(flowcell)]
+    if invalid:
+        click.echo("invalid flowcell ids: {}".format(', '.join(invalid)))
+        context.abort()
+    lims_api = api.connect(context.obj)
+    cache_dir = cache_dir or context.obj.get('cache_dir', DEFAULT_CACHE_DIR)
+    cache = SamplesheetCache(os.path.join(os.path.expanduser(cache_dir), 'samplesheets'))
+
+    def generate(flowcell):
+        return flowcell, cached_samplesheet(lims_api, cache, flowcell, force=force)
+
+    pool = ThreadPool(min(jobs, len(flowcells)))
+    try:
+        results = pool.imap(generate, flowcells)
+        for flowcell, rows in results:
+            if not rows:
+                log.error("flowcell not found: %s", flowcell)
+                continue
+            content = serialize(rows)
+            if outdir:
+                if not os.path.isdir(outdir):
+                    os.makedirs(outdir)
+                out_path = os.path.join(outdir, "{}.csv".format(flowcell))
+                with codecs.open(out_path, 'w', encoding='utf-8') as out_handle:
+                    out_handle.write(content)
+                log.info("%s: samplesheet written to %s", flowcell, out_path)
+            else:
+                click.echo(content, nl=False)
+    finally:
+        pool.terminate()
+
+
+def cached_samplesheet(lims_api, cache, flowcell, force=False):
+    """Render a samplesheet unless the flowcell is unchanged since last time.
+
+    Revalidating a cached samplesheet costs a single request: asking for
+    the flowcell container only if it was modified since it was cached.
+    """
+    cached = None if force else cache.get(flowcell)
+    if cached:
+        modified = lims_api.get_containers(name=flowcell,
+                                           last_modified=cached['checked_at'])
+        if not modified:
+            log.debug("%s: using cached samplesheet", flowcell)
+            return cached['rows']
+
+    # anything modified from here on is picked up by the next revalidation
+    checked_at = (datetime.utcnow() - CLOCK_MARGIN).strftime(LIMS_TIMESTAMP)
+    rows = list(lims_api.samplesheet(flowcell))
+    for lane, result in check_indexes(rows).items():
+        for collision in result['collisions']:
+            log.warning("%s lane %s: indexes too similar: %s", flowcell, lane,
+                        ', '.join(collision['samples']))
+    if rows:
+        cache.set(flowcell, {'checked_at': checked_at, 'rows': rows})
+    return rows
+
+
+def serialize(rows):
+    """Serialize samplesheet rows to CSV."""
+    output = StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow([header for key, header in HEADERS])
+    for row in rows:
+        writer.writerow([row[key] for key, header in HEADERS])
+    return output.getvalue()
+
+
+class SamplesheetCache(object):
+
+    def __init__(self, root_dir):
+        """Rendered samplesheets stored as one JSON file per flowcell."""
+        self.root_dir = root_dir
+
+    def _path(self, flowcell):
+        # keep names like '../x' from pointing outside the cache
+        if not FLOWCELL_PATTERN.match(flowcell):
+            raise ValueError("invalid flowcell id: {}".format(flowcell))
+        return os.path.join(self.root_dir, "{}.json".format(flowcell))
+
+    def get(self, flowcell):
+        """Get a cached samplesheet or None."""
+        path = self._path(flowcell)
+        if not os.path.exists(path):
+            return None
+        with codecs.open(path, 'r', encoding='utf-8') as handle:
+            return json.load(handle)
+
+    def set(self, flowcell, data):
+        """Cache a rendered samplesheet."""
+        path = self._path(flowcell)
+        if not os.path.isdir(self.root_dir):
+            os.makedirs(self.root_dir)
+        # write to a temporary file first to never leave half written caches
+        with codecs.open(path + '.tmp', 'w', encoding='utf-8') as handle:
+            json.dump(data, handle)
+        os.rename(path + '.tmp', path)
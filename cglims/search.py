@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Find cached samples by (part of) their LIMS id, name, customer or CG id.
+
+Lookups use the search index of the persistent store: prefix matches
+come from an index on the terms, substring and fuzzy matches from their
+trigrams. Fuzzy matches are ranked by trigram similarity.
+"""
+from __future__ import division
+
+import logging
+import os
+
+import click
+
+from cglims import store
+from cglims.constants import DEFAULT_CACHE_DIR
+from cglims.store import search_term, trigrams
+
+# how similar a term has to be to count as a fuzzy match
+MIN_SIMILARITY = 0.3
+# fuzzy candidates to rank before picking the best matches
+CANDIDATES = 200
+# most index entries read per term range or trigram
+SCAN_LIMIT = 1000
+# how matches rank, best first
+MATCH_KINDS = ('exact', 'prefix', 'substring', 'fuzzy')
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-c', '--customer', help='only samples of a customer')
+@click.option('-f', '--field', 'fields', multiple=True,
+              type=click.Choice(sorted(store.SEARCH_FIELDS)),
+              help='only match these fields, default: all')
+@click.option('-l', '--limit', default=20, help='max number of samples')
+@click.option('--rebuild', is_flag=True, help='rebuild the index from the store')
+@click.argument('query')
+@click.pass_context
+def search(context, customer, fields, limit, rebuild, query):
+    """Search cached samples by LIMS id, name, customer or CG id."""
+    cache_dir = context.obj.get('cache_dir', DEFAULT_CACHE_DIR)
+    store_path = store.store_path(cache_dir)
+    if not os.path.exists(store_path):
+        click.echo("no cached LIMS data, run 'cglims prefetch' first")
+        context.abort()
+
+    entity_store = store.EntityStore(store_path)
+    if rebuild or not entity_store.connection.execute(
+            'SELECT 1 FROM search_terms LIMIT 1').fetchone():
+        log.info("building the search index")
+        entity_store.reindex()
+
+    matches = find(entity_store, query, fields=fields or None, customer=customer, limit=limit)
+    if not matches:
+        log.error("no matching samples")
+        context.abort()
+    for match in matches:
+        click.echo('\t'.join([match['sample_id'], match.get('name', ''),
+                              match.get('customer', ''), match.get('cgid', ''),
+                              "{}:{}".format(match['match'], match['field'])]))
+
+
+def find(entity_store, query, fields=None, customer=None, limit=20):
+    """Look up samples by exact, prefix, substring or fuzzy matches.
+
+    Args:
+        query (str): (part of) a LIMS id, name, customer or CG id
+        fields (Optional[List[str]]): only match these fields
+        customer (Optional[str]): only samples of this customer
+
+    Returns:
+        List[dict]: best match per sample with its 'match' kind, matched
+                    'field' and values of the sample, best first
+    """
+    connection = entity_store.connection
+    term = search_term(query)
+    fields = set(fields or store.SEARCH_FIELDS)
+    # other customers' samples mustn't crowd out the fallbacks below
+    only, only_params = customer_filter('t', customer)
+    # (rank, similarity) -> lower is better
+    ranked = {}
+
+    def add(sample_id, field, kind, similarity=1.0):
+        if field not in fields:
+            return
+        rank = (MATCH_KINDS.index(kind), -similarity)
+        if sample_id not in ranked or rank < ranked[sample_id][0]:
+            ranked[sample_id] = (rank, field, kind)
+
+    # prefix (and exact) matches through the index on terms, exact first
+    rows = connection.execute(
+        'SELECT t.sample_id, t.field, t.term FROM (SELECT sample_id, field, term'
+        ' FROM search_terms WHERE term >= ? AND term < ? ORDER BY term LIMIT ?) t'
+        ' WHERE 1' + only + ' LIMIT ?',
+        [term, term + u'\uffff', SCAN_LIMIT if customer else CANDIDATES] + only_params +
+        [CANDIDATES])
+    for sample_id, field, other in rows:
+        add(sample_id, field, 'exact' if other == term else 'prefix')
+
+    if len(ranked) < limit and len(term) >= 3:
+        # substring matches contain every trigram of the query, the two
+        # rarest ones narrow it down the most
+        counts = trigram_counts(connection, trigrams(term, padded=False), CANDIDATES)
+        rarest, other = counts[0][1], counts[min(1, len(counts) - 1)][1]
+        rows = connection.execute(
+            'SELECT t.sample_id, t.field FROM (SELECT sample_id, field FROM search_trigrams g'
+            ' WHERE trigram = ? AND EXISTS (SELECT 1 FROM search_trigrams h'
+            ' WHERE h.trigram = ? AND h.sample_id = g.sample_id AND h.field = g.field)'
+            ' LIMIT ?) g JOIN search_terms t ON t.sample_id = g.sample_id'
+            ' AND t.field = g.field WHERE instr(t.term, ?)' + only + ' LIMIT ?',
+            [rarest, other, SCAN_LIMIT, term] + only_params + [limit])
+        for sample_id, field in rows:
+            add(sample_id, field, 'substring')
+
+    # fuzzy matches share enough trigrams with the query, only needed if
+    # nothing matches better e.g. because of a typo. Candidates have to
+    # share a rare trigram, common ones would only give a few of their
+    # terms.
+    if not ranked:
+        query_grams = trigrams(term)
+        counts = trigram_counts(connection, query_grams, SCAN_LIMIT)
+        rare = [trigram for count, trigram in counts if count < SCAN_LIMIT]
+        postings = ' UNION ALL '.join(['SELECT * FROM (SELECT sample_id, field FROM'
+                                       ' search_trigrams WHERE trigram = ? LIMIT ?)'] *
+                                      len(rare or query_grams))
+        posting_params = [value for trigram in rare or sorted(query_grams)
+                          for value in (trigram, SCAN_LIMIT)]
+        rows = connection.execute(
+            'SELECT t.sample_id, t.field, t.term FROM search_terms t JOIN ('
+            ' SELECT s.sample_id, s.field, COUNT(*) AS shared FROM ({}) s WHERE 1{}'
+            ' GROUP BY s.sample_id, s.field ORDER BY shared DESC LIMIT ?) g'
+            ' ON t.sample_id = g.sample_id AND t.field = g.field'
+            .format(postings, customer_filter('s', customer)[0]),
+            posting_params + only_params + [CANDIDATES])
+        for sample_id, field, other in rows:
+            other_grams = trigrams(other)
+            shared = len(other_grams.intersection(query_grams))
+            similarity = shared / len(other_grams.union(query_grams))
+            if similarity >= MIN_SIMILARITY:
+                add(sample_id, field, 'fuzzy', similarity)
+
+    best = sorted(ranked.items(), key=lambda item: (item[1][0], item[0]))[:limit]
+    values = sample_values(connection, [sample_id for sample_id, ranking in best])
+    matches = []
+    for sample_id, (rank, field, kind) in best:
+        match = values.get(sample_id, {})
+        match.update(sample_id=sample_id, field=field, match=kind)
+        matches.append(match)
+    return matches
+
+
+def customer_filter(alias, customer):
+    """SQL condition keeping samples of a customer and its parameters."""
+    if not customer:
+        return '', []
+    return (" AND EXISTS (SELECT 1 FROM search_terms c WHERE c.sample_id = {}.sample_id"
+            " AND c.field = 'customer' AND c.value = ?)".format(alias), [customer])
+
+
+def trigram_counts(connection, grams, limit):
+    """Count the terms of each trigram up to `limit`, rarest first."""
+    counts = []
+    for trigram in sorted(grams):
+        count = connection.execute('SELECT COUNT(*) FROM (SELECT 1 FROM search_trigrams'
+                                   ' WHERE trigram = ? LIMIT ?)', (trigram, limit)).fetchone()[0]
+        counts.append((count, trigram))
+    return sorted(counts)
+
+
+def sample_values(connection, sample_ids):
+    """Get the indexed values of samples.
+
+    Returns:
+        dict: sample id -> field -> value
+    """
+    values = {}
+    rows = connection.execute('SELECT sample_id, field, value FROM search_terms'
+                              ' WHERE sample_id IN ({})'.format(', '.join('?' * len(sample_ids))),
+                              sample_ids)
+    for sample_id, field, value in rows:
+        values.setdefault(sample_id, {})[field] = value
+    return values
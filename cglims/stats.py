@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Turnaround, volume and backlog statistics over cached samples.
+
+Samples, artifacts and processes in the persistent store (see `prefetch`)
+are condensed into a columnar table with one row per sample which is kept
+next to the store and only rebuilt when the store has changed. Reports
+are computed column-wise over the whole table, on numpy arrays if numpy
+is installed.
+"""
+from __future__ import division
+
+from collections import OrderedDict
+import codecs
+from datetime import date, datetime
+from itertools import compress
+import json
+import logging
+import os
+from xml.etree import ElementTree
+
+import click
+import six
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cglims import store
+from cglims.apptag import ApplicationTag, UnknownSequencingTypeError
+from cglims.cli.utils import jsonify
+from cglims.constants import (DEFAULT_CACHE_DIR, DELIVERY_TYPE, RECEIVED_UDF, RECEPTION_CONTROL,
+                              SEQUENCING_TYPES)
+
+TABLE_FILE = 'samples-table.json'
+COLUMNS = ('sample_id', 'customer', 'apptag', 'category', 'status', 'month', 'received',
+           'sequenced', 'delivered')
+DATE_COLUMNS = ('received', 'sequenced', 'delivered')
+STATUSES = ('registered', 'received', 'sequenced', 'delivered', 'cancelled')
+# turnaround in days between two dates of a sample
+SPANS = (('to_sequenced', 'received', 'sequenced'),
+         ('to_delivered', 'sequenced', 'delivered'),
+         ('total', 'received', 'delivered'))
+REPORTS = {'volume': 'customer', 'turnaround': 'category', 'backlog': 'category'}
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-b', '--by', type=click.Choice(['customer', 'apptag', 'category', 'month']),
+              help='group samples by, default depends on the report')
+@click.option('-s', '--since', help='only samples received from this date (YYYY-MM-DD)')
+@click.option('-o', '--output', type=click.Choice(['tsv', 'json']), default='tsv')
+@click.option('--rebuild', is_flag=True, help='rebuild the sample table from the store')
+@click.argument('report', type=click.Choice(sorted(REPORTS)))
+@click.pass_context
+def stats(context, by, since, output, rebuild, report):
+    """Summarize turnaround, volumes or backlog of cached samples."""
+    cache_dir = os.path.expanduser(context.obj.get('cache_dir', DEFAULT_CACHE_DIR))
+    store_path = store.store_path(cache_dir)
+    if not os.path.exists(store_path):
+        click.echo("no cached LIMS data, run 'cglims prefetch' first")
+        context.abort()
+
+    table = load_table(store.EntityStore(store_path), os.path.join(cache_dir, TABLE_FILE),
+                       rebuild=rebuild)
+    if since:
+        start = to_day(since)
+        table = table.select(table.since('received', start))
+    rows = REPORT_FUNCTIONS[report](table, by or REPORTS[report])
+
+    if output == 'json':
+        for row in rows:
+            click.echo(jsonify(row))
+    elif rows:
+        click.echo('\t'.join(rows[0].keys()))
+        for row in rows:
+            click.echo('\t'.join('' if value is None else "{}".format(value)
+                                 for value in row.values()))
+
+
+class SampleTable(object):
+
+    def __init__(self, columns):
+        """Samples as one array of values per column, lists without numpy.
+
+        Dates are stored as day ordinals, missing ones as NaN and missing
+        strings as '' (both None in lists). Columns are turned into arrays
+        when they're first used.
+
+        Args:
+            columns (dict): column name -> list (or array) of values
+        """
+        self.columns = columns
+
+    def __getitem__(self, name):
+        values = self.columns[name]
+        if numpy is not None and not isinstance(values, numpy.ndarray):
+            values = self.columns[name] = to_array(name, values)
+        return values
+
+    def __len__(self):
+        return len(self.columns['sample_id'])
+
+    def lists(self):
+        """The columns as lists of JSON values."""
+        return {name: to_list(name, values) for name, values in self.columns.items()}
+
+    def select(self, mask):
+        """Keep the rows where the mask is true."""
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=bool)
+        return SampleTable({name: values[mask] if numpy is not None and
+                            isinstance(values, numpy.ndarray) else list(compress(values, mask))
+                            for name, values in self.columns.items()})
+
+    def present(self, name):
+        """Mask of rows with a date in a column."""
+        if numpy is not None:
+            return ~numpy.isnan(self[name])
+        return [day is not None for day in self[name]]
+
+    def since(self, name, day):
+        """Mask of rows with a date in a column from `day` on."""
+        if numpy is not None:
+            return self[name] >= day
+        return [value is not None and value >= day for value in self[name]]
+
+    def isin(self, name, values):
+        """Mask of rows with one of `values` in a column."""
+        if numpy is not None:
+            column = self[name]
+            mask = numpy.zeros(len(self), dtype=bool)
+            for value in values:
+                mask |= column == value
+            return mask
+        return [value in values for value in self[name]]
+
+    def groups(self, name):
+        """Row indexes for each value of a column, sorted by value, None last."""
+        if numpy is None:
+            indexes = {}
+            for index, value in enumerate(self[name]):
+                indexes.setdefault(value, []).append(index)
+            return sorted(indexes.items(), key=lambda item: (item[0] is None, item[0]))
+
+        column = self[name]
+        missing = column == ''
+        rows = numpy.flatnonzero(~missing)
+        keys, codes = numpy.unique(column[rows], return_inverse=True)
+        # rows sorted by key, split where the key changes
+        rows = rows[numpy.argsort(codes, kind='stable')]
+        bounds = numpy.cumsum(numpy.bincount(codes, minlength=len(keys)))[:-1]
+        groups = list(zip(keys.tolist(), numpy.split(rows, bounds)))
+        if missing.any():
+            groups.append((None, numpy.flatnonzero(missing)))
+        return groups
+
+    def take(self, name, indexes):
+        """Values of a column in the given rows."""
+        return take(self[name], indexes)
+
+
+def to_array(name, values):
+    """Turn a list of column values into a numpy array."""
+    if name in DATE_COLUMNS:
+        return numpy.array(values, dtype=float)
+    return numpy.array(['' if value is None else value for value in values],
+                       dtype=six.text_type)
+
+
+def to_list(name, values):
+    """Turn column values back into a list, None where missing."""
+    if numpy is None or not isinstance(values, numpy.ndarray):
+        return values
+    if name in DATE_COLUMNS:
+        return [None if numpy.isnan(day) else int(day) for day in values.tolist()]
+    return [value or None for value in values.tolist()]
+
+
+def load_table(entity_store, path, rebuild=False):
+    """Load the sample table, rebuilding it if the store has changed."""
+    signature = entity_store.signature()
+    if not rebuild and os.path.exists(path):
+        with codecs.open(path, 'r', encoding='utf-8') as handle:
+            data = json.load(handle)
+        # tables of older versions lack columns
+        if data['signature'] == signature and set(data['columns']) == set(COLUMNS):
+            return SampleTable(data['columns'])
+
+    log.info("building sample table from: %s", entity_store.path)
+    table = build_table(entity_store)
+    with codecs.open(path + '.tmp', 'w', encoding='utf-8') as handle:
+        json.dump({'signature': signature, 'columns': table.lists()}, handle)
+    os.rename(path + '.tmp', path)
+    return table
+
+
+def build_table(entity_store):
+    """Condense stored samples, artifacts and processes into a table."""
+    # when each reception/sequencing/delivery process happened
+    events = {}
+    for uri, content in entity_store.entities('processes'):
+        process = parse_entity(content)
+        if process['type-name'] == RECEPTION_CONTROL:
+            events[uri] = ('received', process['udf'].get(RECEIVED_UDF))
+        elif process['type'] in SEQUENCING_TYPES:
+            events[uri] = ('sequenced', process['date-run'])
+        elif process['type'] == DELIVERY_TYPE:
+            events[uri] = ('delivered', process['udf'].get('Date delivered'))
+
+    # the first time each sample was received/sequenced/delivered
+    sample_dates = {}
+    for uri, content in entity_store.entities('artifacts'):
+        artifact = parse_entity(content)
+        event, value = events.get(artifact['parent-process'], (None, None))
+        day = to_day(value)
+        if day is None:
+            continue
+        for sample_id in artifact['samples']:
+            dates = sample_dates.setdefault(sample_id, {})
+            dates[event] = min(dates.get(event, day), day)
+
+    columns = {name: [] for name in COLUMNS}
+    for uri, content in entity_store.entities('samples'):
+        sample = parse_entity(content)
+        dates = sample_dates.get(sample['limsid'], {})
+        raw_apptag = sample['udf'].get('Sequencing Analysis')
+        try:
+            category = ApplicationTag(raw_apptag).category if raw_apptag else None
+        except UnknownSequencingTypeError:
+            category = None
+        row = {
+            'sample_id': sample['limsid'],
+            'customer': sample['udf'].get('customer'),
+            'apptag': raw_apptag,
+            'category': category,
+            # like `get_received_date`, not when the sample was registered
+            'received': dates.get('received'),
+            'sequenced': dates.get('sequenced'),
+            'delivered': dates.get('delivered'),
+        }
+        if sample['udf'].get('cancelled') == 'yes':
+            row['status'] = 'cancelled'
+        else:
+            row['status'] = next((status for status in ('delivered', 'sequenced', 'received')
+                                  if row[status] is not None), 'registered')
+        row['month'] = (date.fromordinal(row['received']).strftime('%Y-%m')
+                        if row['received'] else None)
+        for name in COLUMNS:
+            columns[name].append(row[name])
+    return SampleTable(columns)
+
+
+def parse_entity(content):
+    """Pick out what the table needs from the XML of an entity."""
+    root = ElementTree.fromstring(content)
+    data = {'limsid': root.get('limsid'), 'type': None, 'type-name': None, 'date-run': None,
+            'parent-process': None, 'samples': [], 'udf': {}}
+    for element in root:
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'field':
+            data['udf'][element.get('name')] = element.text
+        elif tag == 'type':
+            data['type'] = element.get('uri', '').rstrip('/').rsplit('/', 1)[-1]
+            data['type-name'] = element.text
+        elif tag == 'parent-process':
+            data['parent-process'] = element.get('uri')
+        elif tag == 'sample':
+            data['samples'].append(element.get('limsid'))
+        elif tag == 'date-run':
+            data[tag] = element.text
+    return data
+
+
+def to_day(value):
+    """Convert a LIMS date (YYYY-MM-DD...) to a day ordinal."""
+    if not value:
+        return None
+    return datetime.strptime(value[:10], '%Y-%m-%d').toordinal()
+
+
+def percentile(ordered, percent):
+    """Value below which `percent` of sorted values fall or None."""
+    if not len(ordered):
+        return None
+    return int(ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))])
+
+
+def summarize(prefix, values):
+    """Median, 90th percentile and mean of days, leaving out missing ones."""
+    if numpy is not None:
+        ordered = numpy.sort(values[~numpy.isnan(values)])
+    else:
+        ordered = sorted(value for value in values if value is not None)
+    total = ordered.sum() if numpy is not None else sum(ordered)
+    mean = round(float(total) / len(ordered), 1) if len(ordered) else None
+    return [(prefix + '_median', percentile(ordered, 50)),
+            (prefix + '_p90', percentile(ordered, 90)),
+            (prefix + '_mean', mean)]
+
+
+def take(values, indexes):
+    """Values in the given rows of a column."""
+    if numpy is not None:
+        return values[indexes]
+    return [values[index] for index in indexes]
+
+
+def count(values, value):
+    """How many of the values are `value`."""
+    if numpy is not None:
+        return int(numpy.count_nonzero(values == value))
+    return values.count(value)
+
+
+def days_between(starts, ends):
+    """Days from each start to end (or a single end day), missing if either is."""
+    if numpy is not None:
+        return ends - starts
+    if not isinstance(ends, list):
+        ends = [ends] * len(starts)
+    return [None if start is None or end is None else end - start
+            for start, end in zip(starts, ends)]
+
+
+def volume(table, by):
+    """Number of samples in each status per group."""
+    rows = []
+    for key, indexes in table.groups(by):
+        row = OrderedDict([(by, key), ('samples', len(indexes))])
+        statuses = table.take('status', indexes)
+        row.update((status, count(statuses, status)) for status in STATUSES)
+        rows.append(row)
+    return rows
+
+
+def turnaround(table, by):
+    """Days between receiving, sequencing and delivering samples per group."""
+    table = table.select(table.isin('status', [status for status in STATUSES
+                                               if status != 'cancelled']))
+    spans = [(name, days_between(table[first], table[last])) for name, first, last in SPANS]
+    rows = []
+    for key, indexes in table.groups(by):
+        row = OrderedDict([(by, key), ('samples', len(indexes))])
+        for name, days in spans:
+            row.update(summarize(name, take(days, indexes)))
+        rows.append(row)
+    return rows
+
+
+def backlog(table, by, today=None):
+    """Received samples waiting for delivery and for how many days per group."""
+    table = table.select(table.isin('status', ['received', 'sequenced']))
+    table = table.select(table.present('received'))
+    today = (today or date.today()).toordinal()
+    waiting = days_between(table['received'], today)
+    rows = []
+    for key, indexes in table.groups(by):
+        row = OrderedDict([(by, key), ('samples', len(indexes))])
+        statuses = table.take('status', indexes)
+        row['received'] = count(statuses, 'received')
+        row['sequenced'] = count(statuses, 'sequenced')
+        group_waiting = take(waiting, indexes)
+        row.update(summarize('waiting', group_waiting))
+        row['waiting_max'] = int(max(group_waiting))
+        rows.append(row)
+    return rows
+
+
+REPORT_FUNCTIONS = {'volume': volume, 'turnaround': turnaround, 'backlog': backlog}
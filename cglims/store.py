@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of LIMS responses.
+
+Responses to GET requests (entities as well as list queries) are stored
+by URL in a SQLite database shared between processes. Entities fetched
+with batch retrieve are stored under their own URL so a later GET of a
+single entity is served from the cache too.
+
+Stored samples are indexed by LIMS id, name, customer and Clinical
+Genomics id (terms and their trigrams) to look them up without the LIMS, see `search`.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from xml.etree import ElementTree
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from six import BytesIO
+from six.moves.urllib.parse import urlsplit
+
+STORE_FILE = 'lims.sqlite3'
+# seconds a stored response is served without asking the LIMS
+CACHE_TTL = 3600
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    uri TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    content BLOB NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_kind ON responses (kind);
+CREATE TABLE IF NOT EXISTS search_terms (
+    sample_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (sample_id, field)
+);
+CREATE INDEX IF NOT EXISTS search_terms_term ON search_terms (term);
+CREATE TABLE IF NOT EXISTS search_trigrams (
+    trigram TEXT NOT NULL,
+    sample_id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    PRIMARY KEY (trigram, sample_id, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS search_trigrams_sample ON search_trigrams (sample_id);
+"""
+# searchable fields of samples: field -> UDF (or None for the id and name)
+SEARCH_FIELDS = {'id': None, 'name': None, 'customer': 'customer',
+                 'cgid': 'Clinical Genomics ID'}
+# fields to find by substring or typos, ids and customers are only looked
+# up by prefix
+TRIGRAM_FIELDS = ('name', 'cgid')
+
+log = logging.getLogger(__name__)
+
+
+def search_term(value):
+    """Normalize a value for searching."""
+    return ' '.join(value.lower().split())
+
+
+def trigrams(term, padded=True):
+    """Split a term into overlapping 3-letter pieces.
+
+    Padding the term makes its start (and end) count more when ranking.
+    """
+    if padded:
+        term = "  {} ".format(term)
+    return set(term[index:index + 3] for index in range(len(term) - 2))
+
+
+def sample_terms(content):
+    """Get the searchable values from the XML of a sample.
+
+    Returns:
+        tuple: LIMS id, dict of field -> value
+    """
+    try:
+        root = ElementTree.fromstring(content)
+    except ElementTree.ParseError:
+        return None, {}
+    values = {'id': root.get('limsid')}
+    for element in root:
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'name':
+            values['name'] = element.text
+        elif tag == 'field':
+            for field, udf_key in SEARCH_FIELDS.items():
+                if udf_key and element.get('name') == udf_key:
+                    values[field] = element.text
+    return root.get('limsid'), {field: value for field, value in values.items() if value}
+
+
+def uri_kind(uri):
+    """Classify a URL: the entity type (e.g. 'samples') or 'query' for lists."""
+    parts = urlsplit(uri)
+    segments = parts.path.strip('/').split('/')
+    # api/v2/<kind>/<id>, artifacts can point to a state of the entity
+    if (parts.query and not parts.query.startswith('state=')) or len(segments) != 4:
+        return 'query'
+    return segments[2]
+
+
+class EntityStore(object):
+
+    def __init__(self, path, ttl=CACHE_TTL):
+        """SQLite store of LIMS responses.
+
+        Args:
+            path (str): path to the database file
+            ttl (float): seconds a stored response is considered fresh
+        """
+        self.path = path
+        self.ttl = ttl
+        self.stats = dict(hits=0, misses=0)
+        self._local = threading.local()
+        root_dir = os.path.dirname(path)
+        if root_dir and not os.path.isdir(root_dir):
+            os.makedirs(root_dir)
+        self.connection.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        """SQLite connection for the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, uri):
+        """Get a stored response if it's still fresh."""
+        row = self.connection.execute(
+            'SELECT content FROM responses WHERE uri = ? AND fetched_at > ?',
+            (uri, time.time() - self.ttl)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, uri, content):
+        """Store a response."""
+        self.set_many([(uri, content)])
+
+    def set_many(self, items):
+        """Store many (uri, content) responses in a single transaction."""
+        now = time.time()
+        items = [(uri, uri_kind(uri), content) for uri, content in items]
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                [(uri, kind, sqlite3.Binary(content), now) for uri, kind, content in items])
+            self._index_samples(content for uri, kind, content in items if kind == 'samples')
+
+    def _index_samples(self, contents):
+        """Update the search index for samples, within a transaction."""
+        sample_ids, terms, grams = [], [], []
+        for content in contents:
+            sample_id, values = sample_terms(content)
+            if sample_id is None:
+                continue
+            sample_ids.append((sample_id,))
+            for field, value in values.items():
+                term = search_term(value)
+                terms.append((sample_id, field, value, term))
+                if field in TRIGRAM_FIELDS:
+                    grams.extend((trigram, sample_id, field) for trigram in trigrams(term))
+        self.connection.executemany('DELETE FROM search_terms WHERE sample_id = ?', sample_ids)
+        self.connection.executemany('DELETE FROM search_trigrams WHERE sample_id = ?',
+                                    sample_ids)
+        self.connection.executemany('INSERT OR REPLACE INTO search_terms VALUES (?, ?, ?, ?)',
+                                    terms)
+        self.connection.executemany('INSERT OR IGNORE INTO search_trigrams VALUES (?, ?, ?)',
+                                    grams)
+
+    def reindex(self):
+        """Rebuild the search index from all stored samples."""
+        with self.connection:
+            self.connection.execute('DELETE FROM search_terms')
+            self.connection.execute('DELETE FROM search_trigrams')
+            self._index_samples(content for uri, content in self.entities('samples'))
+
+    def index_samples(self, contents):
+        """Update the search index from the XML of samples, e.g. after an update."""
+        with self.connection:
+            self._index_samples(contents)
+
+    def delete(self, uri, unindex=True):
+        """Forget a response, e.g. after the entity was changed or deleted.
+
+        Args:
+            unindex (bool): also remove a sample from the search index
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM responses WHERE uri = ?', (uri,))
+            if unindex and uri_kind(uri) == 'samples':
+                sample_id = urlsplit(uri).path.rstrip('/').rsplit('/', 1)[-1]
+                self.connection.execute('DELETE FROM search_terms WHERE sample_id = ?',
+                                        (sample_id,))
+                self.connection.execute('DELETE FROM search_trigrams WHERE sample_id = ?',
+                                        (sample_id,))
+
+    def delete_queries(self):
+        """Forget all list queries, any update could change their results."""
+        with self.connection:
+            self.connection.execute("DELETE FROM responses WHERE kind = 'query'")
+
+    def entities(self, kind):
+        """Iterate over (uri, content) of all stored entities of a kind."""
+        query = 'SELECT uri, content FROM responses WHERE kind = ?'
+        for uri, content in self.connection.execute(query, (kind,)):
+            yield uri, bytes(content)
+
+    def signature(self):
+        """Summarize the contents to tell if anything was stored since."""
+        query = 'SELECT COUNT(*), MAX(fetched_at) FROM responses'
+        return list(self.connection.execute(query).fetchone())
+
+    def kind_counts(self):
+        """Count stored responses per kind."""
+        query = 'SELECT kind, COUNT(*) FROM responses GROUP BY kind'
+        return dict(self.connection.execute(query).fetchall())
+
+
+class CachingAdapter(BaseAdapter):
+
+    """Transport adapter serving GET requests from an entity store."""
+
+    def __init__(self, store, adapter, read=True):
+        super(CachingAdapter, self).__init__()
+        self.store = store
+        self.adapter = adapter
+        self.read = read
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            if request.url.endswith('/batch/retrieve'):
+                return self.adapter.send(request, **kwargs)
+            # the entity (or a batch of them) changes and with it what
+            # cached list queries return
+            self.store.delete_queries()
+            response = self.adapter.send(request, **kwargs)
+            if (request.method == 'PUT' and response.status_code == 200 and
+                    uri_kind(request.url) != 'query'):
+                # the LIMS answers with the updated entity
+                self.store.set(request.url, response.content)
+            else:
+                # a failed update leaves the sample as it was
+                self.store.delete(request.url, unindex=request.method == 'DELETE' and
+                                  response.status_code < 300)
+            return response
+
+        content = self.store.get(request.url) if self.read else None
+        if content is not None:
+            self.store.stats['hits'] += 1
+            response = Response()
+            response.status_code = 200
+            response.headers = CaseInsensitiveDict({'content-type': 'application/xml'})
+            response.raw = BytesIO(content)
+            response.url = request.url
+            response.request = request
+            return response
+
+        self.store.stats['misses'] += 1
+        response = self.adapter.send(request, **kwargs)
+        if response.status_code == 200:
+            # reads the (streamed) body, later reads are served from memory
+            self.store.set(request.url, response.content)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def store_path(cache_dir):
+    """Path to the store in a cache directory."""
+    return os.path.join(os.path.expanduser(cache_dir), STORE_FILE)
+
+
+def install(lims_api, path, ttl=CACHE_TTL, read=True):
+    """Cache the responses of a LIMS client in a persistent store.
+
+    Args:
+        read (bool): serve fresh responses from the store, otherwise only
+                     store what is fetched (to refresh the cache)
+    """
+    store = EntityStore(path, ttl=ttl)
+    session = lims_api.request_session
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, CachingAdapter(store, session.adapters[prefix], read=read))
+    lims_api.store = store
+    lims_api.store_read = read
+    return store
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Check the samples of new processes as soon as they show up."""
+import codecs
+from datetime import datetime
+import hashlib
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import time
+from xml.etree import ElementTree
+
+import click
+from genologics.entities import Process
+
+from cglims import api
+from cglims.check import check_sample
+from cglims.constants import CLOCK_MARGIN, DEFAULT_CACHE_DIR, LIMS_TIMESTAMP
+
+PROCESS_TYPES = ['CG002 - Reception Control']
+# polls to retry a failing process in before giving up on it
+MAX_RETRIES = 5
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option('-t', '--process-type', 'process_types', multiple=True,
+              help='process type to watch, default: reception control')
+@click.option('-i', '--interval', default=60, help='seconds between polls')
+@click.option('-j', '--jobs', default=4, help='processes to check concurrently')
+@click.option('-v', '--version', type=int, help='application tag version')
+@click.option('-f', '--force', is_flag=True, help='update existing values')
+@click.option('--since', help='start from this LIMS timestamp instead of the watermark')
+@click.option('--state', type=click.Path(dir_okay=False),
+              help='file to keep the watermark in')
+@click.option('--once', is_flag=True, help='poll once and exit')
+@click.pass_context
+def watch(context, process_types, interval, jobs, version, force, since, state, once):
+    """Run checks (with update) on the inputs of new processes."""
+    watch_config = context.obj.get('watch') or {}
+    process_types = list(process_types or watch_config.get('process_types', PROCESS_TYPES))
+    cache_dir = context.obj.get('cache_dir', DEFAULT_CACHE_DIR)
+    watermark = Watermark(state or os.path.join(os.path.expanduser(cache_dir), 'watch.json'))
+    poll_state = watermark.load()
+    if since:
+        poll_state['since'] = since
+    elif 'since' not in poll_state:
+        # don't go through the whole history the first time
+        poll_state['since'] = (datetime.utcnow() - CLOCK_MARGIN).strftime(LIMS_TIMESTAMP)
+    log.info("watching processes: %s, since %s", ', '.join(process_types),
+             poll_state['since'])
+
+    lims_api = api.connect(context.obj)
+
+    def handle(lims_process):
+        for sample in lims_api.process_samples(lims_process):
+            check_sample(lims_api, sample['sample'], lims_artifact=sample.get('artifact'),
+                         update=True, version=version, force=force)
+
+    pool = ThreadPool(jobs)
+    try:
+        while True:
+            poll_state = poll(lims_api, process_types, poll_state, pool, handle)
+            watermark.save(poll_state)
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log.info("stopped watching at: %s", poll_state['since'])
+    finally:
+        pool.terminate()
+
+
+def poll(lims_api, process_types, state, pool, handle):
+    """Handle all processes modified since the watermark.
+
+    The watermark lags `CLOCK_MARGIN` so processes modified while polling
+    are listed again next time. Processes are only handled again if their
+    content has changed since. Failed processes are retried in the next
+    polls, up to `MAX_RETRIES` times, without holding back the watermark.
+
+    Args:
+        process_types (List[str]): names of process types to watch
+        state (dict): 'since' LIMS timestamp of the last poll, 'handled'
+                      process versions and 'failed' retry counts per id
+        pool (ThreadPool): workers to handle processes with
+        handle (function): called with each process
+
+    Returns:
+        dict: the new state
+    """
+    polled_at = (datetime.utcnow() - CLOCK_MARGIN).strftime(LIMS_TIMESTAMP)
+    handled = state.get('handled', {})
+    failed = state.get('failed', {})
+    lims_processes = list(lims_api.get_processes(type=process_types,
+                                                 last_modified=state['since']))
+    listed = set(lims_process.id for lims_process in lims_processes)
+    # failed processes not modified since are retried anyway
+    lims_processes.extend(Process(lims_api, id=process_id) for process_id in sorted(failed)
+                          if process_id not in listed)
+    if lims_processes:
+        log.info("found %s modified processes", len(lims_processes))
+
+    def timed_handle(lims_process):
+        start = time.time()
+        version = None
+        try:
+            # entities are cached by the client, make sure to see changes
+            lims_process.get(force=True)
+            version = process_version(lims_process)
+            if handled.get(lims_process.id) == version:
+                return 'unchanged', version
+            handle(lims_process)
+        except Exception as error:
+            log.error("process %s failed: %s: %s", lims_process.id,
+                      type(error).__name__, error)
+            return 'failed', version
+        log.info("process %s: checked in %.1fs", lims_process.id, time.time() - start)
+        return 'handled', version
+
+    results = pool.map(timed_handle, lims_processes)
+    # processes listed in the next poll are within the margin of this one
+    new_handled = {process_id: version for process_id, version in handled.items()
+                   if process_id in listed}
+    new_failed = {}
+    for lims_process, (status, version) in zip(lims_processes, results):
+        if status != 'failed':
+            new_handled[lims_process.id] = version
+            continue
+        attempts = failed.get(lims_process.id, 0) + 1
+        if attempts < MAX_RETRIES:
+            new_failed[lims_process.id] = attempts
+        else:
+            log.error("process %s: giving up after %s attempts", lims_process.id, attempts)
+            if version:
+                # unless it changes again
+                new_handled[lims_process.id] = version
+    if new_failed:
+        log.warning("%s processes failed, retrying next poll", len(new_failed))
+    return {'since': polled_at, 'handled': new_handled, 'failed': new_failed}
+
+
+def process_version(lims_process):
+    """Hash the XML of a fetched process to tell if it has changed.
+
+    Processes don't tell when they were last modified.
+    """
+    return hashlib.sha1(ElementTree.tostring(lims_process.root)).hexdigest()
+
+
+class Watermark(object):
+
+    def __init__(self, path):
+        """Timestamp of the last poll and what was seen, kept in a JSON file."""
+        self.path = path
+
+    def load(self):
+        """Get the stored state, empty if there is none."""
+        if not os.path.exists(self.path):
+            return {}
+        with codecs.open(self.path, 'r', encoding='utf-8') as handle:
+            return json.load(handle)
+
+    def save(self, state):
+        """Store a new state with at least a 'since' timestamp."""
+        root_dir = os.path.dirname(self.path)
+        if root_dir and not os.path.isdir(root_dir):
+            os.makedirs(root_dir)
+        # write to a temporary file first to never leave a half written state
+        with codecs.open(self.path + '.tmp', 'w', encoding='utf-8') as handle:
+            json.dump(state, handle, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Parse large LIMS responses incrementally while they are downloaded."""
+from xml.etree import ElementTree
+
+# bytes to read from the response at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class ResponseStream(object):
+
+    """File-like view of a streamed response body.
+
+    Unlike `response.raw` it takes care of content decoding, e.g. gzip.
+    """
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE):
+        self._chunks = response.iter_content(chunk_size)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def iter_children(response):
+    """Yield the children of the root element as soon as they are parsed.
+
+    Each child is detached from the root once the caller is done with it
+    so memory is bounded by a single child rather than the full response.
+    """
+    depth = 0
+    root = None
+    for event, element in ElementTree.iterparse(ResponseStream(response),
+                                                events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                yield element
+                root.remove(element)
@@ -52,6 +52,8 @@ setup(
     packages=find_packages(exclude=('tests*', 'docs', 'examples')),
     include_package_data=True,
     install_requires=parse_reqs(),
+    # vectorized index checks
+    extras_require={'fast': ['numpy']},
     cmdclass=dict(test=PyTest),
     zip_safe=False,
     keywords='pytest cli',
@@ -80,6 +82,15 @@ setup(
             'check = cglims.check:check',
             'samples = cglims.check:samples',
             'sample = cglims.cli.commands:sample',
+            'indexes = cglims.cli.commands:indexes',
+            'capacity = cglims.capacity:capacity',
+            'samplesheet = cglims.samplesheet:samplesheet',
+            'prefetch = cglims.prefetch:prefetch',
+            'watch = cglims.watch:watch',
+            'stats = cglims.stats:stats',
+            'queue = cglims.routing:queue',
+            'delivery = cglims.delivery:delivery',
+            'search = cglims.search:search',
         ],
     },
 )
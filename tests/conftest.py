@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
+import sys
+
 import pytest
+import requests
+from requests.adapters import BaseAdapter
 
 from cglims.apptag import ApplicationTag
 
+# the asyncio client needs python 3 syntax
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 7) else []
+
 
 @pytest.fixture
 def apptag_wgs():
@@ -72,3 +79,27 @@ def apptags():
         'targeted': apptag_focused_exome()
     }
 
+
+class CountingAdapter(BaseAdapter):
+
+    """Answer every request with the number of requests seen so far."""
+
+    def __init__(self):
+        super(CountingAdapter, self).__init__()
+        self.count = 0
+
+    def send(self, request, **kwargs):
+        self.count += 1
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = "<count>{}</count>".format(self.count).encode('utf-8')
+        response.headers['Content-Type'] = 'application/xml'
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def counting_adapter():
+    return CountingAdapter()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+from cglims.aio import AsyncClinicalLims
+
+
+class SlowLims(object):
+
+    """Blocking client tracking how many calls run at the same time."""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def is_delivered(self, lims_id):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+        return "delivered {}".format(lims_id)
+
+    def samplesheet(self, flowcell):
+        for lane in (1, 2):
+            yield {'fcid': flowcell, 'lane': lane}
+
+
+def test_concurrent_lookups():
+    # GIVEN an async client allowing 4 concurrent calls
+    lims = SlowLims()
+    async_lims = AsyncClinicalLims(lims, max_concurrency=4)
+
+    async def lookup_all():
+        return await asyncio.gather(*[async_lims.is_delivered("ADM{}".format(number))
+                                      for number in range(12)])
+
+    # WHEN issuing many lookups at once
+    start = time.time()
+    results = asyncio.run(lookup_all())
+    async_lims.close()
+
+    # THEN they run concurrently but never more than the limit
+    assert results[0] == 'delivered ADM0'
+    assert lims.peak == 4
+    assert time.time() - start < 12 * 0.05
+
+
+def test_samplesheet():
+    # GIVEN an async client
+    async_lims = AsyncClinicalLims(SlowLims())
+
+    async def collect():
+        return [row async for row in async_lims.samplesheet('FC1')]
+
+    # WHEN iterating over a samplesheet
+    rows = asyncio.run(collect())
+    async_lims.close()
+    # THEN all rows are yielded in order
+    assert [row['lane'] for row in rows] == [1, 2]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cglims.api import ClinicalSample
+
+
+class FakeUdf(dict):
+
+    @property
+    def _lookup(self):
+        return dict(self)
+
+
+class FakeProject(object):
+
+    def __init__(self):
+        self.id = 'ADM123'
+        self.fetched = 0
+
+    @property
+    def name(self):
+        # the name needs a request to the LIMS
+        self.fetched += 1
+        return 'project'
+
+
+class FakeSample(object):
+
+    def __init__(self, udf):
+        self.id = 'ADM1'
+        self.name = 'sample'
+        self.date_received = '2016-11-23'
+        self.udf = FakeUdf(udf)
+        self.project = FakeProject()
+
+
+@pytest.fixture
+def lims_sample():
+    return FakeSample({'customer': 'cust003', 'familyID': '16105',
+                       'Sequencing Analysis': 'WGSPCFC030', 'Gender': 'F'})
+
+
+def test_single_field(lims_sample):
+    # GIVEN a sample
+    sample_obj = ClinicalSample(lims_sample)
+
+    # WHEN looking up single fields
+    # THEN only what they depend on is computed
+    assert sample_obj['case_id'] == 'cust003-16105'
+    assert sample_obj['project_id'] == 'ADM123'
+    assert sample_obj['Gender'] == 'F'
+    assert lims_sample.project.fetched == 0
+    # ... and fields are remembered
+    assert sample_obj['project_name'] == sample_obj['project_name'] == 'project'
+    assert lims_sample.project.fetched == 1
+
+
+def test_missing_field(lims_sample):
+    # GIVEN a sample
+    sample_obj = ClinicalSample(lims_sample)
+
+    # THEN unknown fields aren't part of it
+    assert 'Capture Library version' not in sample_obj
+    assert sample_obj.get('Capture Library version') is None
+    with pytest.raises(KeyError):
+        sample_obj['Capture Library version']
+
+
+def test_to_dict(lims_sample):
+    # GIVEN a sample
+    sample_obj = ClinicalSample(lims_sample)
+
+    # WHEN exporting all data
+    data = sample_obj.to_dict()
+
+    # THEN UDFs and derived fields are included
+    assert data['Gender'] == 'F'
+    assert data['sex'] == 'female'
+    assert data['pipeline'] == 'mip'
+    assert data['is_production'] is True
+    assert set(ClinicalSample.EXTENDED_FIELDS) <= set(data)
+    # ... but not with minimal information
+    assert 'sex' not in sample_obj.to_dict(minimal=True)
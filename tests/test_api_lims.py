@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+from xml.etree import ElementTree
+
+from genologics.entities import Artifact, Process, Sample
+
+from cglims.api import ClinicalLims
+from cglims.exc import LimsCaseIdNotFoundError, MissingLimsDataException
+from cglims.store import EntityStore
+
+BASE_URI = 'http://lims'
+PAGE_TMPL = """<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+{samples}{next_page}</smp:samples>"""
+
+
+def sample_page(sample_ids, next_uri=None):
+    samples = ''.join('<sample uri="{}/api/v2/samples/{}" limsid="{}"/>\n'
+                      .format(BASE_URI, sample_id, sample_id)
+                      for sample_id in sample_ids)
+    next_page = '<next-page uri="{}"/>'.format(next_uri) if next_uri else ''
+    return PAGE_TMPL.format(samples=samples, next_page=next_page).encode('utf-8')
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def iter_content(self, chunk_size=1):
+        for index in range(0, len(self.content), chunk_size):
+            yield self.content[index:index + chunk_size]
+
+
+class PagedLims(ClinicalLims):
+
+    """Serve requests from pre-defined responses instead of a server."""
+
+    def __init__(self, pages):
+        super(PagedLims, self).__init__(BASE_URI, 'user', 'password')
+        self.pages = pages
+        self.requested = []
+
+    def _stream(self, method, uri, params=None, data=None, accept_status_codes=(200,)):
+        self.requested.append(uri)
+        return FakeResponse(self.pages[uri])
+
+    def get(self, uri, params=dict()):
+        self.requested.append(uri)
+        return ElementTree.fromstring(self.pages[uri])
+
+
+def test_iter_samples():
+    # GIVEN a sample listing split over two pages
+    first_uri = BASE_URI + '/api/v2/samples'
+    next_uri = BASE_URI + '/api/v2/samples?start-index=2'
+    lims = PagedLims({first_uri: sample_page(['ADM1', 'ADM2'], next_uri=next_uri),
+                      next_uri: sample_page(['ADM3'])})
+
+    # WHEN iterating over the samples
+    lims_samples = lims.iter_samples(projectlimsid='ADM')
+    first = next(lims_samples)
+
+    # THEN the first sample is available before the listing is exhausted
+    assert first.id == 'ADM1'
+    # ... and the remaining samples follow in order
+    assert [sample.id for sample in lims_samples] == ['ADM2', 'ADM3']
+    assert lims.requested == [first_uri, next_uri]
+
+
+def test_iter_samples_without_prefetch():
+    # GIVEN a single page listing
+    first_uri = BASE_URI + '/api/v2/samples'
+    lims = PagedLims({first_uri: sample_page(['ADM1'])})
+    # WHEN iterating without background prefetching
+    lims_samples = list(lims.iter_samples(prefetch=False))
+    # THEN it works the same
+    assert [sample.id for sample in lims_samples] == ['ADM1']
+
+
+def test_get_batch():
+    # GIVEN a batch retrieve response for two samples
+    batch_uri = BASE_URI + '/api/v2/samples/batch/retrieve'
+    details = ('<smp:details xmlns:smp="http://genologics.com/ri/sample">'
+               '<smp:sample uri="{0}/api/v2/samples/ADM1" limsid="ADM1"><name>one</name>'
+               '</smp:sample>'
+               '<smp:sample uri="{0}/api/v2/samples/ADM2" limsid="ADM2"><name>two</name>'
+               '</smp:sample></smp:details>').format(BASE_URI)
+    lims = PagedLims({batch_uri: details.encode('utf-8')})
+    lims_samples = [Sample(lims, id='ADM1'), Sample(lims, id='ADM2')]
+
+    # WHEN retrieving them in a batch
+    lims.get_batch(lims_samples)
+
+    # THEN each sample gets its own XML, parsed from the stream
+    assert [sample.name for sample in lims_samples] == ['one', 'two']
+    # ... and samples already fetched aren't requested again
+    lims.get_batch(lims_samples)
+    assert lims.requested == [batch_uri]
+
+
+def test_get_batch_stored(tmpdir):
+    # GIVEN a batch retrieve response and a persistent store
+    batch_uri = BASE_URI + '/api/v2/samples/batch/retrieve'
+    details = ('<smp:details xmlns:smp="http://genologics.com/ri/sample">'
+               '<smp:sample uri="{0}/api/v2/samples/ADM1" limsid="ADM1"><name>one</name>'
+               '</smp:sample></smp:details>').format(BASE_URI)
+    lims = PagedLims({batch_uri: details.encode('utf-8')})
+    lims.store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+
+    # WHEN retrieving a sample in a batch
+    lims.get_batch([Sample(lims, id='ADM1')])
+
+    # THEN another client reading the store doesn't need to ask again
+    other_lims = PagedLims({})
+    other_lims.store = lims.store
+    other_lims.store_read = True
+    lims_sample = Sample(other_lims, id='ADM1')
+    other_lims.get_batch([lims_sample])
+    assert lims_sample.name == 'one'
+    assert other_lims.requested == []
+
+
+def artifact_xml(artifact_id, process_id, sample_ids):
+    samples = ''.join('<sample uri="{0}/api/v2/samples/{1}" limsid="{1}"/>'
+                      .format(BASE_URI, sample_id) for sample_id in sample_ids)
+    return ('<art:artifact xmlns:art="http://genologics.com/ri/artifact" '
+            'uri="{0}/api/v2/artifacts/{1}" limsid="{1}">'
+            '<parent-process uri="{0}/api/v2/processes/{2}" limsid="{2}"/>{3}'
+            '</art:artifact>').format(BASE_URI, artifact_id, process_id, samples)
+
+
+def process_xml(process_id):
+    return ('<prc:process xmlns:prc="http://genologics.com/ri/process" '
+            'uri="{0}/api/v2/processes/{1}" limsid="{1}">'
+            '<type uri="{0}/api/v2/processtypes/33">CG002 - Capture</type>'
+            '</prc:process>').format(BASE_URI, process_id).encode('utf-8')
+
+
+def test_get_process_artifacts():
+    # GIVEN two artifacts of a process type, one of them a pool of two samples
+    artifacts_uri = BASE_URI + '/api/v2/artifacts'
+    listing = ('<art:artifacts xmlns:art="http://genologics.com/ri/artifact">'
+               '<artifact uri="{0}/api/v2/artifacts/A1" limsid="A1"/>'
+               '<artifact uri="{0}/api/v2/artifacts/A2" limsid="A2"/>'
+               '</art:artifacts>').format(BASE_URI)
+    details = ('<art:details xmlns:art="http://genologics.com/ri/artifact">{}{}</art:details>'
+               .format(artifact_xml('A1', '24-20', ['ADM1']),
+                       artifact_xml('A2', '24-10', ['ADM1', 'ADM2'])))
+    lims = PagedLims({
+        artifacts_uri: listing.encode('utf-8'),
+        artifacts_uri + '/batch/retrieve': details.encode('utf-8'),
+        BASE_URI + '/api/v2/processes/24-10': process_xml('24-10'),
+        BASE_URI + '/api/v2/processes/24-20': process_xml('24-20'),
+    })
+    lims._process_type_names['33'] = 'CG002 - Capture'
+
+    # WHEN getting the artifacts for two samples
+    results = lims.get_process_artifacts(['ADM1', 'ADM2', 'ADM3'], ['33'])
+
+    # THEN a single query is made and artifacts are ordered by process
+    assert lims.requested.count(artifacts_uri) == 1
+    assert [artifact.id for artifact in results['ADM1']] == ['A2', 'A1']
+    assert [artifact.id for artifact in results['ADM2']] == ['A2']
+    assert results['ADM3'] == []
+
+
+def test_delivery_dates_missing_date():
+    # GIVEN a sample delivered by a process without a delivery date
+    artifacts_uri = BASE_URI + '/api/v2/artifacts'
+    listing = ('<art:artifacts xmlns:art="http://genologics.com/ri/artifact">'
+               '<artifact uri="{0}/api/v2/artifacts/A1" limsid="A1"/>'
+               '</art:artifacts>').format(BASE_URI)
+    details = ('<art:details xmlns:art="http://genologics.com/ri/artifact">{}</art:details>'
+               .format(artifact_xml('A1', '24-10', ['ADM1'])))
+    lims = PagedLims({
+        artifacts_uri: listing.encode('utf-8'),
+        artifacts_uri + '/batch/retrieve': details.encode('utf-8'),
+        BASE_URI + '/api/v2/processes/24-10': process_xml('24-10'),
+    })
+    lims._process_type_names['159'] = 'CG002 - Delivery'
+
+    # WHEN looking up delivery dates
+    dates = lims.delivery_dates(['ADM1', 'ADM2'])
+
+    # THEN the missing date is reported for that sample only
+    assert isinstance(dates['ADM1'], MissingLimsDataException)
+    assert dates['ADM2'] is None
+
+
+def test_process_samples():
+    # GIVEN a process with two input artifacts, one of them a pool with two outputs
+    process_uri = BASE_URI + '/api/v2/processes/24-1'
+    process = ('<prc:process xmlns:prc="http://genologics.com/ri/process" '
+               'uri="{0}" limsid="24-1">'
+               '<input-output-map><input uri="{1}/api/v2/artifacts/A2" limsid="A2"/>'
+               '</input-output-map>'
+               '<input-output-map><input uri="{1}/api/v2/artifacts/A1" limsid="A1"/>'
+               '</input-output-map>'
+               '<input-output-map><input uri="{1}/api/v2/artifacts/A2" limsid="A2"/>'
+               '</input-output-map>'
+               '</prc:process>').format(process_uri, BASE_URI)
+    artifacts = ('<art:details xmlns:art="http://genologics.com/ri/artifact">{}{}</art:details>'
+                 .format(artifact_xml('A1', '24-0', ['ADM1']),
+                         artifact_xml('A2', '24-0', ['ADM1', 'ADM2'])))
+    samples = ('<smp:details xmlns:smp="http://genologics.com/ri/sample">'
+               '<smp:sample uri="{0}/api/v2/samples/ADM1" limsid="ADM1"><name>one</name>'
+               '</smp:sample>'
+               '<smp:sample uri="{0}/api/v2/samples/ADM2" limsid="ADM2"><name>two</name>'
+               '</smp:sample></smp:details>').format(BASE_URI)
+    lims = PagedLims({
+        process_uri: process.encode('utf-8'),
+        BASE_URI + '/api/v2/artifacts/batch/retrieve': artifacts.encode('utf-8'),
+        BASE_URI + '/api/v2/samples/batch/retrieve': samples.encode('utf-8'),
+    })
+
+    # WHEN resolving the input samples
+    results = [(result['artifact'].id, result['sample'].name) for result in
+               lims.process_samples(Process(lims, id='24-1'))]
+
+    # THEN inputs and samples are fetched with one batch each, in input order
+    assert results == [('A2', 'one'), ('A2', 'two'), ('A1', 'one')]
+    assert lims.requested == [process_uri,
+                              BASE_URI + '/api/v2/artifacts/batch/retrieve',
+                              BASE_URI + '/api/v2/samples/batch/retrieve']
+
+
+def test_load_related():
+    # GIVEN two artifacts from the same process with two samples
+    artifacts = ('<art:details xmlns:art="http://genologics.com/ri/artifact">{}{}</art:details>'
+                 .format(artifact_xml('A1', '24-1', ['ADM1']),
+                         artifact_xml('A2', '24-1', ['ADM1', 'ADM2'])))
+    samples = ('<smp:details xmlns:smp="http://genologics.com/ri/sample">'
+               '<smp:sample uri="{0}/api/v2/samples/ADM1" limsid="ADM1"><name>one</name>'
+               '</smp:sample>'
+               '<smp:sample uri="{0}/api/v2/samples/ADM2" limsid="ADM2"><name>two</name>'
+               '</smp:sample></smp:details>').format(BASE_URI)
+    lims = PagedLims({
+        BASE_URI + '/api/v2/artifacts/batch/retrieve': artifacts.encode('utf-8'),
+        BASE_URI + '/api/v2/processes/24-1': process_xml('24-1'),
+        BASE_URI + '/api/v2/samples/batch/retrieve': samples.encode('utf-8'),
+    })
+    lims_artifacts = [Artifact(lims, id='A1'), Artifact(lims, id='A2')]
+
+    # WHEN loading their processes and samples
+    lims.load_related(lims_artifacts, 'parent_process', 'samples')
+
+    # THEN each level takes a single request
+    assert lims.requested == [BASE_URI + '/api/v2/artifacts/batch/retrieve',
+                              BASE_URI + '/api/v2/processes/24-1',
+                              BASE_URI + '/api/v2/samples/batch/retrieve']
+    assert [sample.name for sample in lims_artifacts[1].samples] == ['one', 'two']
+
+
+def test_resolve_samples_invalid_case():
+    # GIVEN a customer id without a family
+    lims = PagedLims({})
+
+    # WHEN resolving it
+    results = lims.resolve_samples(['cust003'])
+
+    # THEN it's reported as an error for that identifier only
+    assert isinstance(results['cust003'], LimsCaseIdNotFoundError)
+    assert lims.requested == []
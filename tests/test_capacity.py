@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from cglims.capacity import capacity_report
+
+
+def test_capacity_report():
+    # GIVEN two lanes: one over-loaded and one under-loaded, and a bad tag
+    lane_tags = [
+        (1, 'ADM1', 'WGSPCFC030'),
+        (1, 'ADM2', 'EXOSXTR100'),
+        (2, 'ADM3', 'EXOSXTR020'),
+        (2, 'ADM4', 'RMLP10R150'),
+        (2, 'ADM5', 'WRONG'),
+    ]
+    # WHEN comparing with 400M reads per lane
+    report = capacity_report(lane_tags, 400000000)
+    lanes = {lane['lane']: lane for lane in report['lanes']}
+    # THEN lane 1 is exactly at capacity (300M + 100M reads)
+    assert lanes[1]['ordered_reads'] == 400000000
+    assert lanes[1]['status'] == 'ok'
+    # ... lane 2 is under-loaded
+    assert lanes[2]['ordered_reads'] == 170000000
+    assert lanes[2]['status'] == 'under'
+    # ... and the sample with the broken tag is reported
+    assert report['errors'] == [{'sample_id': 'ADM5', 'app_tag': 'WRONG'}]
+
+
+def test_capacity_report_pending():
+    # GIVEN pending samples without lanes
+    lane_tags = [(None, "ADM{}".format(number), 'WGSPCFC030') for number in range(5)]
+    # WHEN comparing with the lane capacity
+    report = capacity_report(lane_tags, 400000000)
+    # THEN it reports how many lanes they need
+    assert report['lanes'][0]['status'] == 'over'
+    assert report['lanes'][0]['lanes_needed'] == 4
+
+
+def test_capacity_report_pool_on_lanes():
+    # GIVEN a pool of two samples spread over four lanes
+    lane_tags = [(lane, sample_id, 'WGSPCFC030') for lane in (1, 2, 3, 4)
+                 for sample_id in ('ADM1', 'ADM2')]
+    # WHEN comparing with the lane capacity
+    report = capacity_report(lane_tags, 400000000)
+    # THEN the ordered reads of each sample are split between its lanes
+    assert [lane['ordered_reads'] for lane in report['lanes']] == [150000000] * 4
+    assert [lane['status'] for lane in report['lanes']] == ['under'] * 4
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+import requests
+
+from cglims.cassette import Cassette, RecordingAdapter, ReplayAdapter
+from cglims.exc import CassetteError
+
+
+def session_with(adapter):
+    session = requests.Session()
+    session.mount('http://', adapter)
+    return session
+
+
+def test_record_and_replay(tmpdir, counting_adapter):
+    # GIVEN a few requests recorded to a cassette
+    cassette = Cassette(str(tmpdir.join('cassette')))
+    session = session_with(RecordingAdapter(cassette, adapter=counting_adapter))
+    recorded = [session.get('http://lims/api/v2/samples/ADM1').text,
+                session.get('http://lims/api/v2/samples/ADM1').text,
+                session.post('http://lims/api/v2/samples/batch/retrieve', data='<a/>').text]
+    cassette.close()
+
+    # WHEN replaying the same requests against another host
+    replay = session_with(ReplayAdapter(Cassette(str(tmpdir.join('cassette')))))
+    replayed = [replay.get('http://other/api/v2/samples/ADM1').text,
+                replay.get('http://other/api/v2/samples/ADM1').text,
+                replay.post('http://other/api/v2/samples/batch/retrieve', data='<a/>').text]
+
+    # THEN the answers are served in the recorded order
+    assert replayed == recorded == ['<count>1</count>', '<count>2</count>',
+                                    '<count>3</count>']
+    # ... and repeating a request serves the last answer again
+    assert replay.get('http://other/api/v2/samples/ADM1').text == '<count>2</count>'
+
+
+def test_replay_unknown_request(tmpdir, counting_adapter):
+    # GIVEN a cassette with a single request
+    cassette = Cassette(str(tmpdir))
+    session = session_with(RecordingAdapter(cassette, adapter=counting_adapter))
+    session.get('http://lims/api/v2/samples/ADM1')
+    cassette.close()
+
+    # WHEN replaying a request that wasn't recorded
+    replay = session_with(ReplayAdapter(Cassette(str(tmpdir))))
+    # THEN it should fail loudly instead of hitting the network
+    with pytest.raises(CassetteError):
+        replay.post('http://lims/api/v2/samples/ADM1', data='<b/>')
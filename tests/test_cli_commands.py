@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import pytest
+from six import StringIO
+
+from cglims.cli.commands import read_changes, set_defaults, udf_changes
+
+
+class FakeSample(object):
+
+    def __init__(self, sample_id, udf):
+        self.id = sample_id
+        self.udf = udf
+
+
+def test_read_changes_csv():
+    # GIVEN a CSV change file with a header
+    handle = StringIO("#sample,udf,value\nADM1, Gender ,F\n\nADM2,priority,express\n")
+    handle.name = 'changes.csv'
+
+    # WHEN reading the changes
+    rows = read_changes(handle)
+
+    # THEN comments and blank lines are skipped and values stripped
+    assert rows == [('ADM1', 'Gender', 'F'), ('ADM2', 'priority', 'express')]
+
+
+def test_read_changes_invalid():
+    # GIVEN a TSV file with a row missing the value
+    handle = StringIO("ADM1\tGender\n")
+    handle.name = '<stdin>'
+
+    # THEN the line is reported
+    with pytest.raises(ValueError) as excinfo:
+        read_changes(handle)
+    assert 'line 1' in str(excinfo.value)
+
+
+def test_udf_changes_defaults():
+    # GIVEN a sample missing some defaults
+    lims_sample = FakeSample('ADM1', {'Gender': 'f', 'priority': 'standard',
+                                      'Source': 'Blod'})
+    before = dict(lims_sample.udf)
+
+    # WHEN filling in defaults
+    set_defaults(lims_sample)
+    changes = udf_changes(lims_sample, before)
+
+    # THEN only the changed and added UDFs are reported
+    changed = {key: (old, new) for _, key, old, new in changes}
+    assert changed['Gender'] == ('f', 'F')
+    assert changed['Strain'] == (None, 'NA')
+    assert 'priority' not in changed
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import yaml
+
+from cglims.cli.utils import dump_yaml, fix_dump
+
+
+def test_dump_yaml_matches_fix_dump():
+    # GIVEN config-like data with lists at different levels
+    data = {
+        'owner': 'cust003',
+        'default_gene_panels': ['OMIM-AUTO', 'IEM'],
+        'samples': [{'sample_id': 'ADM1', 'father': 0, 'phenotype': 'affected'},
+                    {'sample_id': 'ADM2', 'father': 'ADM1', 'phenotype': 'unknown'}],
+    }
+    # WHEN dumping it in one pass
+    dump = dump_yaml(data)
+    # THEN the output should be the same as the old regex post-pass
+    raw_dump = yaml.safe_dump(data, default_flow_style=False, allow_unicode=True)
+    assert dump == fix_dump(raw_dump)
+    assert '  - father: 0\n    phenotype: affected\n' in dump
+
+
+def test_dump_yaml_nested_lists():
+    # GIVEN a list nested in a list item
+    data = {'samples': [{'name': 'a', 'panels': ['x', 'y']}, {'name': 'b'}]}
+    # WHEN dumping it
+    dump = dump_yaml(data)
+    # THEN every list is indented under its key and it reads back the same
+    assert dump == ("samples:\n"
+                    "  - name: a\n"
+                    "    panels:\n"
+                    "      - x\n"
+                    "      - y\n"
+                    "  - name: b\n")
+    assert yaml.safe_load(dump) == data
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from cglims.delivery import plan_delivery
+from cglims.exc import MissingLimsDataException
+
+
+class FakeSample(object):
+
+    def __init__(self, lims_id, udf):
+        self.id = lims_id
+        self.name = lims_id
+        self.uri = lims_id
+        self.udf = udf
+
+
+class FakeLims(object):
+
+    def __init__(self, delivered):
+        self.delivered = delivered
+
+    def fetch(self, entities):
+        return entities
+
+    def delivery_dates(self, sample_ids):
+        return {sample_id: self.delivered.get(sample_id) for sample_id in sample_ids}
+
+
+def test_plan_delivery():
+    # GIVEN samples for Scout, an uppmax project and a customer with its own delivery
+    lims_samples = [
+        FakeSample('ADM1', {'customer': 'cust003', 'familyID': '1',
+                            'Data Analysis': 'scout'}),
+        FakeSample('ADM2', {'customer': 'cust003', 'familyID': '1',
+                            'Data Analysis': 'scout'}),
+        FakeSample('ADM3', {'customer': 'cust004', 'uppmax_project': 'b2016001'}),
+        FakeSample('ADM4', {'customer': 'cust009'}),
+        FakeSample('ADM5', {}),
+    ]
+    lims = FakeLims(delivered={'ADM3': date(2017, 1, 1)})
+
+    # WHEN planning the delivery
+    manifest = plan_delivery(lims, lims_samples)
+
+    # THEN samples are grouped by target
+    groups = {group['target']: group for group in manifest['raw_data']}
+    assert [sample['id'] for sample in groups['caesar']['samples']] == ['ADM1', 'ADM2']
+    assert groups['uppmax']['project'] == 'b2016001'
+    assert groups['uppmax']['samples'][0]['delivered'] == date(2017, 1, 1)
+    assert groups['manual']['samples'][0]['id'] == 'ADM4'
+    # ... cases are uploaded to Scout together
+    assert manifest['scout'] == [{'case': 'cust003-1', 'samples': ['ADM1', 'ADM2']}]
+    # ... and samples missing information are reported
+    assert manifest['errors'][0]['id'] == 'ADM5'
+
+    # WHEN only planning what's left to deliver
+    manifest = plan_delivery(lims, lims_samples, pending=True)
+
+    # THEN delivered samples are left out
+    assert 'uppmax' not in [group['target'] for group in manifest['raw_data']]
+
+
+def test_plan_delivery_without_date():
+    # GIVEN a sample with a delivery process missing its date
+    lims_samples = [FakeSample('ADM1', {'customer': 'cust009'}),
+                    FakeSample('ADM2', {'customer': 'cust009'})]
+    lims = FakeLims(delivered={'ADM1': MissingLimsDataException('Date delivered')})
+
+    # WHEN planning what's left to deliver
+    manifest = plan_delivery(lims, lims_samples, pending=True)
+
+    # THEN the sample is reported while the others are planned
+    assert manifest['errors'] == [{'id': 'ADM1', 'error': "missing UDF: 'Date delivered'"}]
+    assert [sample['id'] for sample in manifest['raw_data'][0]['samples']] == ['ADM2']
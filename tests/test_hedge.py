@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+from six import BytesIO
+
+from cglims import api
+from cglims.hedge import HedgingAdapter, LatencyTracker
+
+
+class SlowFirstAdapter(BaseAdapter):
+
+    """Answer the first request slowly and the others right away."""
+
+    def __init__(self, delay=1.0):
+        super(SlowFirstAdapter, self).__init__()
+        self.delay = delay
+        self.count = 0
+
+    def send(self, request, **kwargs):
+        self.count += 1
+        number = self.count
+        if number == 1:
+            time.sleep(self.delay)
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = "<count>{}</count>".format(number).encode('utf-8')
+        # losing responses are closed
+        response.raw = BytesIO(response._content)
+        return response
+
+    def close(self):
+        pass
+
+
+def warm_adapter(adapter, latency=0.01, samples=20):
+    for _ in range(samples):
+        adapter.tracker.observe(latency)
+    return adapter
+
+
+def test_latency_percentile():
+    # GIVEN a tracker with too few latencies
+    tracker = LatencyTracker(min_samples=3)
+    tracker.observe(0.1)
+    assert tracker.percentile(95) is None
+
+    # WHEN enough latencies are observed
+    for latency in (0.2, 0.3, 5.0):
+        tracker.observe(latency)
+
+    # THEN the percentile is estimated
+    assert tracker.percentile(50) == 0.3
+    assert tracker.percentile(95) == 5.0
+
+
+def test_no_latencies_yet():
+    # GIVEN an adapter without latency estimates
+    upstream = SlowFirstAdapter(delay=0)
+    adapter = HedgingAdapter(upstream)
+    session = requests.Session()
+    session.mount('http://', adapter)
+
+    # WHEN getting something
+    response = session.get('http://lims/api/v2/samples/ADM1')
+
+    # THEN it's sent once, without hedging, and its latency is tracked
+    assert response.text == '<count>1</count>'
+    assert upstream.count == 1
+    assert adapter.stats()['hedged'] == 0
+    assert len(adapter.tracker.latencies) == 1
+
+
+def test_hedged_request_wins():
+    # GIVEN a slow request once latencies are known
+    upstream = SlowFirstAdapter()
+    adapter = warm_adapter(HedgingAdapter(upstream, min_delay=0.05))
+    session = requests.Session()
+    session.mount('http://', adapter)
+
+    # WHEN getting something
+    start = time.time()
+    response = session.get('http://lims/api/v2/samples/ADM1')
+
+    # THEN the duplicate request answers first
+    assert response.text == '<count>2</count>'
+    assert time.time() - start < 0.5
+    stats = adapter.stats()
+    assert stats['hedged'] == stats['hedge_wins'] == 1
+
+
+def test_hedge_budget():
+    # GIVEN no budget for duplicate requests
+    upstream = SlowFirstAdapter(delay=0.2)
+    adapter = warm_adapter(HedgingAdapter(upstream, budget=0, min_delay=0.05))
+    adapter.tokens = 0
+    session = requests.Session()
+    session.mount('http://', adapter)
+
+    # WHEN a request is slow
+    response = session.get('http://lims/api/v2/samples/ADM1')
+
+    # THEN it's waited for instead
+    assert response.text == '<count>1</count>'
+    assert upstream.count == 1
+    assert adapter.stats()['denied'] == 1
+
+
+def test_connect_bare_hedge_section():
+    # GIVEN a config with an empty 'hedge:' section
+    config = {'host': 'http://lims', 'username': 'user', 'password': 'password',
+              'hedge': None}
+
+    # WHEN connecting
+    lims_api = api.connect(config)
+
+    # THEN hedging is turned on with the defaults
+    assert lims_api.hedger is not None
+    # ... but not without the section
+    del config['hedge']
+    assert api.connect(config).hedger is None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import os
+from xml.etree import ElementTree
+
+from cglims import incremental
+
+TYPES = ['CG002 - Delivery', 'CG002 - Reception Control']
+
+
+class FakeSample(object):
+
+    def __init__(self, sample_id, name='sample'):
+        self.id = sample_id
+        self.root = ElementTree.fromstring("<sample><name>{}</name></sample>".format(name))
+
+
+class FakeEntity(object):
+
+    def __init__(self, kind, entity_id, samples=()):
+        self.id = entity_id
+        self.uri = "http://lims/api/v2/{}/{}".format(kind, entity_id)
+        self.samples = [FakeSample(sample_id) for sample_id in samples]
+
+
+class FakeProcess(FakeEntity):
+
+    def __init__(self, process_id, artifacts):
+        super(FakeProcess, self).__init__('processes', process_id)
+        self.artifacts = artifacts
+
+    def all_inputs(self):
+        return self.artifacts[:1]
+
+    def all_outputs(self):
+        return self.artifacts[1:]
+
+
+class FakeLims(object):
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.modified_processes = []
+        self.modified_containers = []
+        self.used = ['http://lims/api/v2/processes/24-100',
+                     'http://lims/api/v2/containers/27-1']
+        self.queries = []
+
+    def case(self, customer, family):
+        return self.samples.get((customer, family), [])
+
+    def fetch(self, entities):
+        return entities
+
+    def load_related(self, entities, *paths):
+        return entities
+
+    def get_processes(self, last_modified, type):
+        self.queries.append((last_modified, type))
+        return self.modified_processes
+
+    def get_containers(self, last_modified):
+        return self.modified_containers
+
+    @contextmanager
+    def recording(self):
+        yield set(self.used)
+
+
+def test_sweep(tmpdir):
+    # GIVEN a case which hasn't been generated before
+    lims = FakeLims({('cust000', '1'): [FakeSample('ADM1')]})
+    generated = []
+
+    def generate(lims_samples):
+        generated.append(lims_samples)
+        return u"samples: {}\n".format(len(lims_samples))
+
+    # WHEN sweeping the case
+    counts = incremental.sweep(lims, ['cust000-1'], str(tmpdir), generate, TYPES)
+
+    # THEN the output is generated
+    assert counts['regenerated'] == 1
+    assert tmpdir.join('cust000-1.yaml').read() == "samples: 1\n"
+
+    # WHEN sweeping again without changes in the LIMS
+    counts = incremental.sweep(lims, ['cust000-1'], str(tmpdir), generate, TYPES)
+
+    # THEN the case is skipped
+    assert counts['skipped'] == 1
+    assert len(generated) == 1
+
+
+def test_sweep_changed(tmpdir):
+    # GIVEN a generated case
+    lims = FakeLims({('cust000', '1'): [FakeSample('ADM1')]})
+    incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+    mtime = os.path.getmtime(str(tmpdir.join('cust000-1.yaml')))
+
+    # WHEN a process it was read from is modified
+    lims.modified_processes = [FakeProcess('24-100', [])]
+    counts = incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+
+    # THEN it's regenerated but the same output isn't rewritten
+    assert counts['unchanged'] == 1
+    assert os.path.getmtime(str(tmpdir.join('cust000-1.yaml'))) == mtime
+
+    # WHEN a container it was read from is modified
+    lims.modified_processes = []
+    lims.modified_containers = [FakeEntity('containers', '27-1')]
+    counts = incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+
+    # THEN it's regenerated too, to the same output
+    assert counts['unchanged'] == 1
+
+    # WHEN a new process produces artifacts of its sample
+    lims.modified_containers = []
+    lims.modified_processes = [FakeProcess('24-200', [FakeEntity('artifacts', 'ADM1PA1',
+                                                                 samples=['ADM1'])])]
+    counts = incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+
+    # THEN it's regenerated too, to the same output
+    assert counts['unchanged'] == 1
+
+    # WHEN a sample is modified
+    lims.modified_processes = []
+    lims.samples[('cust000', '1')] = [FakeSample('ADM1', name='renamed')]
+    counts = incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"new\n", TYPES)
+
+    # THEN the output is updated
+    assert counts['regenerated'] == 1
+    assert tmpdir.join('cust000-1.yaml').read() == "new\n"
+
+
+def test_sweep_moves_on(tmpdir):
+    # GIVEN a generated case
+    lims = FakeLims({('cust000', '1'): [FakeSample('ADM1')]})
+    incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+    state = incremental.Fingerprints(str(tmpdir.join(incremental.STATE_FILE)))
+    state.data['cust000-1']['checked_at'] = '2016-01-01T00:00:00Z'
+    state.save()
+
+    # WHEN sweeping twice without changes
+    incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+    incremental.sweep(lims, ['cust000-1'], str(tmpdir), lambda samples: u"old\n", TYPES)
+
+    # THEN skipping the case moves on when modifications are looked up from
+    assert lims.queries[0] == ('2016-01-01T00:00:00Z', TYPES)
+    assert lims.queries[1][0] > '2016-01-01T00:00:00Z'
+    # ... and only processes of the types the output is read from count
+    assert lims.queries[1][1] == TYPES
+
+
+def test_sweep_failed(tmpdir):
+    # GIVEN a case which doesn't exist
+    lims = FakeLims({})
+
+    # WHEN sweeping it
+    counts = incremental.sweep(lims, ['cust000-2'], str(tmpdir), lambda samples: u"", TYPES)
+
+    # THEN it's counted as failed and not remembered
+    assert counts['failed'] == 1
+    assert incremental.Fingerprints(
+        str(tmpdir.join(incremental.STATE_FILE))).get('cust000-2') is None
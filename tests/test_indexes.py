@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import random
+
+from cglims import indexes as indexes_module
+from cglims.indexes import LaneIndexes, check_indexes
+
+
+def hamming(first, second):
+    return sum(1 for base, other in zip(first, second) if base != other)
+
+
+def test_distances_match_naive_hamming():
+    # GIVEN random dual indexes
+    random.seed(1)
+    indexes = ['-'.join(''.join(random.choice('ACGTN') for _ in range(8)) for _ in range(2))
+               for _ in range(20)]
+    lane_indexes = LaneIndexes(indexes)
+    # WHEN computing distances per index read
+    for first, second, distances in lane_indexes.pairs():
+        # THEN they are the same as comparing base by base
+        expected = tuple(hamming(read, other) for read, other in
+                         zip(indexes[first].split('-'), indexes[second].split('-')))
+        assert distances == expected
+
+
+def test_check_indexes():
+    # GIVEN a lane with two dual indexes differing by one base in each read
+    rows = [
+        {'lane': 1, 'sample_id': 'ADM1', 'index': 'ACGTACGT-TTTTAAAA'},
+        {'lane': 1, 'sample_id': 'ADM2', 'index': 'ACGTACGA-TTTTAAAC'},
+        {'lane': 2, 'sample_id': 'ADM3', 'index': 'ACGTACGT-TTTTAAAA'},
+        {'lane': 2, 'sample_id': 'ADM4', 'index': 'CATGCATG-GGGGCCCC'},
+    ]
+    # WHEN checking the indexes
+    results = check_indexes(rows)
+    # THEN the close pair is reported with the safe mismatch value
+    assert results[1]['collisions'] == [{'samples': ['ADM1', 'ADM2'],
+                                         'indexes': ['ACGTACGT-TTTTAAAA',
+                                                     'ACGTACGA-TTTTAAAC'],
+                                         'distances': [1, 1]}]
+    assert results[1]['barcode_mismatches'] == 0
+    # ... and distant indexes allow the maximum
+    assert results[2] == {'collisions': [], 'barcode_mismatches': 2}
+
+
+def test_identical_and_missing_indexes():
+    # GIVEN identical indexes and a library missing the second index read
+    rows = [
+        {'lane': 1, 'sample_id': 'ADM1', 'index': 'ACGTACGT-TTTTAAAA'},
+        {'lane': 1, 'sample_id': 'ADM2', 'index': 'ACGTACGT'},
+    ]
+    # WHEN checking the indexes
+    results = check_indexes(rows)
+    # THEN they can't be told apart at all
+    assert results[1]['barcode_mismatches'] is None
+    assert results[1]['collisions'][0]['distances'] == [0, 0]
+
+
+def test_check_indexes_full_plate():
+    # GIVEN a lane with 384 dual indexed libraries
+    random.seed(2)
+    rows = [{'lane': 1, 'sample_id': str(number),
+             'index': '-'.join(''.join(random.choice('ACGT') for _ in range(10))
+                               for _ in range(2))}
+            for number in range(384)]
+    # ... and one library re-using the index of the first
+    rows.append({'lane': 1, 'sample_id': 'duplicate', 'index': rows[0]['index']})
+    # WHEN checking all pairs
+    results = check_indexes(rows)
+    # THEN the re-used index is reported
+    collisions = results[1]['collisions']
+    assert ['0', 'duplicate'] in [collision['samples'] for collision in collisions]
+    assert results[1]['barcode_mismatches'] is None
+
+
+def test_check_indexes_without_numpy(monkeypatch):
+    # GIVEN a lane with close, identical and missing indexes
+    random.seed(3)
+    rows = [{'lane': 1, 'sample_id': str(number),
+             'index': '-'.join(''.join(random.choice('ACGT') for _ in range(4))
+                               for _ in range(2))}
+            for number in range(40)]
+    rows.append({'lane': 1, 'sample_id': 'single', 'index': rows[0]['index'][:4]})
+    expected = check_indexes(rows)
+    assert expected[1]['collisions']
+
+    # WHEN checking them without numpy
+    monkeypatch.setattr(indexes_module, 'numpy', None)
+    # THEN the pairwise fallback finds the same
+    assert check_indexes(rows) == expected
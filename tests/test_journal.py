@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cglims.journal import Journal, output_size, trim_output
+
+
+def test_journal_resume(tmpdir):
+    # GIVEN a journal of a job interrupted while recording a unit
+    path = str(tmpdir.join('export.journal'))
+    journal = Journal(path)
+    journal.record('cust000-1', offset=10)
+    journal.record('cust000-2', offset=25)
+    journal.close()
+    with open(path, 'a') as handle:
+        handle.write('{"unit": "cust0')
+
+    # WHEN resuming the job
+    journal = Journal(path, resume=True)
+
+    # THEN completed units are skipped and the output continues after them
+    assert 'cust000-2' in journal
+    assert 'cust000-3' not in journal
+    assert journal.last('offset') == 25
+
+    # WHEN recording more units and resuming again
+    journal.record('cust000-3', offset=40)
+    journal.record('cust000-4', offset=55)
+    journal.close()
+    journal = Journal(path, resume=True)
+
+    # THEN none of them are lost to the half written entry
+    assert 'cust000-3' in journal
+    assert journal.last('offset') == 55
+    journal.close()
+
+    # WHEN starting over
+    journal = Journal(path)
+
+    # THEN nothing is completed
+    assert journal.completed == {}
+
+
+def test_trim_output(tmpdir):
+    # GIVEN output with half a document after the last completed unit
+    path = tmpdir.join('cases.yaml')
+    path.write('---\ncase: 1\n---\ncas')
+
+    # WHEN trimming it to the last offset
+    with open(str(path), 'ab') as handle:
+        trim_output(handle, 12)
+
+    # THEN the incomplete document is gone
+    assert path.read() == '---\ncase: 1\n'
+
+
+def test_output_size(tmpdir):
+    # GIVEN earlier output in a file and a journal of appending to it
+    path = tmpdir.join('cases.yaml')
+    path.write('---\ncase: 0\n')
+    with open(str(path), 'ab') as handle:
+        start = output_size(handle)
+        handle.write(b'---\ncase: 1\n---\ncas')
+    assert start == 12
+
+    # WHEN trimming it to an offset counted from the start of the file
+    with open(str(path), 'ab') as handle:
+        trim_output(handle, start + 12)
+
+    # THEN the earlier output is kept
+    assert path.read() == '---\ncase: 0\n---\ncase: 1\n'
+
+
+def test_trim_output_overwritten(tmpdir):
+    # GIVEN output redirected with '>' which dropped the earlier cases
+    path = tmpdir.join('cases.yaml')
+    path.write('')
+
+    # WHEN continuing it after the last offset in the journal
+    with open(str(path), 'ab') as handle:
+        # THEN it fails instead of recording offsets the file doesn't match
+        with pytest.raises(ValueError):
+            trim_output(handle, 12)
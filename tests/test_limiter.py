@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cglims.exc import LimsUnavailableError
+from cglims.limiter import AdaptiveLimiter
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_grows_and_shrinks():
+    # GIVEN a limiter starting at 4 concurrent requests
+    limiter = AdaptiveLimiter(initial=4, maximum=6, target_latency=1.)
+    # WHEN many fast requests succeed
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.1, 200)
+    # THEN the limit grows additively up to the maximum
+    assert limiter.stats()['limit'] == 6
+
+    # WHEN the server signals overload
+    limiter.acquire()
+    limiter.release(0.1, 429)
+    # THEN the limit is cut in half
+    assert limiter.stats()['limit'] == 3
+
+    # WHEN a request is slower than the target
+    limiter.acquire()
+    limiter.release(5., 200)
+    # THEN the limit is cut again
+    assert limiter.stats()['limit'] == 1
+    assert limiter.stats()['slow'] == 1
+
+
+def test_circuit_breaker():
+    # GIVEN a limiter opening after 2 consecutive failures
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(failure_threshold=2, cooldown=10, clock=clock)
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(0.1, 503)
+
+    # THEN requests fail fast while the circuit is open
+    with pytest.raises(LimsUnavailableError):
+        limiter.acquire()
+    assert limiter.stats()['circuit'] == 'open'
+
+    # WHEN the cool down has passed and the probe succeeds
+    clock.now = 11
+    limiter.acquire()
+    limiter.release(0.1, 200)
+    # THEN the circuit closes again
+    assert limiter.stats()['circuit'] == 'closed'
+    assert limiter.stats()['rejected'] == 1
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+
+import requests
+from requests.adapters import BaseAdapter
+from six import BytesIO
+from six.moves.urllib.parse import parse_qs, urlsplit
+
+from cglims import store
+from cglims.api import ClinicalLims
+from cglims.export import export_case
+from cglims.prefetch import prefetch_samples, source_samples
+
+BASE = 'http://lims/api/v2'
+NAMESPACES = ('xmlns:smp="http://genologics.com/ri/sample" '
+              'xmlns:art="http://genologics.com/ri/artifact" '
+              'xmlns:prc="http://genologics.com/ri/process" '
+              'xmlns:ptp="http://genologics.com/ri/processtype" '
+              'xmlns:prj="http://genologics.com/ri/project" '
+              'xmlns:ri="http://genologics.com/ri" '
+              'xmlns:udf="http://genologics.com/ri/userdefined"')
+PROCESS_TYPES = {'33': 'CG002 - Hybridize Library', '159': 'CG002 - Delivery',
+                 '663': 'CG002 - Cluster Generation', '664': 'CG002 - Cluster Generation SBS',
+                 '667': 'CG002 - PCR Free Library Prep', '669': 'CG002 - Hybridize Library SS',
+                 '670': 'CG002 - Illumina Sequencing', '671': 'CG002 - Illumina SBS',
+                 '8': 'CG002 - Reception Control'}
+
+
+def udfs(fields):
+    return ''.join('<udf:field name="{}" type="{}">{}</udf:field>'
+                   .format(name, 'Date' if name.startswith(('date', 'Date')) else 'String',
+                           value) for name, value in sorted(fields.items()))
+
+
+class FakeLimsAdapter(BaseAdapter):
+
+    """Answer LIMS requests about a case with two samples, recording them."""
+
+    def __init__(self):
+        super(FakeLimsAdapter, self).__init__()
+        self.requests = []
+        sample_udfs = {'customer': 'cust003', 'familyID': 'F1', 'Gene List': 'OMIM',
+                       'Status': 'Affected', 'Data Analysis': 'scout',
+                       'Sequencing Analysis': 'WGSPCFC030'}
+        self.samples = {sample_id: sample_udfs for sample_id in ('ADM1', 'ADM2')}
+        # process: (type id, date run, UDFs)
+        self.processes = {
+            '24-1': ('8', None, {'date arrived at clinical genomics': '2017-01-02'}),
+            '24-2': ('670', '2017-01-05', {}),
+            '24-3': ('159', '2017-01-12', {'Date delivered': '2017-01-11',
+                                           'Method Document': '1234', 'Method Version': '2'}),
+        }
+        # artifact: (process id, type, sample ids)
+        self.artifacts = {
+            '2-1': ('24-1', 'Analyte', ['ADM1']), '2-2': ('24-1', 'Analyte', ['ADM2']),
+            '2-3': ('24-2', 'ResultFile', ['ADM1']), '2-4': ('24-2', 'ResultFile', ['ADM2']),
+            '2-5': ('24-3', 'Analyte', ['ADM1']),
+        }
+
+    def entity(self, kind, entity_id):
+        if kind == 'samples':
+            return ('<smp:sample {ns} uri="{base}/samples/{id}" limsid="{id}"><name>{id}</name>'
+                    '<project uri="{base}/projects/ADM" limsid="ADM"/>{udf}</smp:sample>'
+                    ).format(ns=NAMESPACES, base=BASE, id=entity_id,
+                             udf=udfs(self.samples[entity_id]))
+        elif kind == 'projects':
+            return ('<prj:project {} uri="{}/projects/ADM" limsid="ADM"><name>Project</name>'
+                    '</prj:project>').format(NAMESPACES, BASE)
+        elif kind == 'processtypes':
+            return ('<ptp:process-type {} uri="{}/processtypes/{}" name="{}"/>'
+                    .format(NAMESPACES, BASE, entity_id, PROCESS_TYPES[entity_id]))
+        elif kind == 'processes':
+            type_id, date_run, fields = self.processes[entity_id]
+            return ('<prc:process {ns} uri="{base}/processes/{id}" limsid="{id}">'
+                    '<type uri="{base}/processtypes/{type_id}">{name}</type>{date_run}{udf}'
+                    '</prc:process>').format(
+                        ns=NAMESPACES, base=BASE, id=entity_id, type_id=type_id,
+                        name=PROCESS_TYPES[type_id], udf=udfs(fields),
+                        date_run='<date-run>{}</date-run>'.format(date_run) if date_run else '')
+        process_id, artifact_type, sample_ids = self.artifacts[entity_id]
+        return ('<art:artifact {ns} uri="{base}/artifacts/{id}" limsid="{id}">'
+                '<type>{type}</type><parent-process uri="{base}/processes/{process}" '
+                'limsid="{process}"/>{samples}</art:artifact>').format(
+                    ns=NAMESPACES, base=BASE, id=entity_id, type=artifact_type,
+                    process=process_id, samples=''.join(
+                        '<sample uri="{}/samples/{}" limsid="{}"/>'.format(BASE, sample_id,
+                                                                           sample_id)
+                        for sample_id in sample_ids))
+
+    def query(self, kind, params):
+        if kind == 'samples':
+            matches = [sample_id for sample_id, fields in sorted(self.samples.items())
+                       if all(fields.get(key[len('udf.'):]) in values
+                              for key, values in params.items())]
+        else:
+            matches = []
+            for artifact_id, (process_id, artifact_type, sample_ids) in sorted(
+                    self.artifacts.items()):
+                process_type = PROCESS_TYPES[self.processes[process_id][0]]
+                if (set(sample_ids).intersection(params.get('samplelimsid', sample_ids)) and
+                        process_type in params.get('process-type', [process_type]) and
+                        artifact_type in params.get('type', [artifact_type])):
+                    matches.append(artifact_id)
+        tag = 'smp:samples' if kind == 'samples' else 'art:artifacts'
+        return '<{tag} {ns}>{links}</{tag}>'.format(tag=tag, ns=NAMESPACES, links=''.join(
+            '<{} uri="{}/{}/{}" limsid="{}"/>'.format(kind[:-1], BASE, kind, entity_id,
+                                                      entity_id) for entity_id in matches))
+
+    def send(self, request, **kwargs):
+        self.requests.append(request.url)
+        parts = urlsplit(request.url)
+        segments = parts.path.strip('/').split('/')[2:]
+        if segments[-1] == 'retrieve':
+            links = ElementTree.fromstring(request.body)
+            content = '<ri:details {}>{}</ri:details>'.format(NAMESPACES, ''.join(
+                self.entity(segments[0], link.get('uri').rsplit('/', 1)[-1])
+                for link in links))
+        elif len(segments) == 1:
+            content = self.query(segments[0], parse_qs(parts.query))
+        else:
+            content = self.entity(*segments)
+        response = requests.models.Response()
+        response.status_code = 200
+        response.raw = BytesIO(content.encode('utf-8'))
+        response.headers['Content-Type'] = 'application/xml'
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def fake_lims(adapter, store_path, read):
+    lims = ClinicalLims('http://lims', 'user', 'password')
+    lims.request_session.mount('http://', adapter)
+    store.install(lims, store_path, read=read)
+    return lims
+
+
+def test_prefetched_export(tmpdir):
+    # GIVEN a case prefetched into the store
+    store_path = str(tmpdir.join('lims.sqlite3'))
+    lims = fake_lims(FakeLimsAdapter(), store_path, read=False)
+    lims_samples, artifacts = source_samples(lims, 'case', 'cust003-F1')
+    pool = ThreadPool(2)
+    try:
+        prefetch_samples(lims, lims_samples, pool, artifacts=artifacts)
+    finally:
+        pool.terminate()
+
+    # WHEN exporting the case from the store
+    upstream = FakeLimsAdapter()
+    cached_lims = fake_lims(upstream, store_path, read=True)
+    case_data = export_case(cached_lims, cached_lims.case('cust003', 'F1'))
+
+    # THEN nothing is asked from the LIMS
+    assert upstream.requests == []
+    assert [sample['received_at'].isoformat() for sample in case_data['samples']] == [
+        '2017-01-02', '2017-01-02']
+    assert case_data['samples'][0]['delivery_method'] == '1234:2'
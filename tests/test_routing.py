@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from cglims.routing import forget_emitted, new_units, retries, work_units
+from cglims.watch import MAX_RETRIES
+
+
+class FakeProject(object):
+
+    def __init__(self, project_id):
+        self.id = project_id
+
+
+class FakeSample(object):
+
+    def __init__(self, lims_id, udf, project_id='ADM123'):
+        self.id = lims_id
+        self.name = lims_id
+        self.udf = udf
+        self.project = FakeProject(project_id)
+
+
+class FakeLims(object):
+
+    def __init__(self, samples, sequenced):
+        self.samples = samples
+        self.sequenced = sequenced
+
+    def resolve_samples(self, case_ids):
+        results = {}
+        for case_id in case_ids:
+            results[case_id] = [lims_sample for lims_sample in self.samples
+                                if '-'.join([lims_sample.udf.get('customer', ''),
+                                             lims_sample.udf.get('familyID', '')]) == case_id]
+            if not results[case_id]:
+                results[case_id] = ValueError(case_id)
+        return results
+
+    def get_samples(self, projectlimsid):
+        return [lims_sample for lims_sample in self.samples
+                if lims_sample.project.id == projectlimsid]
+
+    def fetch(self, entities):
+        return entities
+
+    def get_process_artifacts(self, sample_ids, type_ids):
+        return {sample_id: ['artifact'] for sample_id in sample_ids
+                if sample_id in self.sequenced}
+
+
+def human(lims_id, family, **udf):
+    udf.update({'customer': 'cust003', 'familyID': family,
+                'Sequencing Analysis': 'WGSPCFC030'})
+    return FakeSample(lims_id, udf)
+
+
+def test_work_units():
+    # GIVEN a sequenced trio with a cancelled sibling, a case waiting for a
+    # sample and microbial samples without a case
+    samples = [
+        human('ADM1', '1'), human('ADM2', '1'), human('ADM3', '1'),
+        human('ADM4', '1', cancelled='yes'),
+        human('ADM5', '2'), human('ADM6', '2'),
+        FakeSample('ADM7', {'customer': 'cust002', 'Sequencing Analysis': 'MWGNXTR003'},
+                   project_id='ADM200'),
+    ]
+    lims = FakeLims(samples, sequenced=['ADM1', 'ADM2', 'ADM3', 'ADM5', 'ADM7'])
+
+    # WHEN building work units for a few changed samples
+    units, unresolved = work_units(lims, [samples[0], samples[4], samples[6]])
+
+    # THEN each case is a unit with all its relevant members
+    trio, duo, microbial = units
+    assert trio['case'] == 'cust003-1'
+    assert trio['pipeline'] == 'mip'
+    assert [sample['id'] for sample in trio['samples']] == ['ADM1', 'ADM2', 'ADM3']
+    assert trio['ready'] is True
+    # ... which isn't ready while samples are waiting to be sequenced
+    assert duo['ready'] is False
+    assert duo['waiting_for'] == ['ADM6']
+    # ... and samples without a case are grouped by project
+    assert microbial['project'] == 'ADM200'
+    assert microbial['pipeline'] == 'mwgs'
+    assert microbial['ready'] is True
+
+
+def test_work_units_unresolved():
+    # GIVEN a case to retry which can't be resolved
+    lims = FakeLims([human('ADM1', '1')], sequenced=['ADM1'])
+
+    # WHEN building work units
+    units, unresolved = work_units(lims, [], case_ids=['cust003-9'])
+
+    # THEN it's reported to retry later
+    assert units == []
+    assert unresolved == ['cust003-9']
+
+
+def test_new_units():
+    # GIVEN a ready case which was emitted before
+    samples = [human('ADM1', '1'), human('ADM2', '1')]
+    lims = FakeLims(samples, sequenced=['ADM1', 'ADM2'])
+    units, unresolved = work_units(lims, samples[:1])
+    emitted = {}
+    assert new_units(units, emitted, '2017-01-01T00:00:00Z') == units
+
+    # WHEN the case shows up again
+    units, unresolved = work_units(lims, samples[1:])
+    # THEN it isn't emitted again
+    assert new_units(units, emitted, '2017-01-02T00:00:00Z') == []
+
+    # WHEN a sample is added to the case
+    lims.samples.append(human('ADM3', '1'))
+    lims.sequenced.append('ADM3')
+    units, unresolved = work_units(lims, samples[:1])
+    # THEN it's emitted again
+    assert new_units(units, emitted, '2017-01-03T00:00:00Z') == units
+    assert emitted == {'case:cust003-1:mip': {'samples': ['ADM1', 'ADM2', 'ADM3'],
+                                              'seen_at': '2017-01-03T00:00:00Z'}}
+
+
+def test_forget_emitted():
+    # GIVEN units last seen at different times
+    emitted = {'case:cust003-1:mip': {'samples': ['ADM1'], 'seen_at': '2017-01-01T00:00:00Z'},
+               'case:cust003-2:mip': {'samples': ['ADM2'], 'seen_at': '2017-02-01T00:00:00Z'}}
+
+    # WHEN forgetting what wasn't seen within the retention window
+    kept = forget_emitted(emitted, '2017-01-15T00:00:00Z')
+
+    # THEN only the recent unit is remembered
+    assert list(kept) == ['case:cust003-2:mip']
+
+
+def test_retries():
+    # GIVEN a case which failed before and a new failure
+    failed = {'cust003-1': 1, 'cust003-2': MAX_RETRIES - 1}
+
+    # WHEN both fail again
+    attempts = retries(failed, ['cust003-1', 'cust003-2', 'cust003-3'])
+
+    # THEN they are retried until giving up
+    assert attempts == {'cust003-1': 2, 'cust003-3': 1}
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from cglims.samplesheet import SamplesheetCache, cached_samplesheet, serialize
+
+ROW = {'fcid': 'FC1', 'lane': 1, 'sample_id': 'ADM1', 'sample_ref': 'hg19',
+       'index': 'ACGTACGT', 'description': '', 'sample_name': 'P1', 'control': 'N',
+       'recipe': 'R1', 'operator': 'script', 'project': 'P1'}
+
+
+class FlowcellLims(object):
+
+    """Answer samplesheet requests, counting how often it's rendered."""
+
+    def __init__(self):
+        self.rendered = 0
+        self.modified = []
+
+    def samplesheet(self, flowcell):
+        self.rendered += 1
+        return iter([ROW])
+
+    def get_containers(self, name=None, last_modified=None):
+        return self.modified
+
+
+def test_cached_samplesheet(tmpdir):
+    # GIVEN a cache and a flowcell rendered once
+    cache = SamplesheetCache(str(tmpdir))
+    lims = FlowcellLims()
+    assert cached_samplesheet(lims, cache, 'FC1') == [ROW]
+
+    # WHEN the flowcell hasn't been modified since
+    rows = cached_samplesheet(lims, cache, 'FC1')
+    # THEN the cached samplesheet is used
+    assert rows == [ROW]
+    assert lims.rendered == 1
+
+    # WHEN the flowcell container has been modified
+    lims.modified = ['container']
+    cached_samplesheet(lims, cache, 'FC1')
+    # THEN the samplesheet is rendered again
+    assert lims.rendered == 2
+
+
+def test_cached_samplesheet_invalid_flowcell(tmpdir):
+    # GIVEN a cache in a directory
+    cache = SamplesheetCache(str(tmpdir.join('cache')))
+    # WHEN the flowcell name would point outside it
+    # THEN it's rejected before anything is written
+    with pytest.raises(ValueError):
+        cached_samplesheet(FlowcellLims(), cache, '../FC1')
+    assert tmpdir.listdir() == []
+
+
+def test_serialize():
+    # GIVEN a samplesheet row
+    # WHEN serializing it
+    content = serialize([ROW])
+    # THEN it should be a CSV samplesheet with a header
+    assert content.split('\n')[:2] == [
+        'FCID,Lane,SampleID,SampleRef,Index,Description,Control,Recipe,Operator,SampleProject',
+        'FC1,1,ADM1,hg19,ACGTACGT,,N,R1,script,P1']
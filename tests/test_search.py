@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import requests
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+from cglims.search import find
+from cglims.store import CachingAdapter, EntityStore
+
+BASE = 'http://lims/api/v2/samples/'
+
+
+def sample_xml(lims_id, name, customer='cust003', cgid=None):
+    cgid_udf = ('<udf:field name="Clinical Genomics ID">{}</udf:field>'.format(cgid)
+                if cgid else '')
+    return ('<smp:sample xmlns:smp="http://genologics.com/ri/sample" '
+            'xmlns:udf="http://genologics.com/ri/userdefined" limsid="{}">'
+            '<name>{}</name><udf:field name="customer">{}</udf:field>{}</smp:sample>'
+            ).format(lims_id, name, customer, cgid_udf).encode('utf-8')
+
+
+def matches(entity_store, query, **kwargs):
+    return [(match['sample_id'], match['match'])
+            for match in find(entity_store, query, **kwargs)]
+
+
+def test_find(tmpdir):
+    # GIVEN a store with a few samples
+    entity_store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    entity_store.set_many([
+        (BASE + 'ADM1', sample_xml('ADM1', 'Patient-17', cgid='1604219')),
+        (BASE + 'ADM2', sample_xml('ADM2', 'Patient-170')),
+        (BASE + 'ADM3', sample_xml('ADM3', 'Control-17', customer='cust004')),
+    ])
+
+    # THEN samples are found by exact and partial names, best match first
+    assert matches(entity_store, 'patient-17') == [('ADM1', 'exact'), ('ADM2', 'prefix')]
+    assert matches(entity_store, 'ntrol') == [('ADM3', 'substring')]
+    assert matches(entity_store, 'Pateint-170')[0] == ('ADM2', 'fuzzy')
+    assert matches(entity_store, '1604219') == [('ADM1', 'exact')]
+    # ... by LIMS id
+    assert matches(entity_store, 'adm3') == [('ADM3', 'exact')]
+    # ... and by customer
+    assert matches(entity_store, 'ntrol', customer='cust003') == []
+    assert matches(entity_store, 'cust004') == [('ADM3', 'exact')]
+
+
+def test_find_customer(tmpdir):
+    # GIVEN samples of two customers, one of them misspelled
+    entity_store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    entity_store.set_many([
+        (BASE + 'ADM1', sample_xml('ADM1', 'patient-1', customer='cust001')),
+        (BASE + 'ADM2', sample_xml('ADM2', 'Pateint')),
+    ])
+
+    # WHEN searching the samples of the customer with the misspelled one
+    # THEN the better match of the other customer doesn't hide it
+    assert matches(entity_store, 'patient', customer='cust003') == [('ADM2', 'fuzzy')]
+    assert matches(entity_store, 'ent-', customer='cust003') == []
+    assert matches(entity_store, 'ient-', customer='cust001') == [('ADM1', 'substring')]
+
+
+def test_find_deleted(tmpdir):
+    # GIVEN an indexed sample
+    entity_store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    entity_store.set(BASE + 'ADM1', sample_xml('ADM1', 'Lisa'))
+
+    # WHEN the sample is deleted
+    entity_store.delete(BASE + 'ADM1')
+
+    # THEN it's no longer found
+    assert matches(entity_store, 'Lisa') == []
+
+
+def test_index_current(tmpdir):
+    # GIVEN an indexed sample
+    entity_store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    entity_store.set(BASE + 'ADM1', sample_xml('ADM1', 'Lisa'))
+
+    # WHEN the sample is fetched again after being renamed
+    entity_store.set(BASE + 'ADM1', sample_xml('ADM1', 'Petra'))
+
+    # THEN only the new name is found
+    assert matches(entity_store, 'Lisa') == []
+    assert matches(entity_store, 'Petra') == [('ADM1', 'exact')]
+
+    # WHEN rebuilding the index
+    entity_store.reindex()
+
+    # THEN the sample is still found
+    assert matches(entity_store, 'Petra') == [('ADM1', 'exact')]
+
+
+class EchoAdapter(BaseAdapter):
+
+    """Answer updates with the entity that was sent, like the LIMS."""
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.status_code = 200
+        response._content = request.body
+        return response
+
+    def close(self):
+        pass
+
+
+def test_index_updated(tmpdir):
+    # GIVEN an indexed sample cached by a session
+    entity_store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    entity_store.set(BASE + 'ADM1', sample_xml('ADM1', 'Lisa'))
+    session = requests.Session()
+    session.mount('http://', CachingAdapter(entity_store, EchoAdapter()))
+
+    # WHEN renaming the sample in the LIMS
+    session.put(BASE + 'ADM1', data=sample_xml('ADM1', 'Petra'))
+
+    # THEN it's found by the new name without fetching it again
+    assert matches(entity_store, 'Lisa') == []
+    assert matches(entity_store, 'Petra') == [('ADM1', 'exact')]
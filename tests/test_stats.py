@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from cglims import stats as stats_module
+from cglims.stats import backlog, build_table, turnaround, volume
+from cglims.store import EntityStore
+
+BASE = 'http://lims/api/v2'
+UDF = 'xmlns:udf="http://genologics.com/ri/userdefined"'
+
+
+def sample_xml(lims_id, received, cancelled='no'):
+    return ('<smp:sample xmlns:smp="http://genologics.com/ri/sample" {udf} limsid="{id}">'
+            '<name>{id}</name><date-received>{received}</date-received>'
+            '<udf:field name="customer">cust003</udf:field>'
+            '<udf:field name="Sequencing Analysis">WGSPCFC030</udf:field>'
+            '<udf:field name="cancelled">{cancelled}</udf:field>'
+            '</smp:sample>').format(udf=UDF, id=lims_id, received=received,
+                                    cancelled=cancelled).encode('utf-8')
+
+
+def process_xml(process_id, type_id, date_run, delivered=None, arrived=None,
+                type_name='type'):
+    udf = ''.join('<udf:field name="{}">{}</udf:field>'.format(name, value)
+                  for name, value in [('Date delivered', delivered),
+                                      ('date arrived at clinical genomics', arrived)]
+                  if value)
+    return ('<prc:process xmlns:prc="http://genologics.com/ri/process" {udf_ns} '
+            'limsid="{id}"><type uri="{base}/processtypes/{type_id}">{type_name}</type>'
+            '<date-run>{date_run}</date-run>{udf}</prc:process>'
+            ).format(udf_ns=UDF, id=process_id, base=BASE, type_id=type_id,
+                     type_name=type_name, date_run=date_run, udf=udf).encode('utf-8')
+
+
+def artifact_xml(artifact_id, process_id, sample_id):
+    return ('<art:artifact xmlns:art="http://genologics.com/ri/artifact" limsid="{id}">'
+            '<parent-process uri="{base}/processes/{process}" limsid="{process}"/>'
+            '<sample uri="{base}/samples/{sample}" limsid="{sample}"/></art:artifact>'
+            ).format(id=artifact_id, base=BASE, process=process_id,
+                     sample=sample_id).encode('utf-8')
+
+
+def test_stats(tmpdir):
+    # GIVEN a store with a delivered, a sequenced and a cancelled sample,
+    # registered before they arrived
+    entity_store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    entity_store.set_many([
+        (BASE + '/samples/ADM1', sample_xml('ADM1', '2016-12-20')),
+        (BASE + '/samples/ADM2', sample_xml('ADM2', '2016-12-20')),
+        (BASE + '/samples/ADM3', sample_xml('ADM3', '2016-12-20', cancelled='yes')),
+        (BASE + '/processes/24-0', process_xml('24-0', '8', '2017-01-03', arrived='2017-01-01',
+                                               type_name='CG002 - Reception Control')),
+        (BASE + '/processes/24-3', process_xml('24-3', '8', '2017-01-03', arrived='2017-01-03',
+                                               type_name='CG002 - Reception Control')),
+        (BASE + '/artifacts/2-4', artifact_xml('2-4', '24-0', 'ADM1')),
+        (BASE + '/artifacts/2-5', artifact_xml('2-5', '24-3', 'ADM2')),
+        (BASE + '/artifacts/2-6', artifact_xml('2-6', '24-3', 'ADM3')),
+        (BASE + '/processes/24-1', process_xml('24-1', '670', '2017-01-05')),
+        (BASE + '/processes/24-2', process_xml('24-2', '159', '2017-01-12',
+                                               delivered='2017-01-11')),
+        (BASE + '/artifacts/2-1?state=1', artifact_xml('2-1', '24-1', 'ADM1')),
+        (BASE + '/artifacts/2-2', artifact_xml('2-2', '24-1', 'ADM2')),
+        (BASE + '/artifacts/2-3', artifact_xml('2-3', '24-2', 'ADM1')),
+    ])
+
+    # WHEN condensing it into a table
+    table = build_table(entity_store)
+
+    # THEN each sample gets its status and dates
+    statuses = dict(zip(table['sample_id'], table['status']))
+    assert statuses == {'ADM1': 'delivered', 'ADM2': 'sequenced', 'ADM3': 'cancelled'}
+    # ... received when they arrived, like export reports it
+    assert set(table['month']) == {'2017-01'}
+
+    # ... and reports are grouped
+    assert volume(table, 'customer')[0]['samples'] == 3
+    turnaround_row = turnaround(table, 'category')[0]
+    assert turnaround_row['samples'] == 2
+    assert turnaround_row['to_sequenced_mean'] == 3.0
+    assert turnaround_row['total_median'] == 10
+    backlog_row = backlog(table, 'month', today=date(2017, 1, 13))[0]
+    assert backlog_row['month'] == '2017-01'
+    assert backlog_row['sequenced'] == 1
+    assert backlog_row['waiting_max'] == 10
+
+
+def test_stats_without_numpy(tmpdir, monkeypatch):
+    # GIVEN numpy isn't installed
+    monkeypatch.setattr(stats_module, 'numpy', None)
+
+    # THEN the same reports are computed over lists
+    test_stats(tmpdir)
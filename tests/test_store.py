@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import requests
+
+from cglims.store import CachingAdapter, EntityStore, uri_kind
+
+
+def test_uri_kind():
+    # GIVEN URLs to entities and list queries
+    # THEN entities are classified by type
+    assert uri_kind('http://lims/api/v2/samples/ADM1') == 'samples'
+    assert uri_kind('http://lims/api/v2/processtypes/33') == 'processtypes'
+    assert uri_kind('http://lims/api/v2/artifacts/2-1?state=10') == 'artifacts'
+    assert uri_kind('http://lims/api/v2/samples?name=A') == 'query'
+    assert uri_kind('http://lims/api/v2/samples') == 'query'
+
+
+def test_store_ttl(tmpdir):
+    # GIVEN a stored response
+    store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    store.set('http://lims/api/v2/samples/ADM1', b'<sample/>')
+
+    # THEN it's served while fresh
+    assert store.get('http://lims/api/v2/samples/ADM1') == b'<sample/>'
+    assert store.kind_counts() == {'samples': 1}
+    # ... but not once it has expired
+    store.ttl = -1
+    assert store.get('http://lims/api/v2/samples/ADM1') is None
+
+
+def test_caching_adapter(tmpdir, counting_adapter):
+    # GIVEN a session caching responses in a store
+    store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    upstream = counting_adapter
+    session = requests.Session()
+    session.mount('http://', CachingAdapter(store, upstream))
+
+    # WHEN getting the same entity twice
+    first = session.get('http://lims/api/v2/samples/ADM1').text
+    second = session.get('http://lims/api/v2/samples/ADM1').text
+
+    # THEN the second answer comes from the store
+    assert first == second == '<count>1</count>'
+    assert store.stats == {'hits': 1, 'misses': 1}
+
+    # WHEN updating the entity
+    session.put('http://lims/api/v2/samples/ADM1', data='<sample/>')
+
+    # THEN the updated entity the LIMS answers with is stored
+    assert session.get('http://lims/api/v2/samples/ADM1').text == '<count>2</count>'
+    assert upstream.count == 2
+
+    # WHEN deleting the entity
+    session.delete('http://lims/api/v2/samples/ADM1')
+
+    # THEN it's fetched again the next time
+    assert session.get('http://lims/api/v2/samples/ADM1').text == '<count>4</count>'
+
+
+def test_caching_adapter_invalidates_queries(tmpdir, counting_adapter):
+    # GIVEN a cached list query and a cached entity
+    store = EntityStore(str(tmpdir.join('lims.sqlite3')))
+    session = requests.Session()
+    session.mount('http://', CachingAdapter(store, counting_adapter))
+    query = 'http://lims/api/v2/samples?projectlimsid=ADM1'
+    session.get(query)
+    session.get('http://lims/api/v2/projects/ADM1')
+
+    # WHEN batch retrieving entities
+    session.post('http://lims/api/v2/samples/batch/retrieve', data='<links/>')
+    # THEN nothing is invalidated
+    assert store.kind_counts() == {'query': 1, 'projects': 1}
+
+    # WHEN updating a batch of other entities
+    session.post('http://lims/api/v2/samples/batch/update', data='<details/>')
+    # THEN list queries are fetched again, entities are kept
+    assert store.kind_counts() == {'projects': 1}
+    assert session.get(query).text == '<count>5</count>'
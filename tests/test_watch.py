@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+
+from genologics.entities import Process
+
+from cglims.watch import MAX_RETRIES, Watermark, poll
+
+
+class FakeLims(object):
+
+    """List and serve processes with a revision bumped on every change."""
+
+    def __init__(self, revisions):
+        self.revisions = revisions
+        self.listed = list(revisions)
+        self.cache = {}
+        self.queries = []
+
+    def get_uri(self, *segments):
+        return 'http://lims/api/v2/' + '/'.join(segments)
+
+    def get(self, uri):
+        process_id = uri.rsplit('/', 1)[-1]
+        return ElementTree.Element('process', {'limsid': process_id,
+                                               'revision': self.revisions[process_id]})
+
+    def get_processes(self, type=None, last_modified=None):
+        self.queries.append((type, last_modified))
+        return [Process(self, id=process_id) for process_id in self.listed]
+
+
+def poll_with(lims_api, state, handle):
+    pool = ThreadPool(2)
+    try:
+        return poll(lims_api, ['CG002 - Reception Control'], state, pool, handle)
+    finally:
+        pool.terminate()
+
+
+def test_poll_moves_watermark():
+    # GIVEN two modified processes
+    lims_api = FakeLims({'24-1': '1', '24-2': '1'})
+    handled = []
+
+    # WHEN polling
+    state = poll_with(lims_api, {'since': '2016-01-01T00:00:00Z'},
+                      lambda lims_process: handled.append(lims_process.id))
+
+    # THEN both are handled and the watermark moves on
+    assert sorted(handled) == ['24-1', '24-2']
+    assert lims_api.queries == [(['CG002 - Reception Control'], '2016-01-01T00:00:00Z')]
+    assert state['since'] > '2016-01-01T00:00:00Z'
+    assert sorted(state['handled']) == ['24-1', '24-2']
+
+
+def test_poll_skips_handled_processes():
+    # GIVEN a poll which handled two processes
+    lims_api = FakeLims({'24-1': '1', '24-2': '1'})
+    handled = []
+    state = poll_with(lims_api, {'since': '2016-01-01T00:00:00Z'},
+                      lambda lims_process: handled.append(lims_process.id))
+
+    # WHEN they are listed again as the polls overlap, one of them changed
+    lims_api.revisions['24-2'] = '2'
+    state = poll_with(lims_api, state, lambda lims_process: handled.append(lims_process.id))
+
+    # THEN only the changed process is handled again
+    assert sorted(handled) == ['24-1', '24-2', '24-2']
+
+    # WHEN the processes are no longer listed
+    lims_api.listed = []
+    state = poll_with(lims_api, state, lambda lims_process: handled.append(lims_process.id))
+    # THEN they are forgotten
+    assert state['handled'] == {}
+
+
+def test_poll_retries_failures():
+    # GIVEN a process which keeps failing and one which works
+    lims_api = FakeLims({'24-1': '1', '24-2': '1'})
+    attempts = []
+
+    def handle(lims_process):
+        attempts.append(lims_process.id)
+        if lims_process.id == '24-1':
+            raise ValueError('LIMS hiccup')
+
+    # WHEN polling
+    state = poll_with(lims_api, {'since': '2016-01-01T00:00:00Z'}, handle)
+
+    # THEN the watermark moves on anyway and the failure is kept to retry
+    assert state['since'] > '2016-01-01T00:00:00Z'
+    assert state['failed'] == {'24-1': 1}
+
+    # WHEN polling again after the process has dropped out of the listing
+    lims_api.listed = []
+    for _ in range(MAX_RETRIES):
+        state = poll_with(lims_api, state, handle)
+
+    # THEN it's retried until giving up on it
+    assert attempts.count('24-1') == MAX_RETRIES
+    assert attempts.count('24-2') == 1
+    assert state['failed'] == {}
+
+
+def test_watermark(tmpdir):
+    # GIVEN a watermark not yet stored
+    watermark = Watermark(str(tmpdir.join('state', 'watch.json')))
+    assert watermark.load() == {}
+
+    # WHEN storing a timestamp and what was handled
+    watermark.save({'since': '2016-01-02T00:00:00Z', 'handled': {'24-1': 'abc'}})
+
+    # THEN both survive a restart
+    assert Watermark(watermark.path).load() == {'since': '2016-01-02T00:00:00Z',
+                                                'handled': {'24-1': 'abc'}}